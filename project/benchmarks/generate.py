@@ -0,0 +1,152 @@
+"""
+Deterministic generator of benchmark datasets
+
+Usage:
+    python -m benchmarks.generate --clients 100000 --versements 2000000 --seed 42
+
+The same seed always produces the same rows, so timings of different runs
+are measured against identical data. The database must not hold any client
+or versement yet.
+"""
+
+import argparse
+import datetime
+import random
+import sys
+import time
+
+from config import FIELD_OPTIONS
+from models.client import Client
+from models.database import execute_query, transaction
+from models.schema import create_schema
+from models.versement import Versement
+
+SURNAMES = [
+    "HAMANA", "BOUCHIBANE", "BOUCHAREB", "RAHIM", "HAMITOUCHE", "GUETTOU", "BENALI", "MEZIANE",
+    "BOUDIAF", "KACI", "AOUDIA", "CHERIFI", "DJEBBAR", "FERHAT", "GHARBI", "HADDAD",
+    "IDIR", "KHELIFI", "LOUNIS", "MANSOURI", "NACERI", "OUALI", "SAIDI", "TAHRI",
+    "YAHIAOUI", "ZERROUKI", "BELKACEM", "AMRANI", "SLIMANI", "TOUATI",
+]
+SURNAME_PREFIXES = ["", "", "", "BEN ", "AIT ", "OULD "]
+FIRST_NAMES = [
+    "HASSINA", "ABDERRAHMANE", "DJAMEL", "SAID", "ABDELDJALIL", "SOUMIA", "MERIEM", "RAZIKA",
+    "KARIM", "NADIA", "SAMIR", "LYNDA", "MOHAMED", "FATIMA", "YACINE", "AMINA",
+    "RACHID", "SAMIRA", "MOURAD", "NASSIMA", "FARID", "SALIMA", "HAKIM", "DALILA",
+]
+ACTIVITIES = [
+    "PHARMACIE", "Grossisste Parapharmacie", "Grossisste Produits Veterinaires", "ETB/TCE",
+    "FELLAH-alement de betail", "BOULANGERIE", "TRANSPORT DE MARCHANDISES", "COMMERCE DE DETAIL",
+    "CABINET MEDICAL", "QUINCAILLERIE", "RESTAURATION", "AGENCE DE VOYAGES",
+]
+AGENTS = ["MERIEM", "RAZIKA", ""]
+PAYMENT_MODES = ["MENSUEL", "TRIMESTRE", "ANNUEL", ""]
+CLIENT_TYPES = ["PERSONNE PHYSIQUE", "PERSONNE MORALE"]
+VERSEMENT_TYPES = ["Espèces", "Chèque", "Virement", "CCP"]
+
+FIRST_DATE = datetime.date(2018, 1, 1)
+DATE_RANGE_DAYS = 8 * 365
+
+
+def generate_client(rng):
+    """Return a random client"""
+    nom = rng.choice(SURNAME_PREFIXES) + rng.choice(SURNAMES)
+    honoraires = rng.choice([0, 2000, 3000, 5000, 8000, 10000, 15000, 20000, 36000, 42000])
+    return Client(
+        nom=nom,
+        prenom=rng.choice(FIRST_NAMES),
+        activite=rng.choice(ACTIVITIES),
+        phone="0" + "".join(rng.choice("0123456789") for _ in range(9)),
+        email=f"{nom.lower().replace(' ', '')}{rng.randrange(1000)}@example.dz",
+        address=f"{rng.randrange(1, 200)} rue {rng.choice(SURNAMES).title()}",
+        montant=honoraires * rng.randrange(12, 60),
+        type=rng.choice(CLIENT_TYPES),
+        regime_fiscal=rng.choice(FIELD_OPTIONS['regime_fiscal']),
+        agent_responsable=rng.choice(AGENTS),
+        forme_juridique=rng.choice(FIELD_OPTIONS['forme_juridique']),
+        regime_cnas=rng.choice(FIELD_OPTIONS['regime_cnas']),
+        mode_paiement=rng.choice(PAYMENT_MODES),
+        honoraires_mois=honoraires
+    )
+
+
+def generate_versement(rng, client_ids):
+    """Return a random versement of one of the given clients"""
+    # Square the draw so a minority of clients holds most payments
+    client_id = client_ids[int(len(client_ids) * rng.random() ** 2)]
+    date_paiement = FIRST_DATE + datetime.timedelta(days=rng.randrange(DATE_RANGE_DAYS))
+    return Versement(
+        client_id=client_id,
+        montant=rng.randrange(1, 500) * 100,
+        type=rng.choice(VERSEMENT_TYPES),
+        date_paiement=date_paiement,
+        annee_concernee=date_paiement.year - rng.choice([0, 0, 0, 1])
+    )
+
+
+def _insert_batches(rng, count, build, insert, batch_size, label):
+    """Insert count generated rows, one transaction per batch"""
+    started = time.perf_counter()
+    done = 0
+    while done < count:
+        batch = [build(rng) for _ in range(min(batch_size, count - done))]
+        with transaction():
+            insert(batch)
+        done += len(batch)
+        print(f"\r{label}: {done}/{count}", end="", flush=True)
+    print(f" ({time.perf_counter() - started:.1f} s)")
+
+
+def generate(clients=100000, versements=2000000, seed=42, batch_size=5000):
+    """
+    Fill an empty database with a synthetic dataset
+
+    Args:
+        clients (int): Number of clients to insert
+        versements (int): Number of versements to insert
+        seed (int): Seed of the random generator
+        batch_size (int): Rows inserted per transaction
+
+    Raises:
+        ValueError: If the database already holds clients or versements
+    """
+    rng = random.Random(seed)
+    create_schema()
+
+    # Existing rows would change the dataset the seed stands for
+    for table in ('clients', 'versement'):
+        if execute_query(f"SELECT 1 FROM {table} LIMIT 1", fetch_one=True):
+            raise ValueError(f"La table {table} n'est pas vide; utilisez une base de données vierge")
+
+    _insert_batches(rng, clients, generate_client, Client.insert_many, batch_size, "Clients")
+
+    # The table was empty, so these are the clients generated above
+    rows = execute_query("SELECT id FROM clients ORDER BY id", fetch_all=True)
+    client_ids = [row['id'] for row in rows]
+    if not client_ids:
+        return
+
+    _insert_batches(
+        rng, versements,
+        lambda rng: generate_versement(rng, client_ids),
+        Versement.insert_many, batch_size, "Versements"
+    )
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Génère un jeu de données de test")
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--versements', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args(argv)
+    try:
+        generate(args.clients, args.versements, args.seed, args.batch_size)
+    except ValueError as e:
+        print(f"Erreur: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Time the model and controller operations against the configured database
+
+Usage:
+    python -m benchmarks.run                         Print the timings
+    python -m benchmarks.run --output run.json       Also save them as JSON
+    python -m benchmarks.run --baseline base.json    Compare with a saved run
+    python -m benchmarks.run --baseline base.json --save-baseline
+    python -m benchmarks.run --no-prepared --pure   Without prepared statements
+                                                     and the C extension
+
+Run ``python -m benchmarks.generate`` first to create a dataset. The
+payments created by the benchmark are deleted again before it exits.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import sys
+import time
+
+from config import DB_CONFIG
+from controllers.client_controller import ClientController
+from controllers.versement_controller import VersementController
+from models.client import Client, client_directory
+from models.database import execute_query
+from models.versement import Versement
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Type of the payments created by the benchmark, used to clean them up
+BENCHMARK_TYPE = "BENCHMARK"
+
+SEARCH_TERMS = ["HAMANA", "PHARMACIE", "BEN SAIDI", "MERIEM", "SARL", "BOULANGERIE", "KARIM"]
+
+
+def percentile(durations, fraction):
+    """Return the nearest-rank percentile of a list of durations"""
+    ordered = sorted(durations)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def measure(func, runs):
+    """
+    Call func runs times after one warm-up call
+
+    Returns:
+        dict: Number of runs, p50/p95 latency in ms, client CPU time per call
+            in ms and calls per second
+    """
+    func()
+    durations = []
+    cpu_started = time.process_time()
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    cpu = time.process_time() - cpu_started
+    total = sum(durations)
+    return {
+        'runs': runs,
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 3),
+        'cpu_ms': round(cpu / runs * 1000, 3),
+        'ops_per_s': round(runs / total, 2) if total else None,
+    }
+
+
+def build_operations(rng, scale=1.0):
+    """
+    Return the benchmarked operations
+
+    Inputs are drawn from the dataset up front, so only the call itself is
+    timed.
+
+    Returns:
+        list: (name, callable, runs)
+    """
+    client_controller = ClientController()
+    versement_controller = VersementController()
+
+    total_clients = Client.count()
+    if not total_clients:
+        raise ValueError("La base est vide, lancez d'abord benchmarks.generate")
+
+    # Anchors for keyset pages spread over the whole list
+    anchors = []
+    for _ in range(20):
+        anchors.extend(Client.get_page(offset=rng.randrange(total_clients), limit=1))
+    client_ids = [row.id for row in anchors]
+
+    payers = execute_query(
+        "SELECT id FROM clients WHERE montant >= %s ORDER BY id LIMIT 200", (1000,), fetch_all=True
+    )
+    payer_ids = [row['id'] for row in payers]
+    latest_versement = Versement.get_page(limit=1)
+    versement_anchor = latest_versement[0] if latest_versement else None
+    today = datetime.date.today()
+
+    def create_payment():
+        versement_controller.create_versement({
+            'montant': '1',
+            'type': BENCHMARK_TYPE,
+            'date_paiement': today.strftime('%Y-%m-%d'),
+            'annee_concernee': str(today.year)
+        }, rng.choice(payer_ids))
+
+    def load_directory():
+        client_directory.invalidate()
+        return client_controller.get_clients_for_dropdown()
+
+    def runs(count):
+        return max(1, int(count * scale))
+
+    operations = [
+        ("client.get_all", lambda: Client.get_all(), runs(5)),
+        ("client.get_page", lambda: Client.get_page(limit=100), runs(50)),
+        ("client.get_page.keyset", lambda: Client.get_page(after=rng.choice(anchors), limit=100), runs(50)),
+        ("client.get_page.montant", lambda: Client.get_page(sort_by='montant', limit=100), runs(50)),
+        ("client.search", lambda: Client.get_page(search_term=rng.choice(SEARCH_TERMS), limit=100), runs(50)),
+        ("client.count.search", lambda: Client.count(rng.choice(SEARCH_TERMS)), runs(20)),
+        ("client.get_by_id", lambda: Client.get_by_id(rng.choice(client_ids)), runs(200)),
+        ("client.directory.load", load_directory, runs(5)),
+        ("versement.get_all", lambda: Versement.get_all(), runs(3)),
+        ("versement.get_page", lambda: Versement.get_page(limit=100), runs(50)),
+        ("versement.get_page.client",
+         lambda: Versement.get_page({'client_id': rng.choice(client_ids)}, limit=100), runs(50)),
+        ("versement.get_page.annee",
+         lambda: Versement.get_page({'annee_concernee': rng.randrange(2018, 2026)}, limit=100), runs(50)),
+    ]
+    if versement_anchor:
+        operations.append((
+            "versement.get_page.keyset",
+            lambda: Versement.get_page(after=versement_anchor, limit=100), runs(50)
+        ))
+    if payer_ids:
+        operations.append(("versement_controller.create_versement", create_payment, runs(100)))
+    return operations
+
+
+def cleanup(versement_controller):
+    """Delete the payments created by the benchmark, timing the deletions"""
+    rows = execute_query("SELECT id FROM versement WHERE type = %s", (BENCHMARK_TYPE,), fetch_all=True)
+    ids = iter([row['id'] for row in rows])
+    if len(rows) < 2:
+        for versement_id in ids:
+            versement_controller.delete_versement(versement_id)
+        return None
+    # measure() makes one warm-up call before the timed ones
+    return measure(lambda: versement_controller.delete_versement(next(ids)), len(rows) - 1)
+
+
+def run(seed=42, scale=1.0, only=None):
+    """
+    Run the benchmarks
+
+    Args:
+        seed (int): Seed used to draw the inputs
+        scale (float): Multiplier applied to the number of runs
+        only (list): Names of the operations to run, all by default
+
+    Returns:
+        dict: Operation name -> measurements
+    """
+    rng = random.Random(seed)
+    results = {}
+    try:
+        for name, func, runs in build_operations(rng, scale):
+            if only and name not in only:
+                continue
+            results[name] = measure(func, runs)
+            print(format_result(name, results[name]))
+    finally:
+        deletions = cleanup(VersementController())
+    if deletions and (not only or "versement_controller.delete_versement" in only):
+        results["versement_controller.delete_versement"] = deletions
+        print(format_result("versement_controller.delete_versement", deletions))
+    return results
+
+
+def format_result(name, result, baseline=None):
+    """Format one line of the report"""
+    line = (f"{name:<40} p50 {result['p50_ms']:>10.2f} ms  p95 {result['p95_ms']:>10.2f} ms"
+            f"  cpu {result.get('cpu_ms', 0):>8.2f} ms  {result['ops_per_s'] or 0:>10.1f} ops/s")
+    if baseline:
+        line += f"  ({result['p95_ms'] / baseline['p95_ms']:.2f}x p95)" if baseline['p95_ms'] else ""
+    return line
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare results with a baseline
+
+    Args:
+        results (dict): Measurements of this run
+        baseline (dict): Measurements of the reference run
+        tolerance (float): Allowed relative p95 slowdown
+
+    Returns:
+        list: Names of the operations slower than the baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        print(format_result(name, result, reference))
+        if result['p95_ms'] > reference['p95_ms'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Mesure les performances des modèles et contrôleurs")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplicateur du nombre d'exécutions")
+    parser.add_argument('--only', nargs='*', help="Opérations à mesurer")
+    parser.add_argument('--output', help="Fichier JSON des résultats")
+    parser.add_argument('--baseline', default=None, help="Fichier JSON de référence")
+    parser.add_argument('--save-baseline', action='store_true', help="Enregistrer ce run comme référence")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Ralentissement p95 toléré (0.2 = 20%%)")
+    parser.add_argument('--no-prepared', action='store_true', help="Désactiver les requêtes préparées")
+    parser.add_argument('--pure', action='store_true', help="Utiliser mysql.connector en Python pur")
+    args = parser.parse_args(argv)
+
+    # Read when the first connection is opened
+    if args.no_prepared:
+        DB_CONFIG['prepared_statements'] = False
+    if args.pure:
+        DB_CONFIG['use_pure'] = True
+
+    results = run(args.seed, args.scale, args.only)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    baseline_path = args.baseline or DEFAULT_BASELINE
+    if args.save_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Référence enregistrée dans {baseline_path}")
+        return 0
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print("\nComparaison avec la référence:")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRégressions (p95 > +{args.tolerance:.0%}): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
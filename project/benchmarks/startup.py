@@ -0,0 +1,129 @@
+"""
+Measure the import time of the application at startup
+
+Usage:
+    python -m benchmarks.startup                     Check against the budget
+    python -m benchmarks.startup --profile           Also list the slowest imports
+    python -m benchmarks.startup --budget-ms 1500    Use another budget
+
+``import main`` runs in fresh interpreters with ``python -X importtime``, so
+nothing is already loaded. The check exits with status 1 when the median
+import time is over the budget or when a module that should be loaded on
+first use (database driver, forms, spreadsheet code, views) was imported
+before the window is shown.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median import time of main.py allowed, in milliseconds
+DEFAULT_BUDGET_MS = 1000
+
+# Modules that must not be imported before the window is shown
+LAZY_MODULES = (
+    'mysql.connector',
+    'openpyxl',
+    'utilities.form_builder',
+    'utilities.spreadsheet',
+    'views.client_view',
+    'views.versement_view',
+)
+
+
+def parse_importtime(output):
+    """
+    Parse the report printed by ``python -X importtime``
+
+    Returns:
+        list: (module, self µs, cumulative µs, depth) in import order
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # Header line
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        depth = (len(name) - len(module) - 1) // 2
+        imports.append((module, int(fields[0]), int(fields[1]), depth))
+    return imports
+
+
+def measure_import(module="main"):
+    """
+    Import a module in a fresh interpreter
+
+    Returns:
+        tuple: (total ms, parsed imports)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import de {module} impossible:\n{result.stderr[-2000:]}")
+    imports = parse_importtime(result.stderr)
+    # Interpreter startup (site, encodings) is reported before and not counted
+    total_us = sum(cumulative for name, _, cumulative, depth in imports if depth == 0 and name == module)
+    return total_us / 1000, imports
+
+
+def eager_modules(imports):
+    """Return the modules of LAZY_MODULES that were imported"""
+    names = {module for module, _, _, _ in imports}
+    return sorted(lazy for lazy in LAZY_MODULES
+                  if any(name == lazy or name.startswith(lazy + ".") for name in names))
+
+
+def format_profile(imports, limit=20):
+    """Format the imports with the largest cumulative time"""
+    ordered = sorted(imports, key=lambda item: item[2], reverse=True)[:limit]
+    lines = [f"{'cumulé (ms)':>12} {'propre (ms)':>12}  module"]
+    for module, self_us, cumulative_us, depth in ordered:
+        lines.append(f"{cumulative_us / 1000:>12.1f} {self_us / 1000:>12.1f}  {'  ' * depth}{module}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Mesure le temps d'import au démarrage")
+    parser.add_argument('--module', default="main", help="Module importé au démarrage")
+    parser.add_argument('--runs', type=int, default=5, help="Nombre d'interpréteurs lancés")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--profile', action='store_true', help="Afficher les imports les plus lents")
+    args = parser.parse_args(argv)
+
+    totals = []
+    imports = []
+    for _ in range(max(1, args.runs)):
+        total, imports = measure_import(args.module)
+        totals.append(total)
+    median = statistics.median(totals)
+
+    if args.profile:
+        print(format_profile(imports))
+        print()
+
+    print(f"Import de {args.module}: médiane {median:.1f} ms, min {min(totals):.1f} ms "
+          f"({len(totals)} exécutions), budget {args.budget_ms:.0f} ms")
+
+    failed = False
+    eager = eager_modules(imports)
+    if eager:
+        print(f"Modules importés au démarrage au lieu du premier usage: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"Budget dépassé de {median - args.budget_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -48,6 +48,8 @@ def build_executable():
         '--add-data=config.py;.',      # Include config file
         '--hidden-import=customtkinter',
         '--hidden-import=mysql.connector',
+        '--hidden-import=mysql.connector.connection_cext',  # C extension
+        '--hidden-import=_mysql_connector',
         '--hidden-import=tkinter',
         '--hidden-import=decimal',
         '--hidden-import=datetime',
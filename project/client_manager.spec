@@ -16,6 +16,8 @@ a = Analysis(
     hiddenimports=[
         'customtkinter',
         'mysql.connector',
+        'mysql.connector.connection_cext',
+        '_mysql_connector',
         'tkinter',
         'tkinter.ttk',
         'tkinter.messagebox',
@@ -2,12 +2,111 @@
 Configuration settings for the Client Management Application
 """
 
+# Storage backend: 'mysql' uses DB_CONFIG, 'sqlite' uses SQLITE_CONFIG
+DB_BACKEND = 'mysql'
+
 # Database connection configuration
 DB_CONFIG = {
     'host': 'localhost',
     'user': 'root',
     'password': '',
-    'database': 'client_management'
+    'database': 'client_management',
+    # Use the C extension of mysql.connector when it is installed
+    'use_pure': False,
+    # Connection pool settings (not passed to mysql.connector)
+    'pool_size': 5,
+    'pool_timeout': 10,
+    'pool_max_idle': 60,
+    # Run hot queries as server-side prepared statements (not passed to mysql.connector)
+    'prepared_statements': True
+}
+
+# Embedded database for single-user installs
+SQLITE_CONFIG = {
+    'path': 'client_management.db',
+    'pool_size': 5,
+    'pool_timeout': 10,
+    'pool_max_idle': 60,
+    # Wait this long for another connection's write lock before failing
+    'busy_timeout_ms': 5000,
+    # Page cache per connection and memory-mapped I/O size
+    'cache_size_kb': 65536,
+    'mmap_size': 268435456
+}
+
+# Query timing statistics (models.database.get_query_stats)
+QUERY_STATS_CONFIG = {
+    'enabled': True,
+    # Statements slower than this are logged with the code that ran them
+    'slow_query_ms': 200,
+    'slow_log_size': 100,
+    # Latest durations kept per statement for the p95
+    'samples': 1000,
+    # Write the statistics to this JSON file when the application closes
+    'dump_path': None
+}
+
+# Client search configuration
+SEARCH_CONFIG = {
+    # Use the ft_clients_search FULLTEXT (ngram) index when available;
+    # ignored on SQLite, which always falls back to LIKE. The index must be
+    # built with innodb_ft_enable_stopword = OFF (models.schema does it):
+    # the default stopword list contains "a" and "i", and the ngram parser
+    # drops every bigram containing a stopword, so names like "HAMANA" would
+    # not be found
+    'fulltext': True,
+    # Must match the server's ngram_token_size; shorter words use LIKE
+    'ngram_token_size': 2
+}
+
+# Choices offered by the client form dropdowns
+FIELD_OPTIONS = {
+    'regime_fiscal': ["REEL", "IFU", "Cessation", "RADIE", "SORTIE", "ABS", "GEL"],
+    'forme_juridique': ["INDIVIDUEL", "SARL", "EURL", "SNC", "MORAL", "COOPERATIVE"],
+    'regime_cnas': ["CNAS", "RAS", ""]
+}
+
+# In-process caches
+CACHE_CONFIG = {
+    # Seconds before the client dropdown directory is reloaded, so changes
+    # made from other desktops show up
+    'client_directory_ttl': 300,
+    # Clients kept in memory; names of the others are looked up one at a time
+    'client_directory_max_size': 50000,
+    # Payment histories of the client detail panel: seconds before one is
+    # reloaded, number of clients kept and payments listed per client
+    'client_history_ttl': 120,
+    'client_history_max_size': 200,
+    'client_history_rows': 200
+}
+
+# Multi-user sync: open views poll the database for rows changed elsewhere
+SYNC_CONFIG = {
+    'enabled': True,
+    'poll_interval_ms': 5000,
+    # Changes are read again from this many seconds before the last
+    # watermark, so rows written by transactions that were still open when it
+    # was taken are not missed
+    'overlap_s': 10,
+    # Tombstones of deleted rows are purged after this many days
+    'tombstone_retention_days': 7
+}
+
+# Offline mode (MySQL only): writes made while the server is unreachable are
+# queued in a local journal and replayed once it is back, and reads are
+# answered from a local copy of the clients and payments
+OFFLINE_CONFIG = {
+    'enabled': True,
+    'journal_path': 'offline_journal.db',
+    'snapshot_path': 'offline_snapshot.db',
+    # Seconds during which the server is not tried again after a failure
+    'retry_after_s': 15,
+    # Seconds between two refreshes of the local copy
+    'snapshot_refresh_s': 300,
+    # Queued writes replayed per transaction
+    'replay_batch_size': 50,
+    # Interval of the background check that replays the journal
+    'check_interval_ms': 10000
 }
 
 # UI Configuration
@@ -18,7 +117,21 @@ UI_CONFIG = {
     'font_family': 'Arial',
     'font_size': 16,
     'font_size_bold': 16,
-    'row_height': 30
+    'row_height': 30,
+    # Virtualized client list: only the visible rows are kept in the Treeview
+    # and rows are fetched from the database in pages while scrolling
+    'virtual_tree': True,
+    'page_size': 100,
+    'prefetch_pages': 1,
+    # Delay after the last keystroke before the client search runs
+    'search_debounce_ms': 300,
+    # Background execution of controller calls
+    'worker_threads': 4,
+    'max_view_tasks': 2,
+    # Tabs are built when first shown; the data of the hidden tab is fetched
+    # this long after startup and used if the tab opens before it expires
+    'prefetch_delay_ms': 500,
+    'prefetch_max_age_s': 60
 }
 
 # Validation Constants
@@ -3,6 +3,9 @@ Client controller for business logic
 """
 
 from models.client import Client
+from models.database import transaction, DatabaseUnavailableError
+from models import changes
+from models.offline import offline_journal, register_replay, fingerprint, check_unchanged
 from utilities.validators import validate_client_data
 from decimal import Decimal
 
@@ -14,98 +17,219 @@ class ClientController:
         """Get all clients with optional search"""
         return Client.get_all(search_term, sort_by)
 
+    def get_clients_page(self, search_term=None, sort_by='nom', after=None, offset=0, limit=100):
+        """Get one page of clients, continuing after the given row"""
+        return Client.get_page(search_term, sort_by, after, offset, limit)
+
+    def count_clients(self, search_term=None):
+        """Count clients matching an optional search"""
+        return Client.count(search_term)
+
+    def get_sync_watermark(self):
+        """Get the server time from which changes are polled after a load, None while offline"""
+        try:
+            return changes.server_time()
+        except DatabaseUnavailableError:
+            return None
+
+    def get_client_changes(self, since, search_term=None):
+        """Get the clients matching a search changed or deleted since a watermark"""
+        return changes.get_changes('clients', lambda time: Client.get_changed(time, search_term), since)
+
     def get_client_by_id(self, client_id):
         """Get a specific client by ID"""
         return Client.get_by_id(client_id)
 
-    def get_client_id_by_details(self, nom, prenom, phone):
-        """Get client ID by details"""
-        return Client.get_id_by_details(nom, prenom, phone)
-
-    def create_client(self, client_data):
-        """Create a new client"""
-        # Validate input data
-        validation_result = validate_client_data(client_data)
-        if not validation_result['valid']:
-            raise ValueError(validation_result['message'])
-
-        # Create client instance
-        client = Client(
+    @staticmethod
+    def _build_client(client_data, client_id=None):
+        """Create a Client instance from validated form data"""
+        return Client(
             nom=client_data['nom'],
             prenom=client_data['prenom'],
             activite=client_data.get('activite', ''),
             phone=client_data.get('phone', ''),
             email=client_data.get('email', ''),
             address=client_data.get('address', ''),
-            montant=client_data.get('montant', 0.0),
+            montant=client_data.get('montant') or 0.0,
             type=client_data.get('type', ''),
             regime_fiscal=client_data.get('regime_fiscal', ''),
             agent_responsable=client_data.get('agent_responsable', ''),
             forme_juridique=client_data.get('forme_juridique', ''),
             regime_cnas=client_data.get('regime_cnas', ''),
             mode_paiement=client_data.get('mode_paiement', ''),
-            honoraires_mois=client_data.get('honoraires_mois', 0.0)
+            honoraires_mois=client_data.get('honoraires_mois') or 0.0,
+            id=client_id
         )
 
+    def create_client(self, client_data):
+        """
+        Create a new client
+
+        Returns:
+            QueuedOperation if the server is unreachable and the client was
+            queued in the offline journal, None otherwise
+        """
+        # Validate input data
+        validation_result = validate_client_data(client_data)
+        if not validation_result['valid']:
+            raise ValueError(validation_result['message'])
+
         # Save to database
-        client.save()
+        try:
+            self._build_client(client_data).save()
+        except DatabaseUnavailableError as e:
+            return offline_journal.queue('client.create', {'client_data': client_data}, e)
+
+    def update_client(self, client_id, client_data, original=None):
+        """
+        Update an existing client
 
-    def update_client(self, client_id, client_data):
-        """Update an existing client"""
+        Args:
+            client_id (int): Client to update
+            client_data (dict): Form data
+            original (dict): Row the form was filled from; when given only
+                the fields changed in the form are written
+
+        Returns:
+            QueuedOperation if the server is unreachable and the update was
+            queued in the offline journal, None otherwise
+        """
         # Validate input data
         validation_result = validate_client_data(client_data)
         if not validation_result['valid']:
             raise ValueError(validation_result['message'])
 
-        # Create client instance with ID
-        client = Client(
-            nom=client_data['nom'],
-            prenom=client_data['prenom'],
-            activite=client_data.get('activite', ''),
-            phone=client_data.get('phone', ''),
-            email=client_data.get('email', ''),
-            address=client_data.get('address', ''),
-            montant=client_data.get('montant', 0.0),
-            type=client_data.get('type', ''),
-            regime_fiscal=client_data.get('regime_fiscal', ''),
-            agent_responsable=client_data.get('agent_responsable', ''),
-            forme_juridique=client_data.get('forme_juridique', ''),
-            regime_cnas=client_data.get('regime_cnas', ''),
-            mode_paiement=client_data.get('mode_paiement', ''),
-            honoraires_mois=client_data.get('honoraires_mois', 0.0),
-            id=client_id
-        )
+        client = self._build_client(client_data, client_id)
+        if original is not None:
+            stored = Client.from_row(original)
+            stored.update_from(client)
+            client = stored
 
         # Save to database
+        try:
+            client.save()
+        except DatabaseUnavailableError as e:
+            # Replayed only if the changed fields still hold the values the form showed
+            base = fingerprint(original, client.dirty_fields()) if original is not None else None
+            return offline_journal.queue('client.update', {
+                'client_id': client_id, 'client_data': client_data, 'base': base
+            }, e)
+
+    def _replay_update(self, payload):
+        """
+        Apply an update queued offline, unless another desktop changed the same fields meanwhile
+
+        An update queued without the form's original row has no base to
+        compare with: it writes every field but montant, whose value was read
+        before the payments made since and only changes through
+        adjust_balance.
+        """
+        client_id = payload['client_id']
+        base = payload['base']
+        current = Client.get_by_id(client_id, for_update=True)
+        if base is None:
+            check_unchanged(current, {})
+            fields = [field for field in Client.FIELDS if field != 'montant']
+        else:
+            check_unchanged(current, base)
+            fields = base
+        client = Client.from_row(current)
+        changed = self._build_client(payload['client_data'], client_id)
+        for field in fields:
+            setattr(client, field, getattr(changed, field))
         client.save()
 
+    def import_clients(self, path, batch_size=500):
+        """
+        Import clients from a CSV or XLSX file
+
+        Rows are streamed from the file, validated with the same rules as the
+        client form and inserted in batches, one transaction per batch. A
+        batch rejected by the database is retried row by row so the error can
+        be reported against the offending line.
+
+        Args:
+            path (str): File to import
+            batch_size (int): Rows per insert batch
+
+        Returns:
+            dict: {'imported': int, 'errors': [{'line': int, 'message': str}]}
+        """
+        from utilities.spreadsheet import iter_records
+
+        report = {'imported': 0, 'errors': []}
+        batch = []
+
+        for line, client_data in iter_records(path):
+            # Accept decimal commas in amounts
+            for field in ('montant', 'honoraires_mois'):
+                if client_data.get(field):
+                    client_data[field] = client_data[field].replace(' ', '').replace(',', '.')
+
+            validation_result = validate_client_data(client_data)
+            if not validation_result['valid']:
+                report['errors'].append({'line': line, 'message': validation_result['message']})
+                continue
+
+            try:
+                batch.append((line, self._build_client(client_data)))
+            except (ArithmeticError, ValueError):
+                report['errors'].append({'line': line, 'message': "Veuillez entrer un montant valide!"})
+                continue
+
+            if len(batch) >= batch_size:
+                self._insert_batch(batch, report)
+                batch = []
+
+        self._insert_batch(batch, report)
+        return report
+
+    def export_clients(self, path):
+        """Export every client to a CSV or XLSX file, returning the row count"""
+        from utilities.spreadsheet import write_rows
+
+        headers = [label for _, label in Client.EXPORT_COLUMNS]
+        return write_rows(path, headers, Client.iter_export())
+
+    @staticmethod
+    def _insert_batch(batch, report):
+        """Insert one batch of imported clients, recording failures per row"""
+        if not batch:
+            return
+        try:
+            with transaction():
+                Client.insert_many([client for _, client in batch])
+            report['imported'] += len(batch)
+        except Exception:
+            for line, client in batch:
+                try:
+                    with transaction():
+                        Client.insert_many([client])
+                    report['imported'] += 1
+                except Exception as e:
+                    report['errors'].append({'line': line, 'message': str(e)})
+
     def delete_client(self, client_id):
-        """Delete a client"""
-        Client.delete(client_id)
+        """Delete a client, queued in the offline journal if the server is unreachable"""
+        try:
+            Client.delete(client_id)
+        except DatabaseUnavailableError as e:
+            return offline_journal.queue('client.delete', {'client_id': client_id}, e)
 
     def get_clients_for_dropdown(self):
         """Get clients formatted for dropdown"""
         return Client.get_clients_for_dropdown()
 
+    def get_client_id_by_name(self, name):
+        """Get client ID from its dropdown label"""
+        return Client.get_id_by_name(name)
+
     def update_client_balance(self, client_id, amount):
         """Update client balance"""
-        client_data = self.get_client_by_id(client_id)
-        if client_data:
-            client = Client(
-                nom=client_data['nom'],
-                prenom=client_data['prenom'],
-                activite=client_data.get('activite', ''),
-                phone=client_data.get('phone', ''),
-                email=client_data.get('email', ''),
-                address=client_data.get('address', ''),
-                montant=client_data.get('montant', 0.0),
-                type=client_data.get('type', ''),
-                regime_fiscal=client_data.get('regime_fiscal', ''),
-                agent_responsable=client_data.get('agent_responsable', ''),
-                forme_juridique=client_data.get('forme_juridique', ''),
-                regime_cnas=client_data.get('regime_cnas', ''),
-                mode_paiement=client_data.get('mode_paiement', ''),
-                honoraires_mois=client_data.get('honoraires_mois', 0.0),
-                id=client_id
-            )
-            client.update_balance(amount)
\ No newline at end of file
+        Client.adjust_balance(client_id, amount)
+
+
+# Writes queued by the methods above while the server was unreachable
+register_replay('client.create', lambda payload: ClientController().create_client(payload['client_data']))
+register_replay('client.update', lambda payload: ClientController()._replay_update(payload))
+register_replay('client.delete', lambda payload: ClientController().delete_client(payload['client_id']))
@@ -2,44 +2,81 @@
 Versement controller for business logic
 """
 
-from models.versement import Versement
+from models.versement import Versement, client_history
 from models.client import Client
+from models.database import transaction, DatabaseUnavailableError
+from models import changes
+from models.offline import offline_journal, register_replay, fingerprint, check_unchanged
 from utilities.validators import validate_versement_data
 from decimal import Decimal
 import datetime
+from collections import defaultdict
+
+
+class BatchValidationError(ValueError):
+    """A batch of versements was rejected; errors lists the faulty lines"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("\n".join(f"Ligne {error['line']}: {error['message']}" for error in errors))
+
 
 class VersementController:
+    # Columns compared at replay to detect a versement changed on another desktop
+    VERSEMENT_FIELDS = ('client_id', 'montant', 'type', 'date_paiement', 'annee_concernee')
+
     def get_all_versements(self):
         """Get all versements"""
         return Versement.get_all()
 
+    def get_versements_page(self, filters=None, after=None, limit=100):
+        """Get one page of versements, continuing after the given row"""
+        return Versement.get_page(filters, after, limit)
+
+    def get_sync_watermark(self):
+        """Get the server time from which changes are polled after a load, None while offline"""
+        try:
+            return changes.server_time()
+        except DatabaseUnavailableError:
+            return None
+
+    def get_versement_changes(self, since, filters=None):
+        """Get the versements matching filters changed or deleted since a watermark"""
+        return changes.get_changes('versement', lambda time: Versement.get_changed(time, filters), since)
+
     def get_versement_by_id(self, versement_id):
         """Get a specific versement by ID"""
         return Versement.get_by_id(versement_id)
 
+    def get_client_history(self, client_id, reload=False):
+        """Get a client's latest versements and totals per year (cached unless reload)"""
+        if reload:
+            client_history.invalidate(client_id)
+        return client_history.get(client_id)
+
+    def export_versements(self, path, client_id=None, annee=None):
+        """Export versements to a CSV or XLSX file, optionally filtered by client and year"""
+        from utilities.spreadsheet import write_rows
+
+        headers = [label for _, label in Versement.EXPORT_COLUMNS]
+        return write_rows(path, headers, Versement.iter_export(client_id, annee))
+
     def create_versement(self, versement_data, client_id):
-        """Create a new versement"""
+        """
+        Create a new versement
+
+        Returns:
+            QueuedOperation if the server is unreachable and the versement was
+            queued in the offline journal (the balance is checked when it is
+            replayed), None otherwise
+        """
         # Validate input data
         validation_result = validate_versement_data(versement_data)
         if not validation_result['valid']:
             raise ValueError(validation_result['message'])
 
-        # Check client balance
-        client_data = Client.get_by_id(client_id)
-        if not client_data:
-            raise ValueError("Client non trouvé!")
-
         payment_amount = Decimal(str(versement_data['montant']))
-        current_balance = Decimal(str(client_data['montant'])) if client_data['montant'] is not None else Decimal('0.0')
-
-        if payment_amount > current_balance:
-            raise ValueError(f"Le montant du versement ({payment_amount:.2f}) dépasse le montant dû ({current_balance:.2f})!")
-
-        # Parse date
-        try:
-            payment_date = datetime.datetime.strptime(versement_data['date_paiement'], '%Y-%m-%d').date()
-        except ValueError:
-            payment_date = datetime.date.today()
+        payment_date = self._parse_date(versement_data['date_paiement'])
 
         # Create versement instance
         versement = Versement(
@@ -50,58 +87,116 @@ class VersementController:
             annee_concernee=int(versement_data['annee_concernee'])
         )
 
-        # Save versement
-        versement.save()
-
-        # Update client balance
-        new_balance = current_balance - payment_amount
-        client = Client(
-            nom=client_data['nom'],
-            prenom=client_data['prenom'],
-            activite=client_data.get('activite', ''),
-            phone=client_data.get('phone', ''),
-            email=client_data.get('email', ''),
-            address=client_data.get('address', ''),
-            montant=float(new_balance),
-            type=client_data.get('type', ''),
-            regime_fiscal=client_data.get('regime_fiscal', ''),
-            agent_responsable=client_data.get('agent_responsable', ''),
-            forme_juridique=client_data.get('forme_juridique', ''),
-            regime_cnas=client_data.get('regime_cnas', ''),
-            mode_paiement=client_data.get('mode_paiement', ''),
-            honoraires_mois=client_data.get('honoraires_mois', 0.0),
-            id=client_id
-        )
-        client.save()
+        try:
+            with transaction():
+                # Check client balance (row stays locked until commit)
+                current_balance = Client.get_balance(client_id, for_update=True)
+                if current_balance is None:
+                    raise ValueError("Client non trouvé!")
 
-    def update_versement(self, versement_id, versement_data, client_id):
-        """Update an existing versement"""
-        # Validate input data
-        validation_result = validate_versement_data(versement_data)
-        if not validation_result['valid']:
-            raise ValueError(validation_result['message'])
+                if payment_amount > current_balance:
+                    raise ValueError(f"Le montant du versement ({payment_amount:.2f}) dépasse le montant dû ({current_balance:.2f})!")
 
-        # Get original versement to calculate balance difference
-        original_versement = Versement.get_by_id(versement_id)
-        if not original_versement:
-            raise ValueError("Versement non trouvé!")
+                # Save versement and update client balance
+                versement.save()
+                Client.deduct_balance(client_id, payment_amount)
+        except DatabaseUnavailableError as e:
+            return offline_journal.queue('versement.create', {
+                'versement_data': versement_data, 'client_id': client_id
+            }, e)
 
-        original_amount = Decimal(str(original_versement['montant']))
-        new_amount = Decimal(str(versement_data['montant']))
-        amount_diff = new_amount - original_amount
+    def create_versements(self, entries):
+        """
+        Create a batch of versements in a single transaction
+
+        Every line is validated before anything is written, then each
+        client's payments are added up and checked against its balance with
+        the client rows locked. The versements are inserted with one batched
+        statement and the balances updated with one statement.
+
+        Args:
+            entries (list): (client_id, versement_data) per line, client_id
+                None when the line's client was not found
+
+        Returns:
+            int: Number of versements created, or a QueuedOperation if the
+            server is unreachable and the batch was queued in the offline journal
 
-        # Check if client can afford the difference
-        client_data = Client.get_by_id(client_id)
-        current_balance = Decimal(str(client_data['montant'])) if client_data['montant'] is not None else Decimal('0.0')
+        Raises:
+            BatchValidationError: With one error per faulty line; nothing is written
+        """
+        errors = []
+        versements = []
+        lines = defaultdict(list)
+        totals = defaultdict(Decimal)
+        for line, (client_id, versement_data) in enumerate(entries, start=1):
+            if not client_id:
+                errors.append({'line': line, 'message': "Veuillez sélectionner un client valide."})
+                continue
+            validation_result = validate_versement_data(versement_data)
+            if not validation_result['valid']:
+                errors.append({'line': line, 'message': validation_result['message']})
+                continue
 
-        if amount_diff > current_balance:
-            raise ValueError(f"Insufficient balance for this change. Needed: {amount_diff:.2f}, Available: {current_balance:.2f}")
+            payment_amount = Decimal(str(versement_data['montant']))
+            versements.append(Versement(
+                client_id=client_id,
+                montant=payment_amount,
+                type=versement_data['type'],
+                date_paiement=self._parse_date(versement_data['date_paiement']),
+                annee_concernee=int(versement_data['annee_concernee'])
+            ))
+            lines[client_id].append(line)
+            totals[client_id] += payment_amount
+
+        if errors:
+            raise BatchValidationError(errors)
+        if not versements:
+            return 0
 
-        # Parse date
         try:
-            payment_date = datetime.datetime.strptime(versement_data['date_paiement'], '%Y-%m-%d').date()
-        except ValueError:
-            payment_date = datetime.date.today()
+            with transaction():
+                balances = Client.get_balances(totals, for_update=True)
+                for client_id, total in totals.items():
+                    balance = balances.get(client_id)
+                    if balance is None:
+                        message = "Client non trouvé!"
+                    elif total > balance:
+                        message = f"Le total des versements du client ({total:.2f}) dépasse le montant dû ({balance:.2f})!"
+                    else:
+                        continue
+                    errors += [{'line': line, 'message': message} for line in lines[client_id]]
+                if errors:
+                    raise BatchValidationError(sorted(errors, key=lambda error: error['line']))
+
+                count = Versement.insert_many(versements)
+                Client.deduct_balances(totals)
+                return count
+        except DatabaseUnavailableError as e:
+            return offline_journal.queue('versement.create_batch', {'entries': entries}, e)
+
+    def update_versement(self, versement_id, versement_data, client_id, original=None):
+        """
+        Update an existing versement
+
+        Args:
+            versement_id (int): Versement to update
+            versement_data (dict): Form data
+            client_id (int): Client the versement belongs to
+            original (dict): Row the form was filled from; a copy queued
+                offline is rejected at replay if the row changed since
+
+        Returns:
+            QueuedOperation if the server is unreachable and the update was
+            queued in the offline journal, None otherwise
+        """
+        # Validate input data
+        validation_result = validate_versement_data(versement_data)
+        if not validation_result['valid']:
+            raise ValueError(validation_result['message'])
+
+        new_amount = Decimal(str(versement_data['montant']))
+        payment_date = self._parse_date(versement_data['date_paiement'])
 
         # Create versement instance with ID
         versement = Versement(
@@ -113,30 +208,75 @@ class VersementController:
             id=versement_id
         )
 
-        # Save versement
-        versement.save()
-
-        # Update client balance
-        new_balance = current_balance - amount_diff
-        client = Client(
-            nom=client_data['nom'],
-            prenom=client_data['prenom'],
-            activite=client_data.get('activite', ''),
-            phone=client_data.get('phone', ''),
-            email=client_data.get('email', ''),
-            address=client_data.get('address', ''),
-            montant=float(new_balance),
-            type=client_data.get('type', ''),
-            regime_fiscal=client_data.get('regime_fiscal', ''),
-            agent_responsable=client_data.get('agent_responsable', ''),
-            forme_juridique=client_data.get('forme_juridique', ''),
-            regime_cnas=client_data.get('regime_cnas', ''),
-            mode_paiement=client_data.get('mode_paiement', ''),
-            honoraires_mois=client_data.get('honoraires_mois', 0.0),
-            id=client_id
-        )
-        client.save()
+        try:
+            with transaction():
+                # Get original versement to calculate balance difference
+                original_versement = Versement.get_amount(versement_id, for_update=True)
+                if not original_versement:
+                    raise ValueError("Versement non trouvé!")
+
+                original_amount = Decimal(str(original_versement['montant']))
+                previous_client_id = original_versement['client_id']
+
+                if previous_client_id != client_id:
+                    # Moved to another client: the previous one gets the original
+                    # amount back and the new one pays the full new amount. Both
+                    # rows are locked in id order, like concurrent batches
+                    balances = Client.get_balances([previous_client_id, client_id], for_update=True)
+                    current_balance = balances.get(client_id)
+                    if current_balance is None:
+                        raise ValueError("Client non trouvé!")
+                    if new_amount > current_balance:
+                        raise ValueError(f"Le montant du versement ({new_amount:.2f}) dépasse le montant dû ({current_balance:.2f})!")
+
+                    versement.save()
+                    Client.adjust_balance(previous_client_id, original_amount)
+                    Client.deduct_balance(client_id, new_amount)
+                else:
+                    amount_diff = new_amount - original_amount
+
+                    # Check if client can afford the difference
+                    current_balance = Client.get_balance(client_id, for_update=True)
+                    if current_balance is None:
+                        raise ValueError("Client non trouvé!")
+
+                    if amount_diff > current_balance:
+                        raise ValueError(f"Insufficient balance for this change. Needed: {amount_diff:.2f}, Available: {current_balance:.2f}")
+
+                    # Save versement and update client balance
+                    versement.save()
+                    Client.deduct_balance(client_id, amount_diff)
+        except DatabaseUnavailableError as e:
+            return offline_journal.queue('versement.update', {
+                'versement_id': versement_id, 'versement_data': versement_data, 'client_id': client_id,
+                'base': fingerprint(original, self.VERSEMENT_FIELDS) if original is not None else None
+            }, e)
+
+    def _replay_update(self, payload):
+        """Apply an update queued offline, unless the versement changed on another desktop meanwhile"""
+        if payload['base'] is not None:
+            check_unchanged(Versement.get_by_id(payload['versement_id']), payload['base'])
+        self.update_versement(payload['versement_id'], payload['versement_data'], payload['client_id'])
 
     def delete_versement(self, versement_id):
-        """Delete a versement"""
-        Versement.delete(versement_id)
\ No newline at end of file
+        """Delete a versement, queued in the offline journal if the server is unreachable"""
+        try:
+            Versement.delete(versement_id)
+        except DatabaseUnavailableError as e:
+            return offline_journal.queue('versement.delete', {'versement_id': versement_id}, e)
+
+    @staticmethod
+    def _parse_date(value):
+        """Parse a payment date, defaulting to today"""
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            return datetime.date.today()
+
+
+# Writes queued by the methods above while the server was unreachable
+register_replay('versement.create', lambda payload: VersementController().create_versement(
+    payload['versement_data'], payload['client_id']))
+register_replay('versement.update', lambda payload: VersementController()._replay_update(payload))
+register_replay('versement.delete', lambda payload: VersementController().delete_versement(payload['versement_id']))
+register_replay('versement.create_batch', lambda payload: VersementController().create_versements(payload['entries']))
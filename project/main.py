@@ -4,11 +4,19 @@ Client Management Application
 Entry point for the application
 """
 
+import logging
+import time
 import customtkinter as ctk
-from views.client_view import ClientView
-from views.versement_view import VersementView
+from tkinter import messagebox
 from controllers.client_controller import ClientController
 from controllers.versement_controller import VersementController
+from models.database import dump_query_stats
+from models.changes import purge_tombstones
+from models.offline import offline_enabled, offline_journal, synchronize
+from utilities.background import ViewTaskRunner
+from config import QUERY_STATS_CONFIG, UI_CONFIG, SYNC_CONFIG, OFFLINE_CONFIG
+
+logger = logging.getLogger(__name__)
 
 class ClientManagerApp:
     def __init__(self, root):
@@ -24,19 +32,172 @@ class ClientManagerApp:
         
         # Setup UI
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def setup_ui(self):
-        """Setup the main tabview and all tabs"""
-        self.tabview = ctk.CTkTabview(self.root)
+        """
+        Setup the main tabview
+
+        Each tab shows a loading label until it is first selected; its view
+        is built then. The window is therefore drawn before any view or
+        query runs, and the data of the hidden tab is prefetched once the
+        application is idle.
+        """
+        self.setup_status_bar()
+        self.tabview = ctk.CTkTabview(self.root, command=self.on_tab_change)
         self.tabview.pack(fill="both", expand=True, padx=10, pady=10)
 
+        self.views = {}
+        self.placeholders = {}
+        self.prefetched = {}
+        self.prefetch_pending = {}
+        # One query at a time, the visible tab gets the rest of the pool
+        self.background_tasks = ViewTaskRunner(self.root, max_concurrent=1)
+
         # Create tabs
-        client_tab = self.tabview.add("Clients")
-        versement_tab = self.tabview.add("Versements")
+        for name in ("Clients", "Versements"):
+            tab = self.tabview.add(name)
+            placeholder = ctk.CTkLabel(tab, text="Chargement...")
+            placeholder.pack(expand=True)
+            self.placeholders[name] = placeholder
+
+        # Build the visible tab after the window has been drawn
+        self.root.after_idle(self.root.after, 1, self.open_current_tab)
+
+    def setup_status_bar(self):
+        """Bottom bar reporting offline mode and rejected offline writes"""
+        self.online = True
+        self.offline_tasks = ViewTaskRunner(self.root, max_concurrent=1)
+        bar = ctk.CTkFrame(self.root, fg_color="transparent")
+        bar.pack(side="bottom", fill="x", padx=10)
+        self.status_label = ctk.CTkLabel(bar, text="")
+        self.status_label.pack(side="left")
+        self.conflicts_button = ctk.CTkButton(bar, text="", command=self.show_conflicts)
+
+    def build_view(self, name):
+        """Replace the loading label of a tab by its view, once"""
+        if name in self.views:
+            return self.views[name]
+
+        # The views and what they import are loaded after the window is drawn
+        from views.client_view import ClientView
+        from views.versement_view import VersementView
+
+        task = self.prefetch_pending.pop(name, None)
+        if task is not None:
+            task.cancel()
+        prefetched = self.take_prefetched(name)
+
+        self.placeholders.pop(name).destroy()
+        tab = self.tabview.tab(name)
+        if name == "Clients":
+            view = ClientView(tab, self.client_controller, self.versement_controller, prefetched)
+        else:
+            view = VersementView(tab, self.versement_controller, self.client_controller, prefetched)
+        self.views[name] = view
+        return view
+
+    def on_tab_change(self):
+        """Build the selected tab the first time it is shown"""
+        self.build_view(self.tabview.get())
+
+    def open_current_tab(self):
+        """Build the visible tab, then prefetch the hidden ones when idle"""
+        self.on_tab_change()
+        if SYNC_CONFIG['enabled']:
+            # Failures are ignored, the next start purges again
+            self.background_tasks.submit(purge_tombstones)
+        self.root.after(
+            UI_CONFIG['prefetch_delay_ms'],
+            lambda: self.root.after_idle(self.prefetch_hidden_tabs)
+        )
+        if offline_enabled():
+            # The first check copies the data read while offline
+            self.root.after(UI_CONFIG['prefetch_delay_ms'] * 2, self.check_offline)
+
+    def check_offline(self):
+        """Replay the offline journal and refresh the local copy in the background"""
+        self.offline_tasks.submit(synchronize, on_success=self.on_synchronized, on_error=self.on_synchronize_failed)
+
+    def on_synchronized(self, status):
+        """Show the offline status and reload the views once the server is back"""
+        came_back = status['online'] and not self.online
+        self.online = status['online']
+        if status['applied'] or came_back:
+            # Rows written by the replay, and watermarks not taken while offline
+            for view in self.views.values():
+                view.load_data()
+
+        if not status['online']:
+            text = "Hors ligne: données de la copie locale"
+            if status['pending']:
+                text += f", {status['pending']} modification(s) en attente"
+        elif status['applied']:
+            text = f"{status['applied']} modification(s) hors ligne appliquée(s)"
+        else:
+            text = ""
+        self.status_label.configure(text=text)
+
+        if status['conflicts']:
+            self.conflicts_button.configure(text=f"{status['conflicts']} modification(s) rejetée(s)")
+            self.conflicts_button.pack(side="right", pady=5)
+        else:
+            self.conflicts_button.pack_forget()
+        self.root.after(OFFLINE_CONFIG['check_interval_ms'], self.check_offline)
+
+    def on_synchronize_failed(self, error):
+        """Log the error and check again later"""
+        logger.warning("Synchronisation hors ligne impossible: %s", error)
+        self.root.after(OFFLINE_CONFIG['check_interval_ms'], self.check_offline)
+
+    def show_conflicts(self):
+        """List the offline writes rejected at replay and mark them as seen"""
+        conflicts = offline_journal.conflicts()
+        lines = [f"{entry['created_at']} {entry['operation']}: {entry['error']}" for entry in conflicts[:20]]
+        if len(conflicts) > 20:
+            lines.append(f"... et {len(conflicts) - 20} autre(s)")
+        message = "\n".join(lines) + "\n\nMarquer ces modifications comme vues ?"
+        if messagebox.askyesno("Modifications rejetées", message):
+            offline_journal.dismiss_conflicts()
+            self.conflicts_button.pack_forget()
+
+    def prefetch_hidden_tabs(self):
+        """Fetch the initial data of the tabs not built yet in the background"""
+        from views.client_view import ClientView
+        from views.versement_view import VersementView
+
+        fetchers = {
+            "Clients": (ClientView.fetch_clients, self.client_controller),
+            "Versements": (VersementView.fetch_first_page, self.versement_controller),
+        }
+        for name, (fetch, controller) in fetchers.items():
+            if name in self.views:
+                continue
+            # A failed prefetch is not reported, the view loads its data itself
+            self.prefetch_pending[name] = self.background_tasks.submit(
+                fetch, controller,
+                on_success=lambda data, name=name: self.store_prefetched(name, data),
+                key=name
+            )
+
+    def store_prefetched(self, name, data):
+        """Keep prefetched data until its tab is opened"""
+        self.prefetch_pending.pop(name, None)
+        if name not in self.views:
+            self.prefetched[name] = (time.monotonic(), data)
+
+    def take_prefetched(self, name):
+        """Return the prefetched data of a tab if it is still fresh, else None"""
+        fetched_at, data = self.prefetched.pop(name, (None, None))
+        if fetched_at is None or time.monotonic() - fetched_at > UI_CONFIG['prefetch_max_age_s']:
+            return None
+        return data
 
-        # Initialize views
-        self.client_view = ClientView(client_tab, self.client_controller, self.versement_controller)
-        self.versement_view = VersementView(versement_tab, self.versement_controller, self.client_controller)
+    def on_close(self):
+        """Save the query statistics if configured, then close the window"""
+        if QUERY_STATS_CONFIG['dump_path']:
+            dump_query_stats(QUERY_STATS_CONFIG['dump_path'])
+        self.root.destroy()
 
 def main():
     """Main entry point"""
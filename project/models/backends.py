@@ -0,0 +1,264 @@
+"""
+Storage backends behind models.database
+
+Each backend opens connections that follow the mysql.connector interface
+used by models.database (cursor(dictionary=...), start_transaction, commit,
+rollback, in_transaction, is_connected, reconnect), so the pool and the
+query helpers work unchanged on either of them.
+"""
+
+import datetime
+import re
+import sqlite3
+import threading
+import weakref
+from decimal import Decimal
+from functools import lru_cache
+
+# Keys of a backend configuration that configure the pool, not the driver
+POOL_OPTIONS = ('pool_size', 'pool_timeout', 'pool_max_idle')
+
+# Keys of a backend configuration read by the backend itself
+BACKEND_OPTIONS = POOL_OPTIONS + ('prepared_statements',)
+
+
+class MySQLBackend:
+    """
+    MySQL server reached through mysql.connector
+
+    Queries executed with ``prepared=True`` run as server-side prepared
+    statements. Each pooled connection keeps one prepared cursor per query
+    string, so the server parses a hot query once per connection instead
+    of on every call.
+    """
+
+    name = 'mysql'
+    supports_fulltext = True
+
+    def __init__(self, config):
+        self.pool_options = {key: value for key, value in config.items() if key in POOL_OPTIONS}
+        self.connection_args = {key: value for key, value in config.items() if key not in BACKEND_OPTIONS}
+        self.prepared_statements = config.get('prepared_statements', True)
+        self._statements = weakref.WeakKeyDictionary()
+        self._statements_lock = threading.Lock()
+
+    def connect(self):
+        """Open a new connection, using the C extension unless use_pure is set"""
+        import mysql.connector
+        return mysql.connector.connect(**self.connection_args)
+
+    def prepared_cursor(self, conn, query):
+        """Return the prepared cursor of a query on a connection, creating it once"""
+        with self._statements_lock:
+            cursors = self._statements.setdefault(conn, {})
+        cursor = cursors.get(query)
+        if cursor is None:
+            cursor = cursors[query] = conn.cursor(prepared=True)
+        return cursor
+
+    def reset_statements(self, conn):
+        """Forget the prepared cursors of a connection after an error or reconnect"""
+        with self._statements_lock:
+            cursors = self._statements.pop(conn, {})
+        for cursor in cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    @property
+    def disconnect_errors(self):
+        """Errors after which a connection must not be reused"""
+        import mysql.connector
+        return (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError)
+
+
+# Values passed to and read from SQLite, matching what mysql.connector returns
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(sep=' '))
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()))
+sqlite3.register_converter('DATE', lambda value: datetime.date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATETIME', lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+_CONCAT = re.compile(r"\bCONCAT\(", re.IGNORECASE)
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\b", re.IGNORECASE)
+
+
+def _split_arguments(text, start):
+    """
+    Split the arguments of a call whose parenthesis opens at text[start - 1]
+
+    Returns:
+        tuple: (list of argument strings, index after the closing parenthesis)
+    """
+    arguments = []
+    depth = 0
+    quote = None
+    current = start
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            if depth == 0:
+                arguments.append(text[current:index].strip())
+                return arguments, index + 1
+            depth -= 1
+        elif char == ',' and depth == 0:
+            arguments.append(text[current:index].strip())
+            current = index + 1
+    raise ValueError(f"Parenthèse non fermée dans la requête: {text}")
+
+
+@lru_cache(maxsize=512)
+def translate_query(query):
+    """
+    Rewrite a MySQL query for SQLite
+
+    Placeholders become ``?``, ``CONCAT(a, b)`` becomes ``(a || b)`` and
+    ``FOR UPDATE`` is dropped: SQLite transactions take the write lock up
+    front (BEGIN IMMEDIATE), which serializes the same read-check-write
+    sequences the row locks protect on MySQL.
+    """
+    query = _FOR_UPDATE.sub("", query)
+    while True:
+        match = _CONCAT.search(query)
+        if not match:
+            break
+        arguments, end = _split_arguments(query, match.end())
+        query = f"{query[:match.start()]}({' || '.join(arguments)}){query[end:]}"
+    return query.replace("%s", "?")
+
+
+class SQLiteCursor:
+    """Cursor returning dicts or tuples like a mysql.connector cursor"""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self.dictionary = dictionary
+
+    def execute(self, query, params=()):
+        self._cursor.execute(translate_query(query), params or ())
+
+    def executemany(self, query, seq_params):
+        self._cursor.executemany(translate_query(query), seq_params)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def _convert(self, rows):
+        if not self.dictionary:
+            return rows
+        columns = [column[0] for column in self._cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._convert([row])[0]
+
+    def fetchmany(self, size):
+        return self._convert(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._convert(self._cursor.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """sqlite3 connection exposing the mysql.connector methods the pool uses"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def cursor(self, dictionary=False, buffered=None):
+        return SQLiteCursor(self._conn.cursor(), dictionary)
+
+    def start_transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def is_connected(self):
+        try:
+            self._conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reconnect(self, attempts=1, delay=0):
+        """A local database file does not drop connections"""
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLiteBackend:
+    """
+    Embedded SQLite database for single-user installs
+
+    sqlite3 already caches compiled statements per connection, so queries
+    marked as prepared take the regular path.
+    """
+
+    name = 'sqlite'
+    supports_fulltext = False
+    prepared_statements = False
+    # A local database file does not drop connections; sqlite3 errors are
+    # coding or data errors and must not be mistaken for an outage
+    disconnect_errors = ()
+
+    def __init__(self, config):
+        self.config = config
+        self.pool_options = {key: value for key, value in config.items() if key in POOL_OPTIONS}
+
+    def reset_statements(self, conn):
+        """Statements are cached by sqlite3 itself"""
+
+    def connect(self):
+        """Open a new connection with the configured pragmas"""
+        conn = sqlite3.connect(
+            self.config['path'],
+            timeout=self.config.get('busy_timeout_ms', 5000) / 1000,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,       # Transactions are started explicitly
+            check_same_thread=False     # Pooled connections move between threads
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute(f"PRAGMA cache_size = -{int(self.config.get('cache_size_kb', 65536))}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.config.get('mmap_size', 0))}")
+        return SQLiteConnection(conn)
+
+
+BACKENDS = {
+    'mysql': MySQLBackend,
+    'sqlite': SQLiteBackend,
+}
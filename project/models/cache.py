@@ -0,0 +1,134 @@
+"""
+In-process caches for frequently read model data
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+
+class ClientDirectory:
+    """
+    Cache of client display names used by dropdowns and name lookups
+
+    The directory maps client ids to labels and keeps a reverse index from
+    label to id. Clients sharing a name get their id appended to the label
+    so every label is unique. Entries expire after ``ttl`` seconds and are
+    dropped on invalidate().
+
+    At most ``max_size`` clients are kept, the first ones in name order. When
+    the table is larger, names() only lists those, and labels of the other
+    clients are resolved one at a time by ``lookup`` with an indexed query.
+    """
+
+    def __init__(self, loader, lookup, ttl=300, max_size=50000):
+        self.loader = loader
+        self.lookup = lookup
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._by_id = None
+        self._by_name = None
+        self._complete = True
+        self._loaded_at = 0.0
+        self._generation = 0
+
+    def _build(self, rows):
+        """Build the id -> label and label -> id indexes"""
+        counts = Counter(row['name'] for row in rows)
+        by_id = {}
+        for row in rows:
+            name = row['name']
+            by_id[row['id']] = name if counts[name] == 1 else f"{name} (#{row['id']})"
+        by_name = {label: client_id for client_id, label in by_id.items()}
+        return by_id, by_name
+
+    def _indexes(self):
+        """Return both indexes and whether they hold every client, reloading them if missing or expired"""
+        with self._lock:
+            if self._by_id is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._by_id, self._by_name, self._complete
+            generation = self._generation
+
+        rows = self.loader(self.max_size + 1)
+        complete = len(rows) <= self.max_size
+        if not complete:
+            # Drop the last name entirely so the clients sharing it are not
+            # split between the cached and the looked-up ones
+            last = rows[-1]['name']
+            rows = [row for row in rows if row['name'] != last]
+        by_id, by_name = self._build(rows)
+
+        with self._lock:
+            # Keep the result unless a write invalidated it while loading
+            if generation == self._generation:
+                self._by_id, self._by_name, self._complete = by_id, by_name, complete
+                self._loaded_at = time.monotonic()
+        return by_id, by_name, complete
+
+    def names(self):
+        """Return a dict mapping client id to display label, limited to ``max_size`` clients"""
+        return dict(self._indexes()[0])
+
+    def id_for_name(self, label):
+        """Return the client id for a display label, or None"""
+        _, by_name, complete = self._indexes()
+        client_id = by_name.get(label)
+        if client_id is None and not complete:
+            client_id = self.lookup(label)
+        return client_id
+
+    def invalidate(self):
+        """Drop the cached directory"""
+        with self._lock:
+            self._generation += 1
+            self._by_id = None
+            self._by_name = None
+
+
+class ClientHistoryCache:
+    """
+    Per-client cache of the payment histories shown in the client view
+
+    Entries expire after ``ttl`` seconds and at most ``max_size`` clients
+    are kept, the least recently read ones being dropped first.
+    invalidate(client_id) drops one client once its versements changed; a
+    history loaded while it was invalidated is returned but not kept.
+    """
+
+    def __init__(self, loader, ttl=120, max_size=200):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = Counter()
+        self._epoch = 0
+
+    def get(self, client_id):
+        """Return the history of a client, loading it if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(client_id)
+                return entry[1]
+            version = (self._epoch, self._versions[client_id])
+
+        history = self.loader(client_id)
+
+        with self._lock:
+            if version == (self._epoch, self._versions[client_id]):
+                self._entries[client_id] = (time.monotonic(), history)
+                self._entries.move_to_end(client_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return history
+
+    def invalidate(self, client_id=None):
+        """Drop the history of one client, or of every client"""
+        with self._lock:
+            if client_id is None:
+                self._epoch += 1
+                self._entries.clear()
+            else:
+                self._versions[client_id] += 1
+                self._entries.pop(client_id, None)
@@ -0,0 +1,83 @@
+"""
+Change tracking used to keep several desktops in sync
+
+clients and versement rows carry an updated_at timestamp maintained by the
+database, and deleting a row leaves a tombstone in deleted_rows. A view
+remembers the server time of its last load or poll (its watermark) and only
+asks for the rows changed since.
+"""
+
+import datetime
+from models.database import execute_query
+from config import SYNC_CONFIG
+
+
+def server_time():
+    """Return the current time of the database server"""
+    # Never the offline snapshot's clock: watermarks are compared with server times
+    now = execute_query("SELECT CURRENT_TIMESTAMP AS now", fetch_one=True, snapshot=False)['now']
+    # SQLite returns the timestamp as text
+    if isinstance(now, str):
+        now = datetime.datetime.fromisoformat(now)
+    return now
+
+
+def record_deletion(table, where, params):
+    """
+    Leave tombstones for rows about to be deleted
+
+    Call it in the deleting transaction, just before the DELETE.
+
+    Args:
+        table (str): Table the rows are deleted from
+        where (str): Condition selecting the rows, e.g. "id = %s"
+        params (tuple): Parameters of the condition
+    """
+    execute_query(
+        f"INSERT INTO deleted_rows (table_name, row_id) SELECT %s, id FROM {table} WHERE {where}",
+        (table,) + tuple(params)
+    )
+
+
+def deleted_since(table, since):
+    """Return the ids of the rows of a table deleted since a time"""
+    rows = execute_query(
+        "SELECT row_id FROM deleted_rows WHERE table_name = %s AND deleted_at >= %s",
+        (table, since), fetch_all=True
+    )
+    return [row['row_id'] for row in rows]
+
+
+def get_changes(table, fetch_changed, since):
+    """
+    Return what changed in a table since a watermark
+
+    The new watermark is read before the changes, so rows written while they
+    are read are returned again by the next poll. Reading from overlap_s
+    before the watermark also catches rows stamped before it by transactions
+    that committed after it.
+
+    Args:
+        table (str): Table whose tombstones are read
+        fetch_changed (callable): fetch_changed(since) returning the rows
+            inserted or updated since a time
+        since (datetime): Watermark of the previous load or poll
+
+    Returns:
+        dict: {'watermark': server time to poll from next time,
+               'changed': rows returned by fetch_changed,
+               'deleted': ids of the deleted rows}
+    """
+    watermark = server_time()
+    since -= datetime.timedelta(seconds=SYNC_CONFIG['overlap_s'])
+    return {
+        'watermark': watermark,
+        'changed': fetch_changed(since),
+        'deleted': deleted_since(table, since)
+    }
+
+
+def purge_tombstones():
+    """Delete the tombstones older than the retention period"""
+    cutoff = server_time() - datetime.timedelta(days=SYNC_CONFIG['tombstone_retention_days'])
+    execute_query("DELETE FROM deleted_rows WHERE deleted_at < %s", (cutoff,))
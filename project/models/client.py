@@ -2,8 +2,22 @@
 Client model and database operations
 """
 
-from models.database import execute_query
+from models.database import execute_query, execute_many, stream_query, transaction, on_commit, get_backend
+from models.cache import ClientDirectory
+from models.changes import record_deletion
+import re
+from collections import namedtuple
 from decimal import Decimal
+from config import SEARCH_CONFIG, CACHE_CONFIG
+
+# Columns fetched by the client lists: the displayed ones plus the keyset
+# columns of every sort option
+LIST_COLUMNS = ('id', 'nom', 'prenom', 'activite', 'phone', 'address', 'montant',
+                'regime_fiscal', 'agent_responsable', 'forme_juridique')
+
+# One row of a client list; score is only set when sorting by relevance
+ClientRow = namedtuple('ClientRow', LIST_COLUMNS + ('score',), defaults=(None,))
+
 
 class Client:
     def __init__(self, nom, prenom='', activite='', phone='', email='', address='', 
@@ -25,97 +39,381 @@ class Client:
         self.regime_cnas = regime_cnas
         self.mode_paiement = mode_paiement
         self.honoraires_mois = Decimal(str(honoraires_mois))
+        # Values as last read from or written to the database, None if unknown
+        self._stored = None
+
+    # Columns written by save(), in INSERT_QUERY order
+    FIELDS = ('nom', 'prenom', 'activite', 'phone', 'email', 'address', 'montant', 'type',
+              'regime_fiscal', 'agent_responsable', 'forme_juridique', 'regime_cnas',
+              'mode_paiement', 'honoraires_mois')
 
     @staticmethod
-    def get_all(search_term=None, sort_by='nom'):
-        """Get all clients with optional search"""
-        # Define valid sort options and their SQL equivalents
-        sort_options = {
-            'nom': 'c.nom ASC, c.prenom ASC',
-            'montant': 'c.montant DESC',
-            'creation_date': 'c.id DESC'  # Assuming newer IDs = newer records
-        }
-        
+    def from_row(row):
+        """Build a client from a database row, tracking later changes"""
+        values = {field: row[field] for field in Client.FIELDS if row.get(field) is not None}
+        client = Client(id=row['id'], **values)
+        client.mark_clean()
+        return client
+
+    def _values(self):
+        return {field: getattr(self, field) for field in Client.FIELDS}
+
+    def mark_clean(self):
+        """Record the current values as the stored ones"""
+        self._stored = self._values()
+
+    def dirty_fields(self):
+        """Return the fields changed since the client was loaded, all if it was not"""
+        if self._stored is None:
+            return list(Client.FIELDS)
+        return [field for field, value in self._values().items() if value != self._stored[field]]
+
+    def update_from(self, client):
+        """Copy the field values of another client, keeping this one's change tracking"""
+        for field in Client.FIELDS:
+            setattr(self, field, getattr(client, field))
+
+    # Sort options: SQL order clause plus the keyset columns and comparison
+    # operator used to continue after the last row of a page
+    SORT_OPTIONS = {
+        'nom': ('c.nom ASC, c.prenom ASC, c.id ASC', ('nom', 'prenom', 'id'), '>'),
+        'montant': ('c.montant DESC, c.id DESC', ('montant', 'id'), '<'),
+        'creation_date': ('c.id DESC', ('id',), '<'),  # Assuming newer IDs = newer records
+        'relevance': ('score DESC, c.id ASC', None, None)  # Full-text searches only
+    }
+
+    # Columns of the ft_clients_search FULLTEXT index
+    SEARCH_COLUMNS = "c.nom, c.prenom, c.phone, c.activite"
+
+    @staticmethod
+    def _fulltext_query(search_term):
+        """Build a boolean-mode query for the ngram index, or None if it cannot serve the term"""
+        if not SEARCH_CONFIG['fulltext'] or not get_backend().supports_fulltext:
+            return None
+        terms = []
+        for word in search_term.split():
+            word = word.replace('"', '')
+            # The ngram parser cannot match words shorter than its token size
+            if len(word) < SEARCH_CONFIG['ngram_token_size']:
+                return None
+            terms.append(f'+"{word}"')
+        return " ".join(terms) or None
+
+    @staticmethod
+    def _search_clause(search_term):
+        """
+        Build the WHERE clause for a search term
+
+        Returns:
+            tuple: (where clause, params, relevance expression or None)
+        """
+        if not search_term:
+            return "", (), None
+
+        fulltext = Client._fulltext_query(search_term)
+        if fulltext:
+            match = f"MATCH({Client.SEARCH_COLUMNS}) AGAINST (%s IN BOOLEAN MODE)"
+            return f" WHERE {match}", (fulltext,), match
+
+        # Fall back to a scan for terms the index cannot serve
+        clause = " WHERE (c.nom LIKE %s OR c.prenom LIKE %s OR c.phone LIKE %s OR c.activite LIKE %s)"
+        return clause, tuple(f"%{search_term}%" for _ in range(4)), None
+
+    @staticmethod
+    def _list_query(search_term, sort_by):
+        """
+        Build the SELECT and WHERE part of a client list query
+
+        Returns:
+            tuple: (query, params, sort option)
+        """
+        where_clause, params, relevance = Client._search_clause(search_term)
+
         # Default to name sorting if invalid sort option provided
-        order_clause = sort_options.get(sort_by, sort_options['nom'])
-        
-        query = "SELECT * FROM clients c"
-        
-        if search_term:
-            query += " WHERE c.nom LIKE %s OR c.prenom LIKE %s OR c.phone LIKE %s OR c.activite LIKE %s"
-            query += f" ORDER BY {order_clause}"
-            params = tuple(f"%{search_term}%" for _ in range(4))
-            return execute_query(query, params, fetch_all=True)
+        if sort_by not in Client.SORT_OPTIONS or (sort_by == 'relevance' and relevance is None):
+            sort_by = 'nom'
+
+        columns = ", ".join(f"c.{column}" for column in LIST_COLUMNS)
+        if sort_by == 'relevance':
+            query = f"SELECT {columns}, {relevance} AS score FROM clients c{where_clause}"
+            params = params + params
         else:
-            query += f" ORDER BY {order_clause}"
-            return execute_query(query, fetch_all=True)
+            query = f"SELECT {columns} FROM clients c{where_clause}"
+        return query, params, Client.SORT_OPTIONS[sort_by]
+
+    @staticmethod
+    def get_all(search_term=None, sort_by='nom'):
+        """Get all clients with optional search"""
+        query, params, (order_clause, _, _) = Client._list_query(search_term, sort_by)
+        return execute_query(f"{query} ORDER BY {order_clause}", params, fetch_all=True, row_type=ClientRow)
+
+    @staticmethod
+    def get_page(search_term=None, sort_by='nom', after=None, offset=0, limit=100):
+        """
+        Get one page of clients
+
+        Args:
+            search_term (str): Optional search filter
+            sort_by (str): Sort option key
+            after (ClientRow): Last row of the previous page; when given the page
+                is fetched by keyset on the sort columns instead of by offset
+            offset (int): Row offset of the page
+            limit (int): Page size
+
+        Returns:
+            list: ClientRow tuples
+        """
+        query, params, (order_clause, key_columns, operator) = Client._list_query(search_term, sort_by)
+
+        keyset = after is not None and key_columns is not None
+        if keyset:
+            columns = ", ".join(f"c.{column}" for column in key_columns)
+            placeholders = ", ".join("%s" for _ in key_columns)
+            query += " AND" if " WHERE " in query else " WHERE"
+            query += f" ({columns}) {operator} ({placeholders})"
+            params += tuple(getattr(after, column) for column in key_columns)
+
+        query += f" ORDER BY {order_clause} LIMIT %s"
+        params += (limit,)
+        if not keyset and offset:
+            query += " OFFSET %s"
+            params += (offset,)
+        return execute_query(query, params, fetch_all=True, row_type=ClientRow)
+
+    @staticmethod
+    def get_changed(since, search_term=None):
+        """
+        Get the clients inserted or updated since a time
+
+        Args:
+            since (datetime): Rows with an updated_at from this time on are returned
+            search_term (str): Optional search filter
+
+        Returns:
+            list: ClientRow tuples
+        """
+        query, params, _ = Client._list_query(search_term, 'nom')
+        query += " AND" if " WHERE " in query else " WHERE"
+        return execute_query(f"{query} c.updated_at >= %s", params + (since,), fetch_all=True, row_type=ClientRow)
 
     @staticmethod
-    def get_by_id(client_id):
-        """Get a client by ID"""
+    def count(search_term=None):
+        """Count clients matching an optional search"""
+        where_clause, params, _ = Client._search_clause(search_term)
+        result = execute_query(f"SELECT COUNT(*) AS total FROM clients c{where_clause}", params, fetch_one=True)
+        return result['total']
+
+    # Columns written by exports, with their header labels
+    EXPORT_COLUMNS = (
+        ('nom', 'Nom'), ('prenom', 'Prénom'), ('activite', 'Activité'),
+        ('phone', 'Téléphone'), ('email', 'Email'), ('address', 'Adresse'),
+        ('montant', 'Montant'), ('type', 'Type'), ('regime_fiscal', 'Régime Fiscal'),
+        ('agent_responsable', 'Agent Responsable'), ('forme_juridique', 'Forme Juridique'),
+        ('regime_cnas', 'Régime CNAS'), ('mode_paiement', 'Mode Paiement'),
+        ('honoraires_mois', 'Honoraires/Mois')
+    )
+
+    @staticmethod
+    def iter_export():
+        """Stream every client as a tuple of EXPORT_COLUMNS values"""
+        columns = ", ".join(column for column, _ in Client.EXPORT_COLUMNS)
+        return stream_query(f"SELECT {columns} FROM clients ORDER BY nom, prenom, id")
+
+    @staticmethod
+    def get_by_id(client_id, for_update=False):
+        """Get a client by ID, optionally locking the row for the current transaction"""
         query = "SELECT * FROM clients WHERE id = %s"
-        return execute_query(query, (client_id,), fetch_one=True)
+        if for_update:
+            query += " FOR UPDATE"
+        return execute_query(query, (client_id,), fetch_one=True, prepared=True)
+
+    @staticmethod
+    def get_balance(client_id, for_update=False):
+        """Get a client's balance, optionally locking the row for the current transaction"""
+        query = "SELECT montant FROM clients WHERE id = %s"
+        if for_update:
+            query += " FOR UPDATE"
+        result = execute_query(query, (client_id,), fetch_one=True, prepared=True)
+        if not result:
+            return None
+        return Decimal(str(result['montant'])) if result['montant'] is not None else Decimal('0.0')
+
+    @staticmethod
+    def adjust_balance(client_id, delta):
+        """Add a (possibly negative) amount to a client's balance in a single statement"""
+        execute_query(
+            "UPDATE clients SET montant = montant + %s WHERE id = %s",
+            (delta, client_id),
+            prepared=True
+        )
+
+    @staticmethod
+    def deduct_balance(client_id, amount):
+        """Subtract an amount from a client's balance in a single statement"""
+        Client.adjust_balance(client_id, -amount)
 
     @staticmethod
-    def get_id_by_details(nom, prenom, phone):
-        """Get client ID by name and phone details"""
-        query = "SELECT id FROM clients WHERE nom = %s AND prenom = %s AND phone = %s LIMIT 1"
-        result = execute_query(query, (nom, prenom, phone), fetch_one=True)
-        return result['id'] if result else None
+    def get_balances(client_ids, for_update=False):
+        """
+        Get the balances of several clients, optionally locking their rows
+
+        Returns:
+            dict: client id -> Decimal balance; missing clients are left out
+        """
+        client_ids = sorted(set(client_ids))
+        if not client_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(client_ids))
+        # Rows are locked in id order, like concurrent batches, to avoid deadlocks
+        query = f"SELECT id, montant FROM clients WHERE id IN ({placeholders}) ORDER BY id"
+        if for_update:
+            query += " FOR UPDATE"
+        rows = execute_query(query, tuple(client_ids), fetch_all=True)
+        return {row['id']: Decimal(str(row['montant'] or 0)) for row in rows}
+
+    @staticmethod
+    def deduct_balances(amounts):
+        """
+        Subtract an amount from each of several clients' balances in a single statement
+
+        Args:
+            amounts (dict): client id -> amount to subtract
+        """
+        if not amounts:
+            return
+        client_ids = sorted(amounts)
+        cases = " ".join(["WHEN %s THEN %s"] * len(client_ids))
+        placeholders = ", ".join(["%s"] * len(client_ids))
+        params = []
+        for client_id in client_ids:
+            params += [client_id, amounts[client_id]]
+        execute_query(
+            f"UPDATE clients SET montant = montant - CASE id {cases} END WHERE id IN ({placeholders})",
+            tuple(params) + tuple(client_ids)
+        )
 
     @staticmethod
     def get_clients_for_dropdown():
         """Get clients formatted for dropdown selection"""
-        query = "SELECT id, CONCAT(nom, ' ', prenom) as name FROM clients"
-        clients = execute_query(query, fetch_all=True)
-        return {row['id']: row['name'] for row in clients}
+        return client_directory.names()
+
+    @staticmethod
+    def get_id_by_name(name):
+        """Get a client ID from its dropdown label"""
+        return client_directory.id_for_name(name)
+
+    @staticmethod
+    def _load_directory(limit):
+        """Load the id and display name of the first clients in name order"""
+        query = "SELECT id, CONCAT(nom, ' ', prenom) as name FROM clients ORDER BY nom, prenom LIMIT %s"
+        return execute_query(query, (limit,), fetch_all=True)
+
+    @staticmethod
+    def _find_by_label(label):
+        """
+        Resolve a dropdown label with the (nom, prenom) index
+
+        Args:
+            label (str): "nom prenom", or "nom prenom (#id)" for a shared name
+
+        Returns:
+            int: The client id, or None when no client or several match
+        """
+        match = re.fullmatch(r"(.*) \(#(\d+)\)", label)
+        if match:
+            label, client_id = match.group(1), int(match.group(2))
+            row = execute_query(
+                "SELECT CONCAT(nom, ' ', prenom) as name FROM clients WHERE id = %s", (client_id,), fetch_one=True
+            )
+            return client_id if row and row['name'] == label else None
+
+        # nom and prenom may contain spaces: try every split of the label
+        splits = [(label[:i], label[i + 1:]) for i, char in enumerate(label) if char == ' ']
+        if not splits:
+            return None
+        conditions = " OR ".join(["(nom = %s AND prenom = %s)"] * len(splits))
+        rows = execute_query(
+            f"SELECT id FROM clients WHERE {conditions} LIMIT 2",
+            tuple(value for split in splits for value in split), fetch_all=True
+        )
+        return rows[0]['id'] if len(rows) == 1 else None
 
     def save(self):
-        """Save client to database (insert or update)"""
+        """
+        Save client to database (insert or update)
+
+        An existing client loaded with from_row() only writes the columns
+        changed since it was loaded, so concurrent changes to the other
+        columns (such as payments updating montant) are kept.
+        """
         if self.id:
-            # Update existing client
-            query = """
-            UPDATE clients SET 
-            nom=%s, prenom=%s, activite=%s, phone=%s, email=%s, 
-            address=%s, montant=%s, type=%s, regime_fiscal=%s, agent_responsable=%s,
-            forme_juridique=%s, regime_cnas=%s, mode_paiement=%s, honoraires_mois=%s
-            WHERE id=%s
-            """
-            params = (
-                self.nom, self.prenom, self.activite, self.phone, self.email, 
-                self.address, float(self.montant), self.type, self.regime_fiscal,
-                self.agent_responsable, self.forme_juridique, self.regime_cnas,
-                self.mode_paiement, float(self.honoraires_mois),
-                self.id
-            )
+            fields = self.dirty_fields()
+            if not fields:
+                return
+            assignments = ", ".join(f"{field}=%s" for field in fields)
+            query = f"UPDATE clients SET {assignments} WHERE id=%s"
+            params = tuple(self._param(field) for field in fields) + (self.id,)
         else:
             # Insert new client
-            query = """
+            fields = Client.FIELDS
+            query = Client.INSERT_QUERY
+            params = self._insert_params()
+        
+        execute_query(query, params)
+        self.mark_clean()
+        # The directory only holds names
+        if 'nom' in fields or 'prenom' in fields:
+            on_commit(client_directory.invalidate)
+
+    INSERT_QUERY = """
             INSERT INTO clients 
             (nom, prenom, activite, phone, email, address, montant, type, regime_fiscal, 
              agent_responsable, forme_juridique, regime_cnas, mode_paiement, honoraires_mois) 
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
-            params = (
-                self.nom, self.prenom, self.activite, self.phone, self.email, 
-                self.address, float(self.montant), self.type, self.regime_fiscal,
-                self.agent_responsable, self.forme_juridique, self.regime_cnas,
-                self.mode_paiement, float(self.honoraires_mois)
-            )
-        
-        execute_query(query, params)
+
+    def _param(self, field):
+        """Value of a field as passed to the database"""
+        value = getattr(self, field)
+        return float(value) if isinstance(value, Decimal) else value
+
+    def _insert_params(self):
+        """Parameters of INSERT_QUERY for this client"""
+        return tuple(self._param(field) for field in Client.FIELDS)
+
+    @staticmethod
+    def insert_many(clients):
+        """Insert new clients with a single batched statement"""
+        if not clients:
+            return
+        execute_many(Client.INSERT_QUERY, [client._insert_params() for client in clients])
+        on_commit(client_directory.invalidate)
 
     @staticmethod
     def delete(client_id):
         """Delete a client and all related versements"""
-        # Delete related versements first
-        execute_query("DELETE FROM versement WHERE client_id = %s", (client_id,))
-        # Delete client
-        execute_query("DELETE FROM clients WHERE id = %s", (client_id,))
+        with transaction():
+            # Delete related versements first
+            record_deletion('versement', "client_id = %s", (client_id,))
+            execute_query("DELETE FROM versement WHERE client_id = %s", (client_id,))
+            # Delete client
+            record_deletion('clients', "id = %s", (client_id,))
+            execute_query("DELETE FROM clients WHERE id = %s", (client_id,))
+            on_commit(client_directory.invalidate)
 
     def update_balance(self, amount):
         """Update client balance"""
         if self.id:
-            new_balance = float(self.montant) + amount
-            execute_query("UPDATE clients SET montant = %s WHERE id = %s", (new_balance, self.id))
-            self.montant = Decimal(str(new_balance))
\ No newline at end of file
+            Client.adjust_balance(self.id, amount)
+            self.montant += Decimal(str(amount))
+            if self._stored is not None:
+                self._stored['montant'] = self.montant
+
+
+# Shared directory of client names, invalidated whenever a client is written
+client_directory = ClientDirectory(
+    Client._load_directory,
+    Client._find_by_label,
+    ttl=CACHE_CONFIG['client_directory_ttl'],
+    max_size=CACHE_CONFIG['client_directory_max_size']
+)
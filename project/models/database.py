@@ -2,44 +2,553 @@
 Database connection and setup utilities
 """
 
-import mysql.connector
-from config import DB_CONFIG
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from config import DB_BACKEND, DB_CONFIG, SQLITE_CONFIG, QUERY_STATS_CONFIG, OFFLINE_CONFIG
+from models.backends import BACKENDS
+from models.query_stats import QueryStats
+
+_backend = None
+
+
+def get_backend():
+    """Return the storage backend selected by config.DB_BACKEND"""
+    global _backend
+    if _backend is None:
+        if DB_BACKEND not in BACKENDS:
+            raise ValueError(f"Backend de base de données inconnu: {DB_BACKEND}")
+        config = SQLITE_CONFIG if DB_BACKEND == 'sqlite' else DB_CONFIG
+        _backend = BACKENDS[DB_BACKEND](config)
+    return _backend
+
 
 def connect_db():
     """Create and return a database connection"""
-    return mysql.connector.connect(**DB_CONFIG)
+    return get_backend().connect()
+
+
+class DatabaseUnavailableError(ConnectionError):
+    """The database server cannot be reached or dropped the connection"""
+
+
+class CommitUnknownError(ConnectionError):
+    """
+    The connection dropped during a commit, so the writes may have been applied
+
+    Unlike DatabaseUnavailableError the write must not be queued for a later
+    replay, which would apply it twice if the server did commit it.
+    """
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of reusable database connections
+
+    Connections are opened lazily up to ``size``. A connection that has been
+    idle for longer than ``max_idle`` seconds is pinged before being handed
+    out and transparently reconnected if the server dropped it.
+
+    When the server cannot be reached DatabaseUnavailableError is raised,
+    and for ``retry_after`` seconds further requests fail immediately
+    instead of waiting for another connection timeout.
+    """
+
+    def __init__(self, size=5, timeout=10, max_idle=60, retry_after=15, backend=None):
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.retry_after = retry_after
+        self.backend = backend or get_backend()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._unavailable_until = 0.0
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'reconnected': 0,
+            'discarded': 0,
+            'waits': 0,
+            'in_use': 0,
+            'unavailable': 0,
+        }
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def _create(self):
+        """Open a new connection, reserving a slot in the pool"""
+        try:
+            conn = self.backend.connect()
+        except self.backend.disconnect_errors as e:
+            with self._lock:
+                self._open -= 1
+            self.mark_unavailable()
+            raise DatabaseUnavailableError(f"Serveur de base de données injoignable: {e}") from e
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+        self._count('created')
+        return conn
+
+    def mark_unavailable(self):
+        """Fail requests immediately for retry_after seconds"""
+        with self._lock:
+            self._unavailable_until = time.monotonic() + self.retry_after
+            self._stats['unavailable'] += 1
+
+    def mark_available(self):
+        """Let the next request try the server again"""
+        with self._lock:
+            self._unavailable_until = 0.0
+
+    def is_available(self):
+        """Return False while requests fail without trying the server"""
+        with self._lock:
+            return time.monotonic() >= self._unavailable_until
+
+    def _check(self, conn, last_used):
+        """Return a usable connection, reconnecting it if it went stale"""
+        if time.monotonic() - last_used < self.max_idle:
+            return conn
+        try:
+            if not conn.is_connected():
+                self.backend.reset_statements(conn)
+                conn.reconnect(attempts=1, delay=0)
+                self._count('reconnected')
+            return conn
+        except Exception:
+            self._discard(conn)
+            return None
+
+    def _discard(self, conn):
+        """Close a broken connection and free its slot"""
+        self.backend.reset_statements(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._stats['discarded'] += 1
+
+    def acquire(self):
+        """Take a healthy connection from the pool"""
+        if not self.is_available():
+            raise DatabaseUnavailableError("Serveur de base de données injoignable")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._open < self.size
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    conn = self._create()
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Aucune connexion disponible dans le pool")
+                self._count('waits')
+                try:
+                    conn, last_used = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+
+            conn = self._check(conn, last_used)
+            if conn is not None:
+                self._count('reused')
+                break
+
+        self._count('in_use')
+        return conn
+
+    def release(self, conn, broken=False):
+        """Return a connection to the pool"""
+        self._count('in_use', -1)
+        if broken:
+            self._discard(conn)
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
 
-def execute_query(query, params=None, fetch_one=False, fetch_all=False):
+    @contextmanager
+    def connection(self):
+        """
+        Context manager yielding a pooled connection
+
+        A connection lost while in use is discarded and reported as
+        DatabaseUnavailableError; its open transaction was rolled back by
+        the server. One lost during a commit is discarded as well.
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except self.backend.disconnect_errors as e:
+            broken = True
+            raise DatabaseUnavailableError(f"Connexion à la base de données perdue: {e}") from e
+        except CommitUnknownError:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def stats(self):
+        """Return a snapshot of the pool counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = self._open
+        stats['idle'] = self._idle.qsize()
+        stats['size'] = self.size
+        return stats
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                options = get_backend().pool_options
+                _pool = ConnectionPool(
+                    size=options.get('pool_size', 5),
+                    timeout=options.get('pool_timeout', 10),
+                    max_idle=options.get('pool_max_idle', 60),
+                    retry_after=OFFLINE_CONFIG['retry_after_s']
+                )
+    return _pool
+
+
+def get_pool_stats():
+    """Return statistics of the shared connection pool"""
+    return get_pool().stats()
+
+
+# Timings of every statement run through this module
+query_stats = QueryStats(
+    enabled=QUERY_STATS_CONFIG['enabled'],
+    slow_query_ms=QUERY_STATS_CONFIG['slow_query_ms'],
+    slow_log_size=QUERY_STATS_CONFIG['slow_log_size'],
+    samples=QUERY_STATS_CONFIG['samples']
+)
+
+
+def get_query_stats():
+    """Return per-statement timings and the slow-query log"""
+    return query_stats.snapshot()
+
+
+def dump_query_stats(path=None):
+    """Return the query statistics as JSON, also writing them to path if given"""
+    return query_stats.dump_json(path)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def transaction():
+    """
+    Run every execute_query call of the block in a single transaction
+
+    The block uses one pooled connection and commits once on exit, or rolls
+    back if an exception escapes. Nested calls join the outer transaction.
+    A connection lost during the commit raises CommitUnknownError.
+    """
+    if getattr(_local, 'conn', None) is not None:
+        yield _local.conn
+        return
+    if getattr(_local, 'recorded', None) is not None:
+        yield None
+        return
+
+    with get_pool().connection() as conn:
+        _local.conn = conn
+        _local.on_commit = []
+        try:
+            try:
+                conn.start_transaction()
+                yield conn
+            except Exception:
+                conn.rollback()
+                raise
+            _commit(conn)
+            for callback in _local.on_commit:
+                callback()
+        finally:
+            _local.conn = None
+            _local.on_commit = []
+
+
+def _commit(conn):
+    """Commit writes, reporting a connection lost during the commit as CommitUnknownError"""
+    try:
+        conn.commit()
+    except get_pool().backend.disconnect_errors as e:
+        raise CommitUnknownError(
+            "La connexion au serveur a été perdue pendant l'enregistrement; la modification a peut-être "
+            "été appliquée, vérifiez-la avant de recommencer"
+        ) from e
+
+
+def on_commit(callback):
+    """
+    Run a callback once the current writes are committed
+
+    Outside a transaction() block the callback runs immediately; inside one
+    it runs after the commit and is dropped on rollback.
+    """
+    if getattr(_local, 'conn', None) is not None:
+        _local.on_commit.append(callback)
+    else:
+        callback()
+
+
+def in_transaction():
+    """Return True inside a transaction() block"""
+    return getattr(_local, 'conn', None) is not None
+
+
+@contextmanager
+def record_queries():
+    """
+    Record the statements of the block instead of running them
+
+    execute_query, stream_query and execute_many append (query, params) to
+    the yielded list and return no rows, and transaction() does not open a
+    connection. Used to EXPLAIN the queries exactly as the models build them.
+    """
+    _local.recorded = []
+    try:
+        yield _local.recorded
+    finally:
+        _local.recorded = None
+
+
+def execute_query(query, params=None, fetch_one=False, fetch_all=False, row_type=None, prepared=False,
+                  snapshot=True):
     """
     Execute a database query with optional parameters
-    
+
+    Inside a transaction() block the query runs on the transaction's
+    connection and is committed with it; otherwise it is committed
+    immediately.
+
     Args:
         query (str): SQL query to execute
         params (tuple): Parameters for the query
         fetch_one (bool): Whether to fetch one result
         fetch_all (bool): Whether to fetch all results
-        
+        row_type (type): Build each row as row_type(*columns) from a plain
+            tuple cursor instead of a dict; used with a named tuple matching
+            the selected columns
+        prepared (bool): Run the query as a server-side prepared statement
+            cached on the connection; for hot queries with a fixed text
+        snapshot (bool): When the server is unreachable, answer a read made
+            outside a transaction from the offline snapshot (models.offline)
+
     Returns:
         Query result or None
     """
-    conn = connect_db()
-    cursor = conn.cursor(dictionary=True)
-    
+    recorded = getattr(_local, 'recorded', None)
+    if recorded is not None:
+        recorded.append((query, params or ()))
+        return [] if fetch_all else None
+
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return _run(conn, query, params, fetch_one, fetch_all, row_type, prepared)
+
+    try:
+        with get_pool().connection() as conn:
+            try:
+                result = _run(conn, query, params, fetch_one, fetch_all, row_type, prepared)
+            except Exception as e:
+                conn.rollback()
+                raise e
+            if fetch_one or fetch_all:
+                conn.commit()
+            else:
+                _commit(conn)
+            return result
+    except DatabaseUnavailableError:
+        if not snapshot or not (fetch_one or fetch_all):
+            raise
+        from models.offline import read_snapshot
+        return read_snapshot(query, params, fetch_one, fetch_all, row_type)
+
+
+def stream_query(query, params=None, batch_size=1000):
+    """
+    Stream the rows of a query without buffering the result set
+
+    Rows are read from the server in batches on a dedicated pooled
+    connection, so memory use does not grow with the size of the result.
+
+    Args:
+        query (str): SQL query to execute
+        params (tuple): Parameters for the query
+        batch_size (int): Rows fetched per round trip
+
+    Yields:
+        tuple: One row at a time
+    """
+    recorded = getattr(_local, 'recorded', None)
+    if recorded is not None:
+        recorded.append((query, params or ()))
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    cursor = conn.cursor(buffered=False)
+    finished = False
+    # Only the time spent in the driver is counted, not the consumer's
+    elapsed = 0.0
+    count = 0
     try:
+        started = time.perf_counter()
         cursor.execute(query, params or ())
-        
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            elapsed += time.perf_counter() - started
+            if not rows:
+                break
+            count += len(rows)
+            yield from rows
+            started = time.perf_counter()
+        finished = True
+        query_stats.record(query, elapsed, count)
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            finished = False
+        # A partially read result leaves the connection unusable
+        pool.release(conn, broken=not finished)
+
+
+def execute_many(query, seq_params):
+    """
+    Execute a statement once per parameter tuple in a single batch
+
+    Args:
+        query (str): SQL statement to execute
+        seq_params (list): One parameter tuple per execution
+
+    Returns:
+        int: Number of affected rows
+    """
+    recorded = getattr(_local, 'recorded', None)
+    if recorded is not None:
+        # The statement is the same for every parameter tuple
+        for params in seq_params:
+            recorded.append((query, params))
+            break
+        return 0
+
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return _run_many(conn, query, seq_params)
+
+    with get_pool().connection() as conn:
+        try:
+            rowcount = _run_many(conn, query, seq_params)
+        except Exception as e:
+            conn.rollback()
+            raise e
+        _commit(conn)
+        return rowcount
+
+
+def _run_many(conn, query, seq_params):
+    """Execute a batched statement on the given connection"""
+    cursor = conn.cursor()
+    try:
+        started = time.perf_counter()
+        cursor.executemany(query, seq_params)
+        query_stats.record(query, time.perf_counter() - started)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def _run(conn, query, params, fetch_one, fetch_all, row_type=None, prepared=False):
+    """Execute a query on the given connection, recording its timing"""
+    started = time.perf_counter()
+    result = _fetch(conn, query, params, fetch_one, fetch_all, row_type, prepared)
+    if isinstance(result, list):
+        rows = len(result)
+    else:
+        rows = 0 if result is None else 1
+    query_stats.record(query, time.perf_counter() - started, rows)
+    return result
+
+
+def _fetch(conn, query, params, fetch_one, fetch_all, row_type, prepared):
+    """Execute a query on the given connection and fetch its result"""
+    backend = get_backend()
+    if prepared and backend.prepared_statements:
+        return _run_prepared(backend, conn, query, params, fetch_one, fetch_all, row_type)
+
+    cursor = conn.cursor(dictionary=row_type is None, buffered=True)
+    try:
+        cursor.execute(query, params or ())
+
         if fetch_one:
-            result = cursor.fetchone()
+            row = cursor.fetchone()
+            return row if row is None or row_type is None else row_type(*row)
         elif fetch_all:
-            result = cursor.fetchall()
-        else:
-            result = None
-            
-        conn.commit()
-        return result
-    except Exception as e:
-        conn.rollback()
-        raise e
+            rows = cursor.fetchall()
+            return rows if row_type is None else [row_type(*row) for row in rows]
+        return None
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+
+
+def _run_prepared(backend, conn, query, params, fetch_one, fetch_all, row_type):
+    """Execute a query with the connection's prepared cursor for it"""
+    cursor = backend.prepared_cursor(conn, query)
+    try:
+        cursor.execute(query, tuple(params or ()))
+        if not (fetch_one or fetch_all):
+            return None
+        # The whole result is read so the cursor can be executed again
+        rows = cursor.fetchall()
+    except Exception:
+        backend.reset_statements(conn)
+        raise
+
+    if row_type is None:
+        columns = cursor.column_names
+        rows = [dict(zip(columns, row)) for row in rows]
+    else:
+        rows = [row_type(*row) for row in rows]
+    if fetch_one:
+        return rows[0] if rows else None
+    return rows
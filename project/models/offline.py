@@ -0,0 +1,440 @@
+"""
+Offline mode: write-behind journal and local snapshot
+
+When the MySQL server cannot be reached the controllers record their writes
+in a durable local journal instead of failing, and reads made outside a
+transaction are answered from a local SQLite copy of the clients and
+payments. Once the server is back the journal is replayed in batches, each
+entry checked against what other desktops changed in the meantime.
+"""
+
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+
+from config import DB_BACKEND, OFFLINE_CONFIG, SYNC_CONFIG
+from models.backends import SQLiteBackend
+from models.database import (
+    CommitUnknownError, ConnectionPool, DatabaseUnavailableError, execute_query, get_backend, get_pool,
+    in_transaction, stream_query, transaction, _run
+)
+
+logger = logging.getLogger(__name__)
+
+# Returned by a controller write that was queued instead of applied
+QueuedOperation = namedtuple('QueuedOperation', ['id', 'operation'])
+
+QUEUED_MESSAGE = ("Serveur injoignable: la modification est enregistrée sur ce poste "
+                  "et sera appliquée dès le retour de la connexion.")
+
+# Replay functions per operation name, registered by the controllers
+_replay_handlers = {}
+
+
+class ReplayConflict(ValueError):
+    """A queued write no longer applies to the current data"""
+
+
+def offline_enabled():
+    """Return True when writes are queued while the server is unreachable"""
+    return OFFLINE_CONFIG['enabled'] and DB_BACKEND != 'sqlite'
+
+
+def register_replay(operation, handler):
+    """
+    Register the function replaying a queued operation
+
+    Args:
+        operation (str): Name the operation is queued under, e.g. 'client.create'
+        handler (callable): handler(payload), run inside the replay
+            transaction; raises ValueError when the write no longer applies
+    """
+    _replay_handlers[operation] = handler
+
+
+def _text(value):
+    """Comparable text of a column value, the same whether read from the server or the snapshot"""
+    if value is None:
+        return ''
+    if isinstance(value, (Decimal, float)):
+        return f"{Decimal(str(value)):.2f}"
+    return str(value)
+
+
+def fingerprint(row, fields):
+    """Return the values of some fields of a row as text, to detect later changes"""
+    return {field: _text(row.get(field)) for field in fields}
+
+
+def check_unchanged(row, base):
+    """
+    Raise ReplayConflict if a row no longer has the values a write was based on
+
+    Args:
+        row (dict): Current row, None if it was deleted
+        base (dict): fingerprint() taken when the write was made
+    """
+    if row is None:
+        raise ReplayConflict("Enregistrement supprimé sur un autre poste entre-temps")
+    changed = [field for field, text in base.items() if _text(row.get(field)) != text]
+    if changed:
+        raise ReplayConflict(f"Modifié sur un autre poste entre-temps: {', '.join(changed)}")
+
+
+class OfflineJournal:
+    """
+    Durable queue of the writes made while the server is unreachable
+
+    Entries live in a local SQLite file written with synchronous=FULL, so a
+    queued write survives a crash. Each entry has an operation name, its JSON
+    payload and a status: pending, applied, conflict or dismissed. The file
+    also holds an origin id identifying this desktop on the server.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._origin = None
+
+    def _connection(self):
+        """Open the journal file on first use"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = FULL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS journal (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_status ON journal (status, id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'origin'").fetchone()
+            if row is None:
+                row = (str(uuid.uuid4()),)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('origin', ?)", row)
+            self._origin = row[0]
+            self._conn = conn
+        return self._conn
+
+    @property
+    def origin(self):
+        """Id of this desktop's journal, recorded on the server with each replayed entry"""
+        with self._lock:
+            self._connection()
+            return self._origin
+
+    def record(self, operation, payload):
+        """Append a write to the journal, returning it as a QueuedOperation"""
+        created_at = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+        with self._lock:
+            cursor = self._connection().execute(
+                "INSERT INTO journal (created_at, operation, payload) VALUES (?, ?, ?)",
+                (created_at, operation, json.dumps(payload, default=str))
+            )
+        logger.info("Écriture mise en attente hors ligne: %s #%d", operation, cursor.lastrowid)
+        return QueuedOperation(cursor.lastrowid, operation)
+
+    def queue(self, operation, payload, error):
+        """
+        Record a write that failed because the server is unreachable
+
+        The error is raised again when offline mode is disabled, and during a
+        replay, whose entry must stay pending instead of being queued twice.
+        """
+        if not offline_enabled() or in_transaction():
+            raise error
+        return self.record(operation, payload)
+
+    def pending(self, limit):
+        """Return the oldest pending entries as (id, operation, payload)"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, operation, payload FROM journal WHERE status = 'pending' ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(entry_id, operation, json.loads(payload)) for entry_id, operation, payload in rows]
+
+    def mark(self, results):
+        """Record the outcome of replayed entries, a list of (id, status, error)"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            conn.executemany("UPDATE journal SET status = ?, error = ? WHERE id = ?",
+                             [(status, error, entry_id) for entry_id, status, error in results])
+            conn.execute("COMMIT")
+
+    def counts(self):
+        """Return the number of entries per status"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM journal GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def conflicts(self):
+        """Return the entries rejected at replay, oldest first"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, created_at, operation, payload, error FROM journal "
+                "WHERE status = 'conflict' ORDER BY id"
+            ).fetchall()
+        return [
+            {'id': entry_id, 'created_at': created_at, 'operation': operation,
+             'payload': json.loads(payload), 'error': error}
+            for entry_id, created_at, operation, payload, error in rows
+        ]
+
+    def dismiss_conflicts(self):
+        """Mark the rejected entries as seen"""
+        with self._lock:
+            self._connection().execute("UPDATE journal SET status = 'dismissed' WHERE status = 'conflict'")
+
+
+class OfflineSnapshot:
+    """
+    Local SQLite copy of the clients and payments, read while offline
+
+    The first refresh copies both tables; later ones only read the rows
+    changed since the previous refresh and the tombstones of deleted rows
+    (see models.changes), like the views polling for changes.
+    """
+
+    TABLES = ('clients', 'versement')
+
+    def __init__(self, path):
+        self.backend = SQLiteBackend({'path': path})
+        self.refreshed_at = None
+        self._pool = None
+        self._watermark = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def pool(self):
+        """Return the pool of the snapshot file, creating its tables on first use"""
+        with self._lock:
+            if self._pool is None:
+                from models.schema import sqlite_schema_sql
+                pool = ConnectionPool(size=2, backend=self.backend)
+                with pool.connection() as conn:
+                    cursor = conn.cursor()
+                    for table in self.TABLES:
+                        for statement in sqlite_schema_sql(table):
+                            cursor.execute(statement)
+                    cursor.execute("CREATE TABLE IF NOT EXISTS snapshot_meta (key TEXT PRIMARY KEY, value TEXT)")
+                    cursor.execute("SELECT value FROM snapshot_meta WHERE key = 'watermark'")
+                    row = cursor.fetchone()
+                    cursor.close()
+                self._watermark = datetime.datetime.fromisoformat(row[0]) if row else None
+                self._pool = pool
+            return self._pool
+
+    def ready(self):
+        """Return True once a first copy has been made"""
+        self.pool()
+        return self._watermark is not None
+
+    def refresh_due(self):
+        """Return True when the copy has not been refreshed for snapshot_refresh_s"""
+        return (self.refreshed_at is None
+                or time.monotonic() - self.refreshed_at >= OFFLINE_CONFIG['snapshot_refresh_s'])
+
+    def refresh(self):
+        """Copy the rows changed on the server since the last refresh (runs in the background)"""
+        from models.changes import server_time, deleted_since
+        from models.schema import COLUMNS
+
+        with self._refresh_lock:
+            pool = self.pool()
+            since = self._watermark
+            watermark = server_time()
+            if since is not None:
+                since -= datetime.timedelta(seconds=SYNC_CONFIG['overlap_s'])
+
+            copied = 0
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                # INSERT OR REPLACE deletes the old row, which must not cascade
+                cursor.execute("PRAGMA foreign_keys = OFF")
+                conn.start_transaction()
+                try:
+                    for table in self.TABLES:
+                        columns = [name for name, _ in COLUMNS[table]]
+                        query = f"SELECT {', '.join(columns)} FROM {table}"
+                        params = ()
+                        if since is None:
+                            cursor.execute(f"DELETE FROM {table}")
+                        else:
+                            query += " WHERE updated_at >= %s"
+                            params = (since,)
+                        insert = (f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                                  f"VALUES ({', '.join(['%s'] * len(columns))})")
+                        batch = []
+                        for row in stream_query(query, params):
+                            batch.append(row)
+                            if len(batch) >= 1000:
+                                cursor.executemany(insert, batch)
+                                copied += len(batch)
+                                batch = []
+                        if batch:
+                            cursor.executemany(insert, batch)
+                            copied += len(batch)
+                        if since is not None:
+                            deleted = deleted_since(table, since)
+                            for start in range(0, len(deleted), 500):
+                                chunk = deleted[start:start + 500]
+                                cursor.execute(
+                                    f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk
+                                )
+                    cursor.execute("INSERT OR REPLACE INTO snapshot_meta (key, value) VALUES ('watermark', %s)",
+                                   (watermark.isoformat(sep=' '),))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.execute("PRAGMA foreign_keys = ON")
+                    cursor.close()
+
+            self._watermark = watermark
+            self.refreshed_at = time.monotonic()
+            return copied
+
+    def query(self, query, params, fetch_one, fetch_all, row_type):
+        """Run a read on the local copy"""
+        with self.pool().connection() as conn:
+            return _run(conn, query, params, fetch_one, fetch_all, row_type)
+
+
+offline_journal = OfflineJournal(OFFLINE_CONFIG['journal_path'])
+offline_snapshot = OfflineSnapshot(OFFLINE_CONFIG['snapshot_path'])
+
+
+def read_snapshot(query, params, fetch_one, fetch_all, row_type):
+    """
+    Answer a read from the local copy while the server is unreachable
+
+    Raises:
+        DatabaseUnavailableError: No copy was made yet, or the query needs
+            the server (FULLTEXT search)
+    """
+    if not offline_enabled() or not offline_snapshot.ready():
+        raise DatabaseUnavailableError("Serveur de base de données injoignable")
+    if "MATCH(" in query:
+        raise DatabaseUnavailableError("Recherche indisponible hors ligne, effacez le filtre de recherche")
+    return offline_snapshot.query(query, params, fetch_one, fetch_all, row_type)
+
+
+def _is_disconnect(error):
+    """Return True for errors meaning the server went away during the replay"""
+    # A replayed batch lost during its commit is safe to retry: replayed_operations
+    # was written in the same transaction
+    return isinstance(error, (DatabaseUnavailableError, CommitUnknownError) + tuple(get_backend().disconnect_errors))
+
+
+def was_replayed(origin, entry_id):
+    """Return True if a journal entry was already applied on the server"""
+    return execute_query(
+        "SELECT id FROM replayed_operations WHERE origin = %s AND entry_id = %s",
+        (origin, entry_id), fetch_one=True
+    ) is not None
+
+
+def replay_journal(batch_size=None):
+    """
+    Apply the pending journal entries on the server
+
+    Each batch runs in one transaction, each entry in a savepoint: an entry
+    that no longer applies (ReplayConflict, a balance now too low, a client
+    deleted meanwhile...) is rolled back alone and marked as a conflict. Replayed entries
+    are recorded in replayed_operations in the same transaction, so an entry
+    committed before the journal was updated is not applied twice.
+
+    Returns:
+        dict: {'applied': int, 'conflicts': int}
+    """
+    batch_size = batch_size or OFFLINE_CONFIG['replay_batch_size']
+    origin = offline_journal.origin
+    totals = {'applied': 0, 'conflicts': 0}
+
+    while True:
+        entries = offline_journal.pending(batch_size)
+        if not entries:
+            return totals
+
+        results = []
+        with transaction():
+            for entry_id, operation, payload in entries:
+                if was_replayed(origin, entry_id):
+                    results.append((entry_id, 'applied', None))
+                    continue
+
+                execute_query("SAVEPOINT journal_entry")
+                try:
+                    handler = _replay_handlers.get(operation)
+                    if handler is None:
+                        raise ReplayConflict(f"Opération inconnue: {operation}")
+                    handler(payload)
+                    execute_query("INSERT INTO replayed_operations (origin, entry_id) VALUES (%s, %s)",
+                                  (origin, entry_id))
+                    execute_query("RELEASE SAVEPOINT journal_entry")
+                    results.append((entry_id, 'applied', None))
+                except Exception as e:
+                    if _is_disconnect(e):
+                        raise
+                    execute_query("ROLLBACK TO SAVEPOINT journal_entry")
+                    logger.warning("Écriture hors ligne #%d rejetée (%s): %s", entry_id, operation, e)
+                    results.append((entry_id, 'conflict', str(e)))
+
+        offline_journal.mark(results)
+        for _, status, _ in results:
+            totals['applied' if status == 'applied' else 'conflicts'] += 1
+
+
+def synchronize():
+    """
+    Replay the journal and refresh the snapshot when the server is reachable (runs in the background)
+
+    Returns:
+        dict: {'online': bool, 'applied': int, 'conflicts': int,
+               'pending': int} where conflicts counts every entry awaiting review
+    """
+    status = {'online': False, 'applied': 0, 'conflicts': 0, 'pending': 0}
+    if not offline_enabled():
+        status['online'] = True
+        return status
+
+    counts = offline_journal.counts()
+    pool = get_pool()
+    try:
+        if counts.get('pending') or not pool.is_available():
+            # Try the server now instead of waiting for retry_after
+            pool.mark_available()
+            execute_query("SELECT 1", fetch_one=True, snapshot=False)
+        status['online'] = True
+        if counts.get('pending'):
+            status['applied'] = replay_journal()['applied']
+        if offline_snapshot.refresh_due():
+            offline_snapshot.refresh()
+    except Exception as e:
+        if not _is_disconnect(e):
+            raise
+        logger.info("Serveur injoignable: %s", e)
+        status['online'] = False
+
+    counts = offline_journal.counts()
+    status['pending'] = counts.get('pending', 0)
+    status['conflicts'] = counts.get('conflict', 0)
+    return status
@@ -0,0 +1,141 @@
+"""
+Per-statement timing statistics and slow-query log
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import traceback
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Modules of the database layer, skipped when looking for the caller
+_DATABASE_MODULES = ('database.py', 'backends.py', 'query_stats.py')
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query):
+    """
+    Reduce a query to its shape so calls with different values share a key
+
+    Whitespace is collapsed, literals and placeholders become ``?`` and
+    lists of placeholders (``IN (?, ?, ?)``) become a single ``?, ...``.
+    """
+    query = " ".join(query.split())
+    query = _STRING.sub("?", query)
+    query = _NUMBER.sub("?", query)
+    query = query.replace("%s", "?")
+    return _PLACEHOLDERS.sub("?, ...", query)
+
+
+def caller_location():
+    """Return 'file:line in function' of the first frame outside the database layer"""
+    for frame in reversed(traceback.extract_stack()):
+        if os.path.basename(frame.filename) not in _DATABASE_MODULES:
+            return f"{frame.filename}:{frame.lineno} in {frame.name}"
+    return "?"
+
+
+class QueryStats:
+    """
+    Thread-safe timings of the executed statements, keyed by normalized SQL
+
+    Each statement keeps its call count, total and maximum duration, the
+    rows it returned and the latest ``samples`` durations for percentiles.
+    Statements slower than ``slow_query_ms`` are logged with their caller
+    and kept in a bounded slow-query log.
+    """
+
+    def __init__(self, enabled=True, slow_query_ms=200, slow_log_size=100, samples=1000):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._slow = deque(maxlen=slow_log_size)
+
+    def record(self, query, duration, rows=0):
+        """
+        Record one execution
+
+        Args:
+            query (str): SQL as executed
+            duration (float): Seconds spent executing and fetching
+            rows (int): Rows returned
+        """
+        if not self.enabled:
+            return
+        key = normalize_sql(query)
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0,
+                    'durations': deque(maxlen=self.samples)
+                }
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['rows'] += rows
+            entry['durations'].append(duration)
+
+        if duration * 1000 >= self.slow_query_ms:
+            caller = caller_location()
+            with self._lock:
+                self._slow.append({
+                    'sql': key,
+                    'ms': round(duration * 1000, 3),
+                    'rows': rows,
+                    'caller': caller,
+                })
+            logger.warning("Requête lente (%.1f ms, %d lignes) depuis %s: %s",
+                           duration * 1000, rows, caller, key)
+
+    def snapshot(self):
+        """
+        Return the statistics, slowest total time first
+
+        Returns:
+            dict: {'statements': [...], 'slow_queries': [...]}
+        """
+        with self._lock:
+            entries = [(key, dict(entry), sorted(entry['durations'])) for key, entry in self._statements.items()]
+            slow = list(self._slow)
+
+        statements = []
+        for key, entry, durations in entries:
+            p95 = durations[max(math.ceil(len(durations) * 0.95) - 1, 0)] if durations else 0.0
+            statements.append({
+                'sql': key,
+                'count': entry['count'],
+                'total_ms': round(entry['total'] * 1000, 3),
+                'mean_ms': round(entry['total'] / entry['count'] * 1000, 3),
+                'p95_ms': round(p95 * 1000, 3),
+                'max_ms': round(entry['max'] * 1000, 3),
+                'rows': entry['rows'],
+            })
+        statements.sort(key=lambda statement: statement['total_ms'], reverse=True)
+        return {'statements': statements, 'slow_queries': slow}
+
+    def dump_json(self, path=None):
+        """Return the statistics as JSON, also writing them to path if given"""
+        text = json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
+
+    def reset(self):
+        """Forget every recorded statement"""
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
@@ -0,0 +1,476 @@
+"""
+Database schema creation, migration and index checks
+
+Usage:
+    python -m models.schema create    Create missing tables
+    python -m models.schema migrate   Add missing columns, indexes and foreign keys
+    python -m models.schema check     EXPLAIN the model queries and flag full scans
+"""
+
+import argparse
+import sys
+
+from config import SEARCH_CONFIG
+from models.changes import deleted_since
+from models.client import Client, ClientRow
+from models.database import execute_query, get_backend, get_pool, record_queries
+from models.versement import Versement, VersementRow
+
+# Column definitions per table, in creation order
+COLUMNS = {
+    'clients': [
+        ('id', "INT AUTO_INCREMENT PRIMARY KEY"),
+        ('nom', "VARCHAR(255) NOT NULL"),
+        ('prenom', "VARCHAR(255) DEFAULT ''"),
+        ('activite', "VARCHAR(255) DEFAULT ''"),
+        ('annee', "VARCHAR(50) DEFAULT ''"),
+        ('agent_responsable', "VARCHAR(255) DEFAULT ''"),
+        ('forme_juridique', "VARCHAR(100) DEFAULT ''"),
+        ('regime_fiscal', "VARCHAR(100) DEFAULT ''"),
+        ('regime_cnas', "VARCHAR(100) DEFAULT ''"),
+        ('mode_paiement', "VARCHAR(100) DEFAULT ''"),
+        ('indicateur', "VARCHAR(50) DEFAULT ''"),
+        ('recette_impots', "VARCHAR(255) DEFAULT ''"),
+        ('observation', "TEXT"),
+        ('source', "VARCHAR(255) DEFAULT ''"),
+        ('honoraires_mois', "DECIMAL(10,2) DEFAULT 0.00"),
+        ('montant', "DECIMAL(10,2) DEFAULT 0.00"),
+        ('phone', "VARCHAR(50) DEFAULT ''"),
+        ('email', "VARCHAR(255) DEFAULT ''"),
+        ('company', "VARCHAR(255) DEFAULT ''"),
+        ('address', "TEXT"),
+        ('type', "VARCHAR(255) DEFAULT ''"),
+        ('created_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ('updated_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    ],
+    'versement': [
+        ('id', "INT AUTO_INCREMENT PRIMARY KEY"),
+        ('client_id', "INT NOT NULL"),
+        ('montant', "DECIMAL(10,2) NOT NULL"),
+        ('type', "VARCHAR(255) NOT NULL"),
+        ('date_paiement', "DATE NOT NULL"),
+        ('annee_concernee', "INT NOT NULL"),
+        ('created_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ('updated_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    ],
+    # Tombstones of deleted rows, read by the views polling for changes
+    'deleted_rows': [
+        ('id', "INT AUTO_INCREMENT PRIMARY KEY"),
+        ('table_name', "VARCHAR(64) NOT NULL"),
+        ('row_id', "INT NOT NULL"),
+        ('deleted_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+    ],
+    # Journal entries of each desktop already replayed (see models.offline)
+    'replayed_operations': [
+        ('id', "INT AUTO_INCREMENT PRIMARY KEY"),
+        ('origin', "VARCHAR(36) NOT NULL"),
+        ('entry_id', "INT NOT NULL"),
+        ('replayed_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+    ],
+}
+
+# Secondary indexes per table: name -> columns
+INDEXES = {
+    'clients': {
+        # Name sort and its keyset (nom, prenom, id); the id is appended implicitly
+        'idx_nom_prenom': ('nom', 'prenom'),
+        # Balance sort and its keyset (montant, id)
+        'idx_montant': ('montant',),
+        # Rows changed since a watermark
+        'idx_clients_updated_at': ('updated_at',),
+    },
+    'versement': {
+        # Payments of one client, newest first; also backs the foreign key
+        'idx_client_date': ('client_id', 'date_paiement'),
+        # Versement list order and its keyset (date_paiement, id)
+        'idx_date_paiement': ('date_paiement',),
+        # Year filter
+        'idx_annee_date': ('annee_concernee', 'date_paiement'),
+        # Rows changed since a watermark
+        'idx_versement_updated_at': ('updated_at',),
+    },
+    'deleted_rows': {
+        # Tombstones of one table since a watermark, and their purge
+        'idx_table_deleted': ('table_name', 'deleted_at'),
+    },
+    'replayed_operations': {
+        # Replay check of one journal entry
+        'idx_origin_entry': ('origin', 'entry_id'),
+    },
+}
+
+# FULLTEXT (ngram) indexes per table, MySQL only: name -> columns.
+# The ngram parser drops every token containing a stopword, and InnoDB's
+# default English list has "a" and "i": with it most bigrams of client names
+# ("HA", "AM", "MA"...) would never be indexed. Indexes are therefore built
+# with the stopword list disabled, see FULLTEXT_SESSION.
+FULLTEXT_INDEXES = {
+    'clients': {
+        # Client search (see Client.SEARCH_COLUMNS)
+        'ft_clients_search': ('nom', 'prenom', 'phone', 'activite'),
+    },
+}
+
+# Run before creating a FULLTEXT index, on the same connection; InnoDB reads
+# the stopword setting when the index is built
+FULLTEXT_SESSION = "SET SESSION innodb_ft_enable_stopword = OFF"
+
+# Foreign keys per table: name -> (column, referenced table, ON DELETE rule)
+FOREIGN_KEYS = {
+    'versement': {
+        'fk_versement_client': ('client_id', 'clients', 'CASCADE'),
+    },
+}
+
+# Sample arguments of the model calls checked by check_queries
+_SAMPLE_CLIENT = ClientRow(1000000, 'M', '', '', '', '', 1000, '', '', '')
+_SAMPLE_VERSEMENT = VersementRow(1000000, '', 0, '', '2024-01-01', 2024)
+_SINCE = '2024-01-01 00:00:00'
+
+
+def model_calls():
+    """
+    Return the model calls whose queries check_queries EXPLAINs
+
+    The queries are recorded while the models build them, so the check
+    follows the code. Calls that read a whole table by design (full lists,
+    exports, LIKE searches) are flagged as expected scans.
+
+    Returns:
+        list: (name, callable, full scan expected)
+    """
+    from models.offline import was_replayed
+
+    # Searches use the FULLTEXT index when there is one, LIKE otherwise
+    like_search = not (SEARCH_CONFIG['fulltext'] and get_backend().supports_fulltext)
+    calls = [
+        ("Client.get_all", lambda: Client.get_all(), True),
+        ("Client.get_all (recherche)", lambda: Client.get_all('pharma', 'relevance'), like_search),
+        ("Client.get_all (recherche LIKE)", lambda: Client.get_all('a'), True),
+        ("Client.get_page (offset)", lambda: Client.get_page(offset=1000), False),
+        ("Client.get_page (recherche)", lambda: Client.get_page('pharma', 'relevance'), like_search),
+        ("Client.get_changed", lambda: Client.get_changed(_SINCE), False),
+        ("Client.count", lambda: Client.count(), False),
+        ("Client.count (recherche)", lambda: Client.count('pharma'), like_search),
+        ("Client.iter_export", lambda: list(Client.iter_export()), True),
+        ("Client.get_by_id", lambda: Client.get_by_id(1, for_update=True), False),
+        ("Client.get_balance", lambda: Client.get_balance(1, for_update=True), False),
+        ("Client.get_balances", lambda: Client.get_balances([1, 2, 3], for_update=True), False),
+        ("Client.adjust_balance", lambda: Client.adjust_balance(1, 0), False),
+        ("Client.deduct_balances", lambda: Client.deduct_balances({1: 0, 2: 0}), False),
+        ("Client._load_directory", lambda: Client._load_directory(50001), False),
+        ("Client._find_by_label", lambda: Client._find_by_label('M A B'), False),
+        ("Client._find_by_label (#id)", lambda: Client._find_by_label('M A (#1)'), False),
+        ("Client.delete", lambda: Client.delete(0), False),
+        ("Versement.get_all", lambda: Versement.get_all(), True),
+        ("Versement.get_page", lambda: Versement.get_page(), False),
+        ("Versement.get_page (keyset)", lambda: Versement.get_page(after=_SAMPLE_VERSEMENT), False),
+        ("Versement.get_page (client)", lambda: Versement.get_page({'client_id': 1}), False),
+        ("Versement.get_page (annee)", lambda: Versement.get_page({'annee_concernee': 2024}), False),
+        ("Versement.get_page (dates)",
+         lambda: Versement.get_page({'date_from': '2024-01-01', 'date_to': '2024-12-31'}), False),
+        ("Versement.get_changed", lambda: Versement.get_changed(_SINCE), False),
+        ("Versement.iter_export", lambda: list(Versement.iter_export()), True),
+        ("Versement.iter_export (client, annee)", lambda: list(Versement.iter_export(1, 2024)), False),
+        ("Versement.get_client_history", lambda: Versement.get_client_history(1), False),
+        ("Versement.get_by_id", lambda: Versement.get_by_id(1), False),
+        ("Versement.get_amount", lambda: Versement.get_amount(1, for_update=True), False),
+        ("changes.deleted_since", lambda: deleted_since('clients', _SINCE), False),
+        ("offline.was_replayed", lambda: was_replayed('', 1), False),
+    ]
+    for sort_by, (_, key_columns, _) in Client.SORT_OPTIONS.items():
+        if key_columns is not None:
+            calls.append((f"Client.get_page ({sort_by})", lambda sort_by=sort_by: Client.get_page(sort_by=sort_by), False))
+            calls.append((f"Client.get_page ({sort_by}, keyset)",
+                          lambda sort_by=sort_by: Client.get_page(sort_by=sort_by, after=_SAMPLE_CLIENT), False))
+    return calls
+
+
+def recorded_queries():
+    """
+    Run the model calls without touching the database and collect their statements
+
+    Returns:
+        list: (name, query, params, full scan expected)
+    """
+    queries = []
+    for name, call, expected in model_calls():
+        with record_queries() as recorded:
+            try:
+                call()
+            except (TypeError, KeyError):
+                pass  # No rows are returned while recording; the statements issued so far are kept
+        for index, (query, params) in enumerate(recorded):
+            label = name if len(recorded) == 1 else f"{name} #{index + 1}"
+            queries.append((label, " ".join(query.split()), params, expected))
+    return queries
+
+
+def _index_sql(name, columns, fulltext=False):
+    """Build the definition of an index inside CREATE or ALTER TABLE"""
+    if fulltext:
+        return f"FULLTEXT INDEX {name} ({', '.join(columns)}) WITH PARSER ngram"
+    return f"INDEX {name} ({', '.join(columns)})"
+
+
+def _sqlite_column(definition):
+    """Translate a MySQL column definition for SQLite"""
+    definition = definition.replace("INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+    definition = definition.replace(" ON UPDATE CURRENT_TIMESTAMP", "")
+    # Compare text case-insensitively, like the MySQL default collation
+    if definition.startswith(("VARCHAR", "TEXT")):
+        data_type, _, rest = definition.partition(" ")
+        definition = f"{data_type} COLLATE NOCASE {rest}".strip()
+    return definition
+
+
+def _sqlite_triggers_sql(table):
+    """
+    Build the triggers of a table for SQLite
+
+    SQLite has no ON UPDATE CURRENT_TIMESTAMP, a trigger stamps updated_at
+    instead unless the update set it itself. A column added by migrate()
+    has no default either, so inserted rows are stamped by a trigger too.
+
+    Returns:
+        dict: trigger name -> CREATE TRIGGER statement
+    """
+    if 'updated_at' not in dict(COLUMNS[table]):
+        return {}
+    stamp = f"BEGIN UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id; END"
+    return {
+        f"trg_{table}_updated_at": (
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at AFTER UPDATE ON {table} "
+            f"FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at {stamp}"
+        ),
+        f"trg_{table}_inserted_at": (
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_inserted_at AFTER INSERT ON {table} "
+            f"FOR EACH ROW WHEN NEW.updated_at IS NULL {stamp}"
+        ),
+    }
+
+
+def _foreign_keys_sql(table):
+    """Build the foreign key constraints of a table"""
+    return [
+        f"CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {reference}(id) ON DELETE {on_delete}"
+        for name, (column, reference, on_delete) in FOREIGN_KEYS.get(table, {}).items()
+    ]
+
+
+def create_table_sql(table):
+    """Build the CREATE TABLE statement of a table for MySQL"""
+    parts = [f"{name} {definition}" for name, definition in COLUMNS[table]]
+    parts += [_index_sql(name, columns) for name, columns in INDEXES.get(table, {}).items()]
+    parts += [_index_sql(name, columns, fulltext=True)
+              for name, columns in FULLTEXT_INDEXES.get(table, {}).items()]
+    parts += _foreign_keys_sql(table)
+    body = ",\n    ".join(parts)
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n    {body}\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+
+
+def sqlite_schema_sql(table):
+    """
+    Build the statements creating a table and its indexes for SQLite
+
+    FULLTEXT indexes have no SQLite equivalent; client search falls back to
+    LIKE on that backend.
+
+    Returns:
+        list: CREATE TABLE followed by one CREATE INDEX per index and the
+            triggers of the table
+    """
+    parts = [f"{name} {_sqlite_column(definition)}" for name, definition in COLUMNS[table]]
+    parts += _foreign_keys_sql(table)
+    body = ",\n    ".join(parts)
+    statements = [f"CREATE TABLE IF NOT EXISTS {table} (\n    {body}\n)"]
+    statements += [
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+        for name, columns in INDEXES.get(table, {}).items()
+    ]
+    statements += list(_sqlite_triggers_sql(table).values())
+    return statements
+
+
+def create_schema():
+    """Create every missing table with its indexes and foreign keys"""
+    if get_backend().name == 'sqlite':
+        # Indexes of existing tables may need columns only migrate() adds
+        existing = {row['name'] for row in execute_query(
+            "SELECT name FROM sqlite_master WHERE type = 'table'", fetch_all=True
+        )}
+        for table in COLUMNS:
+            if table not in existing:
+                for statement in sqlite_schema_sql(table):
+                    execute_query(statement)
+        return
+    _run_statements([FULLTEXT_SESSION] + [create_table_sql(table) for table in COLUMNS])
+
+
+def _run_statements(statements):
+    """Run statements in order on one connection, so session settings apply to the following ones"""
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+            conn.commit()
+        finally:
+            cursor.close()
+
+
+def _existing(query, table):
+    """Run an information_schema query for a table, keyed by its first column"""
+    rows = execute_query(query, (table,), fetch_all=True)
+    return {list(row.values())[0]: row for row in rows}
+
+
+def _migrate_sqlite():
+    """Add missing columns and indexes to SQLite tables"""
+    executed = []
+    for table, columns in COLUMNS.items():
+        existing_columns = {row['name'] for row in execute_query(f"PRAGMA table_info({table})", fetch_all=True)}
+        for name, definition in columns:
+            if name in existing_columns:
+                continue
+            definition = _sqlite_column(definition)
+            if "DEFAULT CURRENT_TIMESTAMP" in definition:
+                # Added columns need a constant default, existing rows are stamped now
+                executed.append(f"ALTER TABLE {table} ADD COLUMN {name} "
+                                f"{definition.replace('DEFAULT CURRENT_TIMESTAMP', '').strip()}")
+                executed.append(f"UPDATE {table} SET {name} = CURRENT_TIMESTAMP")
+            else:
+                executed.append(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        # CREATE INDEX IF NOT EXISTS is a no-op for existing indexes; foreign
+        # keys cannot be altered on SQLite and are only set at creation
+        existing_indexes = {row['name'] for row in execute_query(f"PRAGMA index_list({table})", fetch_all=True)}
+        for statement, name in zip(sqlite_schema_sql(table)[1:], INDEXES.get(table, {})):
+            if name not in existing_indexes:
+                executed.append(statement)
+        existing_triggers = {row['name'] for row in execute_query(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", (table,), fetch_all=True
+        )}
+        for name, statement in _sqlite_triggers_sql(table).items():
+            if name not in existing_triggers:
+                executed.append(statement)
+    return executed
+
+
+def migrate():
+    """
+    Bring existing tables up to date
+
+    Adds missing columns and indexes, and (re)creates foreign keys whose
+    ON DELETE rule differs from the expected one.
+
+    Returns:
+        list: Statements that were executed
+    """
+    create_schema()
+    if get_backend().name == 'sqlite':
+        executed = _migrate_sqlite()
+        for statement in executed:
+            execute_query(statement)
+        return executed
+
+    executed = []
+
+    for table, columns in COLUMNS.items():
+        existing_columns = _existing(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", table
+        )
+        for name, definition in columns:
+            if name not in existing_columns:
+                executed.append(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+        existing_indexes = _existing(
+            "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", table
+        )
+        indexes = [(name, columns, False) for name, columns in INDEXES.get(table, {}).items()]
+        indexes += [(name, columns, True) for name, columns in FULLTEXT_INDEXES.get(table, {}).items()]
+        for name, index_columns, fulltext in indexes:
+            if name not in existing_indexes:
+                if fulltext and FULLTEXT_SESSION not in executed:
+                    executed.append(FULLTEXT_SESSION)
+                executed.append(f"ALTER TABLE {table} ADD {_index_sql(name, index_columns, fulltext)}")
+
+        # Foreign keys are matched by column, older databases named them automatically
+        existing_keys = _existing(
+            "SELECT k.COLUMN_NAME, k.CONSTRAINT_NAME, r.DELETE_RULE "
+            "FROM information_schema.KEY_COLUMN_USAGE k "
+            "JOIN information_schema.REFERENTIAL_CONSTRAINTS r "
+            "ON r.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA AND r.CONSTRAINT_NAME = k.CONSTRAINT_NAME "
+            "WHERE k.TABLE_SCHEMA = DATABASE() AND k.TABLE_NAME = %s", table
+        )
+        for name, (column, reference, on_delete) in FOREIGN_KEYS.get(table, {}).items():
+            current = existing_keys.get(column)
+            if current and current['DELETE_RULE'] == on_delete:
+                continue
+            if current:
+                executed.append(f"ALTER TABLE {table} DROP FOREIGN KEY {current['CONSTRAINT_NAME']}")
+            executed.append(
+                f"ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+                f"REFERENCES {reference}(id) ON DELETE {on_delete}"
+            )
+
+    _run_statements(executed)
+    return executed
+
+
+def check_queries():
+    """
+    EXPLAIN every model query and flag the ones that scan a whole table
+
+    Returns:
+        tuple: (number of queries checked,
+                list of (query name, description of the scan, expected) per full scan)
+    """
+    sqlite = get_backend().name == 'sqlite'
+    queries = recorded_queries()
+    problems = []
+    for name, query, params, expected in queries:
+        if sqlite:
+            plan = [row['detail'] for row in execute_query(f"EXPLAIN QUERY PLAN {query}", params, fetch_all=True)]
+            # A table walked in rowid order for ORDER BY ... LIMIT stops after LIMIT rows
+            ordered = " LIMIT " in query and not any(detail.startswith('USE TEMP B-TREE') for detail in plan)
+            for detail in plan:
+                # A SCAN without an index reads the whole table
+                if detail.startswith('SCAN') and 'INDEX' not in detail and not ordered:
+                    problems.append((name, detail, expected))
+            continue
+        for row in execute_query(f"EXPLAIN {query}", params, fetch_all=True):
+            # ALL is a full table scan
+            if row.get('type') == 'ALL':
+                problems.append((name, f"{row.get('table')} (type={row.get('type')}, key={row.get('key')})", expected))
+    return len(queries), problems
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Gestion du schéma de la base de données")
+    parser.add_argument('command', choices=['create', 'migrate', 'check'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        create_schema()
+        print("Schéma créé.")
+    elif args.command == 'migrate':
+        executed = migrate()
+        for statement in executed:
+            print(statement)
+        print(f"{len(executed)} modification(s) appliquée(s).")
+    else:
+        checked, problems = check_queries()
+        unexpected = [problem for problem in problems if not problem[2]]
+        for name, description, expected in problems:
+            print(f"SCAN COMPLET{' (attendu)' if expected else ''}: {name}: {description}")
+        print(f"{checked} requête(s) vérifiée(s), {len(unexpected)} scan(s) complet(s) inattendu(s), "
+              f"{len(problems) - len(unexpected)} attendu(s).")
+        return 1 if unexpected else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,10 +2,23 @@
 Versement (Payment) model and database operations
 """
 
-from models.database import execute_query
+from models.database import execute_query, execute_many, stream_query, transaction, on_commit
+from models.client import Client
+from models.cache import ClientHistoryCache
+from models.changes import record_deletion
+from collections import namedtuple
 from decimal import Decimal
+from config import CACHE_CONFIG
 import datetime
 
+# One row of the versement list
+VersementRow = namedtuple('VersementRow', ('id', 'client_name', 'montant', 'type', 'date_paiement', 'annee_concernee'))
+
+# One payment of a client's history and the payments of one year
+HistoryRow = namedtuple('HistoryRow', ('id', 'montant', 'type', 'date_paiement', 'annee_concernee'))
+YearTotal = namedtuple('YearTotal', ('annee_concernee', 'total', 'count'))
+
+
 class Versement:
     def __init__(self, client_id, montant, type, date_paiement, annee_concernee, id=None):
         self.id = id
@@ -15,16 +28,157 @@ class Versement:
         self.date_paiement = date_paiement if isinstance(date_paiement, datetime.date) else datetime.datetime.strptime(date_paiement, '%Y-%m-%d').date()
         self.annee_concernee = int(annee_concernee)
 
+    # Columns fetched by the versement list, in VersementRow order
+    LIST_QUERY = """
+        SELECT v.id, CONCAT(c.nom, ' ', c.prenom) as client_name, v.montant, v.type,
+               v.date_paiement, v.annee_concernee
+        FROM versement v
+        JOIN clients c ON v.client_id = c.id
+        """
+
     @staticmethod
     def get_all():
         """Get all versements with client names"""
-        query = """
-        SELECT v.*, CONCAT(c.nom, ' ', c.prenom) as client_name 
+        query = Versement.LIST_QUERY + " ORDER BY v.date_paiement DESC"
+        return execute_query(query, fetch_all=True, row_type=VersementRow)
+
+    @staticmethod
+    def _filter_clause(filters):
+        """
+        Build the WHERE conditions for versement list filters
+
+        Args:
+            filters (dict): Optional keys client_id, annee_concernee, type,
+                date_from and date_to
+
+        Returns:
+            tuple: (list of conditions, params)
+        """
+        filters = filters or {}
+        conditions = []
+        params = ()
+        if filters.get('client_id'):
+            conditions.append("v.client_id = %s")
+            params += (filters['client_id'],)
+        if filters.get('annee_concernee'):
+            conditions.append("v.annee_concernee = %s")
+            params += (filters['annee_concernee'],)
+        if filters.get('type'):
+            conditions.append("v.type = %s")
+            params += (filters['type'],)
+        if filters.get('date_from'):
+            conditions.append("v.date_paiement >= %s")
+            params += (filters['date_from'],)
+        if filters.get('date_to'):
+            conditions.append("v.date_paiement <= %s")
+            params += (filters['date_to'],)
+        return conditions, params
+
+    @staticmethod
+    def get_page(filters=None, after=None, limit=100):
+        """
+        Get one page of versements, newest first
+
+        Args:
+            filters (dict): See _filter_clause
+            after (VersementRow): Last row of the previous page; the page
+                continues by keyset on (date_paiement, id)
+            limit (int): Page size
+
+        Returns:
+            list: VersementRow tuples
+        """
+        conditions, params = Versement._filter_clause(filters)
+        if after is not None:
+            conditions.append("(v.date_paiement, v.id) < (%s, %s)")
+            params += (after.date_paiement, after.id)
+
+        query = Versement.LIST_QUERY
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY v.date_paiement DESC, v.id DESC LIMIT %s"
+        return execute_query(query, params + (limit,), fetch_all=True, row_type=VersementRow)
+
+    @staticmethod
+    def get_changed(since, filters=None):
+        """
+        Get the versements inserted or updated since a time
+
+        Args:
+            since (datetime): Rows with an updated_at from this time on are returned
+            filters (dict): See _filter_clause
+
+        Returns:
+            list: VersementRow tuples
+        """
+        conditions, params = Versement._filter_clause(filters)
+        conditions.append("v.updated_at >= %s")
+        query = Versement.LIST_QUERY + " WHERE " + " AND ".join(conditions)
+        return execute_query(query, params + (since,), fetch_all=True, row_type=VersementRow)
+
+    # Columns written by exports, with their header labels
+    EXPORT_COLUMNS = (
+        ('v.id', 'ID'), ("CONCAT(c.nom, ' ', c.prenom)", 'Client'), ('v.montant', 'Montant'),
+        ('v.type', 'Type'), ('v.date_paiement', 'Date Paiement'),
+        ('v.annee_concernee', 'Année Concernée')
+    )
+
+    @staticmethod
+    def iter_export(client_id=None, annee=None):
+        """Stream versements as tuples of EXPORT_COLUMNS values, optionally filtered"""
+        columns = ", ".join(column for column, _ in Versement.EXPORT_COLUMNS)
+        query = f"""
+        SELECT {columns}
         FROM versement v
         JOIN clients c ON v.client_id = c.id
-        ORDER BY v.date_paiement DESC
         """
-        return execute_query(query, fetch_all=True)
+        conditions, params = Versement._filter_clause({'client_id': client_id, 'annee_concernee': annee})
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY v.date_paiement DESC, v.id DESC"
+        return stream_query(query, params)
+
+    # Both served by the (client_id, date_paiement) index
+    HISTORY_QUERY = """
+        SELECT id, montant, type, date_paiement, annee_concernee
+        FROM versement
+        WHERE client_id = %s
+        ORDER BY date_paiement DESC, id DESC
+        LIMIT %s
+        """
+    YEAR_TOTALS_QUERY = """
+        SELECT annee_concernee, SUM(montant), COUNT(*)
+        FROM versement
+        WHERE client_id = %s
+        GROUP BY annee_concernee
+        ORDER BY annee_concernee DESC
+        """
+
+    @staticmethod
+    def get_client_history(client_id, limit=200):
+        """
+        Get the payment history of one client
+
+        Args:
+            client_id (int): Client whose versements are read
+            limit (int): Latest versements returned
+
+        Returns:
+            dict: {'versements': HistoryRow list, latest first,
+                   'totals': YearTotal list, latest annee_concernee first,
+                   'last_payment': date of the latest versement or None}
+        """
+        versements = execute_query(
+            Versement.HISTORY_QUERY, (client_id, limit), fetch_all=True, row_type=HistoryRow, prepared=True
+        )
+        totals = execute_query(
+            Versement.YEAR_TOTALS_QUERY, (client_id,), fetch_all=True, row_type=YearTotal, prepared=True
+        )
+        return {
+            'versements': versements,
+            'totals': totals,
+            'last_payment': versements[0].date_paiement if versements else None
+        }
 
     @staticmethod
     def get_by_id(versement_id):
@@ -38,8 +192,17 @@ class Versement:
         return execute_query(query, (versement_id,), fetch_one=True)
 
     def save(self):
-        """Save versement to database (insert or update)"""
+        """
+        Save versement to database (insert or update)
+
+        The payment histories of the versement's client are invalidated once
+        committed, and of its previous client when an update moves it.
+        """
+        client_ids = {self.client_id}
         if self.id:
+            previous = Versement.get_amount(self.id)
+            if previous:
+                client_ids.add(previous['client_id'])
             # Update existing versement
             query = """
             UPDATE versement SET
@@ -60,38 +223,75 @@ class Versement:
             )
         else:
             # Insert new versement
-            query = """
+            query = Versement.INSERT_QUERY
+            params = self._insert_params()
+        
+        execute_query(query, params, prepared=True)
+
+        def invalidate():
+            for client_id in client_ids:
+                client_history.invalidate(client_id)
+        on_commit(invalidate)
+
+    INSERT_QUERY = """
             INSERT INTO versement 
             (client_id, montant, type, date_paiement, annee_concernee)
             VALUES (%s, %s, %s, %s, %s)
             """
-            params = (
-                self.client_id,
-                float(self.montant),
-                self.type,
-                self.date_paiement,
-                self.annee_concernee
-            )
-        
-        execute_query(query, params)
+
+    def _insert_params(self):
+        """Parameters of INSERT_QUERY for this versement"""
+        return (
+            self.client_id,
+            float(self.montant),
+            self.type,
+            self.date_paiement,
+            self.annee_concernee
+        )
+
+    @staticmethod
+    def insert_many(versements):
+        """Insert new versements with a single batched statement"""
+        if not versements:
+            return 0
+        count = execute_many(Versement.INSERT_QUERY, [versement._insert_params() for versement in versements])
+        client_ids = {versement.client_id for versement in versements}
+
+        def invalidate():
+            for client_id in client_ids:
+                client_history.invalidate(client_id)
+
+        on_commit(invalidate)
+        return count
+
+    @staticmethod
+    def get_amount(versement_id, for_update=False):
+        """Get a versement's client and amount, optionally locking the row"""
+        query = "SELECT client_id, montant FROM versement WHERE id = %s"
+        if for_update:
+            query += " FOR UPDATE"
+        return execute_query(query, (versement_id,), fetch_one=True, prepared=True)
 
     @staticmethod
     def delete(versement_id):
         """Delete a versement and update client balance"""
-        # Get versement details first
-        versement_data = execute_query(
-            "SELECT client_id, montant FROM versement WHERE id = %s", 
-            (versement_id,), 
-            fetch_one=True
-        )
-        
-        if versement_data:
-            # Add the amount back to client's balance
-            execute_query("""
-                UPDATE clients 
-                SET montant = montant + %s 
-                WHERE id = %s
-            """, (versement_data['montant'], versement_data['client_id']))
-            
-            # Delete the versement
-            execute_query("DELETE FROM versement WHERE id = %s", (versement_id,))
\ No newline at end of file
+        with transaction():
+            # Get versement details first
+            versement_data = Versement.get_amount(versement_id, for_update=True)
+
+            if versement_data:
+                # Add the amount back to client's balance
+                Client.adjust_balance(versement_data['client_id'], versement_data['montant'])
+
+                # Delete the versement
+                record_deletion('versement', "id = %s", (versement_id,))
+                execute_query("DELETE FROM versement WHERE id = %s", (versement_id,))
+                on_commit(lambda: client_history.invalidate(versement_data['client_id']))
+
+
+# Payment histories of the client view, invalidated whenever a versement is written
+client_history = ClientHistoryCache(
+    lambda client_id: Versement.get_client_history(client_id, CACHE_CONFIG['client_history_rows']),
+    ttl=CACHE_CONFIG['client_history_ttl'],
+    max_size=CACHE_CONFIG['client_history_max_size']
+)
@@ -0,0 +1,25 @@
+/*
+# Full-text search index for clients
+
+The client search used `LIKE '%term%'` on four columns, which can never use
+an index. This migration adds a FULLTEXT index using the ngram parser so
+`Client.get_all` / `Client.get_page` can search with MATCH ... AGAINST.
+
+InnoDB maintains the index on every INSERT, UPDATE and DELETE, so it stays
+current with `Client.save` and `Client.delete` without extra code.
+
+## Notes:
+- The column list must match `Client.SEARCH_COLUMNS`
+- Words shorter than the server's `ngram_token_size` (default 2) fall back
+  to the LIKE search; keep `SEARCH_CONFIG['ngram_token_size']` in sync
+- The index is built without stopwords. The ngram parser drops every token
+  containing one, and the default InnoDB list includes "a" and "i", which
+  would leave most bigrams of client names out of the index. The setting is
+  read when the index is created; an index built with the default list must
+  be dropped and created again.
+*/
+
+SET SESSION innodb_ft_enable_stopword = OFF;
+
+ALTER TABLE clients
+    ADD FULLTEXT INDEX ft_clients_search (nom, prenom, phone, activite) WITH PARSER ngram;
@@ -0,0 +1,171 @@
+"""
+Background execution helpers for the Tk views
+"""
+
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import UI_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the thread pool shared by every view"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=UI_CONFIG['worker_threads'],
+                    thread_name_prefix="view-worker"
+                )
+    return _executor
+
+
+class Task:
+    """Handle on a call submitted to a ViewTaskRunner"""
+
+    def __init__(self, func, args, on_success, on_error, key):
+        self.func = func
+        self.args = args
+        self.on_success = on_success
+        self.on_error = on_error
+        self.key = key
+        self.future = None
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the task; a result that still arrives is discarded"""
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class ViewTaskRunner:
+    """
+    Run controller calls for one view on the shared thread pool
+
+    Calls never block the Tk main loop. Their results and errors are handed
+    to the callbacks on the main thread by polling a queue with
+    ``widget.after``. At most ``max_concurrent`` calls of a view run at the
+    same time, further calls wait in submission order. Submitting a call
+    with the ``key`` of an unfinished one cancels the older call, so only
+    the latest result for that key is applied.
+    """
+
+    def __init__(self, widget, max_concurrent=2, on_busy=None, poll_interval=50):
+        self.widget = widget
+        self.max_concurrent = max_concurrent
+        self.on_busy = on_busy
+        self.poll_interval = poll_interval
+        self.results = queue.Queue()
+        self.waiting = deque()
+        self.running = set()
+        self.keyed = {}
+        self.polling = False
+        self.busy = False
+
+    def submit(self, func, *args, on_success=None, on_error=None, key=None):
+        """
+        Run func(*args) in the background
+
+        Args:
+            func (callable): Controller call to run
+            on_success (callable): Called on the main thread with the result
+            on_error (callable): Called on the main thread with the exception
+            key (str): Calls sharing a key supersede each other
+
+        Returns:
+            Task: Handle that can be cancelled
+        """
+        task = Task(func, args, on_success, on_error, key)
+        if key is not None:
+            previous = self.keyed.get(key)
+            if previous is not None:
+                previous.cancel()
+            self.keyed[key] = task
+
+        self.waiting.append(task)
+        self._start_waiting()
+        self._update_busy()
+        if not self.polling:
+            self.polling = True
+            self.widget.after(self.poll_interval, self.poll)
+        return task
+
+    def cancel_all(self):
+        """Cancel every pending and running call"""
+        for task in list(self.waiting) + list(self.running):
+            task.cancel()
+
+    def _start_waiting(self):
+        """Start waiting calls while there are free slots"""
+        while self.waiting and len(self.running) < self.max_concurrent:
+            task = self.waiting.popleft()
+            if task.cancelled:
+                continue
+            self.running.add(task)
+            task.future = get_executor().submit(self._run, task)
+
+    def _run(self, task):
+        """Execute a call on a worker thread"""
+        if task.cancelled:
+            self.results.put((task, False, None))
+            return
+        try:
+            self.results.put((task, True, task.func(*task.args)))
+        except Exception as e:
+            self.results.put((task, False, e))
+
+    def poll(self):
+        """
+        Deliver finished calls on the main thread
+
+        A callback that raises is logged and does not stop the delivery of
+        the other results nor the polling.
+        """
+        try:
+            while True:
+                try:
+                    task, ok, value = self.results.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.running.discard(task)
+                if task.key is not None and self.keyed.get(task.key) is task:
+                    del self.keyed[task.key]
+                if task.cancelled:
+                    continue
+                callback = task.on_success if ok else task.on_error
+                if callback is None:
+                    continue
+                try:
+                    callback(value)
+                except Exception:
+                    logger.exception("Erreur dans le traitement du résultat de %s",
+                                     getattr(task.func, '__qualname__', task.func))
+
+            # Drop cancelled calls whose future never started
+            for task in [task for task in self.running if task.future.cancelled()]:
+                self.running.discard(task)
+        finally:
+            self._start_waiting()
+            self._update_busy()
+            if (self.running or self.waiting) and self.widget.winfo_exists():
+                self.widget.after(self.poll_interval, self.poll)
+            else:
+                self.polling = False
+
+    def _update_busy(self):
+        """Notify the view when it starts or stops waiting on calls"""
+        busy = any(not task.cancelled for task in list(self.running) + list(self.waiting))
+        if busy != self.busy:
+            self.busy = busy
+            if self.on_busy:
+                self.on_busy(busy)
@@ -5,6 +5,10 @@ Common form building functions
 import customtkinter as ctk
 from tkinter import StringVar, messagebox
 from models.client import Client
+from models.offline import QueuedOperation, QUEUED_MESSAGE
+from utilities.background import ViewTaskRunner
+from config import FIELD_OPTIONS
+from decimal import Decimal, InvalidOperation
 import datetime
 
 class FormBuilder:
@@ -68,31 +72,28 @@ class FormBuilder:
         # Dropdowns
         ctk.CTkLabel(left_frame, text="Régime Fiscal").pack(pady=(10, 0))
         regime_fiscal_var = StringVar()
-        regime_fiscal_options = ["REEL", "IFU", "Cessation", "RADIE", "SORTIE", "ABS", "GEL"]
         regime_fiscal_dropdown = ctk.CTkComboBox(
             left_frame,
             variable=regime_fiscal_var,
-            values=regime_fiscal_options
+            values=FIELD_OPTIONS['regime_fiscal']
         )
         regime_fiscal_dropdown.pack(padx=10, pady=5, fill="x")
 
         ctk.CTkLabel(right_frame, text="Forme Juridique").pack(pady=(10, 0))
         forme_juridique_var = StringVar()
-        forme_juridique_options = ["INDIVIDUEL", "SARL", "EURL", "SNC", "MORAL", "COOPERATIVE"]
         forme_juridique_dropdown = ctk.CTkComboBox(
             right_frame,
             variable=forme_juridique_var,
-            values=forme_juridique_options
+            values=FIELD_OPTIONS['forme_juridique']
         )
         forme_juridique_dropdown.pack(padx=10, pady=5, fill="x")
 
         ctk.CTkLabel(right_frame, text="Régime CNAS").pack(pady=(10, 0))
         regime_cnas_var = StringVar()
-        regime_cnas_options = ["CNAS", "RAS", ""]
         regime_cnas_dropdown = ctk.CTkComboBox(
             right_frame,
             variable=regime_cnas_var,
-            values=regime_cnas_options
+            values=FIELD_OPTIONS['regime_cnas']
         )
         regime_cnas_dropdown.pack(padx=10, pady=5, fill="x")
 
@@ -111,25 +112,34 @@ class FormBuilder:
             if client_data.get('regime_cnas'):
                 regime_cnas_var.set(client_data['regime_cnas'])
 
+        tasks = ViewTaskRunner(form, max_concurrent=1)
+
         def save():
-            try:
-                data = {field: entry.get().strip() for field, entry in entries.items()}
-                data['regime_fiscal'] = regime_fiscal_var.get()
-                data['forme_juridique'] = forme_juridique_var.get()
-                data['regime_cnas'] = regime_cnas_var.get()
-                
-                if client_data:
-                    controller.update_client(client_data['id'], data)
-                else:
-                    controller.create_client(data)
-                
-                form.destroy()
-                success_callback()
-                
-            except Exception as e:
-                messagebox.showerror("Erreur", str(e))
-
-        ctk.CTkButton(bottom_frame, text="Enregistrer", command=save).pack(pady=20)
+            data = {field: entry.get().strip() for field, entry in entries.items()}
+            data['regime_fiscal'] = regime_fiscal_var.get()
+            data['forme_juridique'] = forme_juridique_var.get()
+            data['regime_cnas'] = regime_cnas_var.get()
+
+            save_button.configure(state="disabled")
+            if client_data:
+                tasks.submit(controller.update_client, client_data['id'], data, client_data,
+                             on_success=on_saved, on_error=on_failed, key='save')
+            else:
+                tasks.submit(controller.create_client, data,
+                             on_success=on_saved, on_error=on_failed, key='save')
+
+        def on_saved(result):
+            form.destroy()
+            if isinstance(result, QueuedOperation):
+                messagebox.showinfo("Hors ligne", QUEUED_MESSAGE)
+            success_callback()
+
+        def on_failed(error):
+            save_button.configure(state="normal")
+            messagebox.showerror("Erreur", str(error))
+
+        save_button = ctk.CTkButton(bottom_frame, text="Enregistrer", command=save)
+        save_button.pack(pady=20)
 
     @staticmethod
     def versement_form(parent, title, versement_controller, client_controller, success_callback, client_id=None, versement_data=None):
@@ -181,18 +191,27 @@ class FormBuilder:
 
         # Client selection if not predefined
         client_var = StringVar()
-        clients = {}
         
+        tasks = ViewTaskRunner(form, max_concurrent=1)
+
         if not client_id:
             ctk.CTkLabel(left_frame, text="Client*").pack(pady=(10, 0))
-            clients = client_controller.get_clients_for_dropdown()
             client_dropdown = ctk.CTkComboBox(
                 left_frame,
                 variable=client_var,
-                values=list(clients.values())
+                values=[]
             )
             client_dropdown.pack(padx=10, pady=5, fill="x")
 
+            def on_clients_loaded(clients):
+                client_dropdown.configure(values=list(clients.values()))
+
+            tasks.submit(
+                client_controller.get_clients_for_dropdown,
+                on_success=on_clients_loaded,
+                on_error=lambda e: messagebox.showerror("Erreur", str(e))
+            )
+
         # Pre-fill form if editing
         if versement_data:
             entries['montant'].insert(0, str(versement_data.get('montant', '')))
@@ -207,33 +226,267 @@ class FormBuilder:
             entries['date_paiement'].insert(0, datetime.date.today().strftime('%Y-%m-%d'))
 
         def save():
-            try:
-                data = {field: entry.get().strip() for field, entry in entries.items()}
-                
+            data = {field: entry.get().strip() for field, entry in entries.items()}
+            client_name = client_var.get()
+
+            def submit():
                 # Determine client ID
-                selected_client_id = client_id
+                selected_client_id = client_id or client_controller.get_client_id_by_name(client_name)
                 if not selected_client_id:
-                    for cid, name in clients.items():
-                        if name == client_var.get():
-                            selected_client_id = cid
-                            break
-                    
-                    if not selected_client_id:
-                        messagebox.showerror("Erreur", "Veuillez sélectionner un client valide.")
-                        return
-                
+                    raise ValueError("Veuillez sélectionner un client valide.")
+
                 if versement_data:
-                    versement_controller.update_versement(versement_data['id'], data, selected_client_id)
-                else:
-                    versement_controller.create_versement(data, selected_client_id)
-                
-                form.destroy()
-                success_callback()
-                
-            except Exception as e:
-                messagebox.showerror("Erreur", str(e))
-
-        ctk.CTkButton(bottom_frame, text="Enregistrer", command=save).pack(pady=20)
+                    return versement_controller.update_versement(versement_data['id'], data, selected_client_id,
+                                                                 versement_data)
+                return versement_controller.create_versement(data, selected_client_id)
+
+            save_button.configure(state="disabled")
+            tasks.submit(submit, on_success=on_saved, on_error=on_failed, key='save')
+
+        def on_saved(result):
+            form.destroy()
+            if isinstance(result, QueuedOperation):
+                messagebox.showinfo("Hors ligne", QUEUED_MESSAGE)
+            success_callback()
+
+        def on_failed(error):
+            save_button.configure(state="normal")
+            messagebox.showerror("Erreur", str(error))
+
+        save_button = ctk.CTkButton(bottom_frame, text="Enregistrer", command=save)
+        save_button.pack(pady=20)
+
+    @staticmethod
+    def versement_batch_form(parent, versement_controller, client_controller, success_callback):
+        """
+        Create a grid to enter many versements and save them together
+
+        Lines are typed in the entry bar (Entrée adds the line) or pasted
+        from a spreadsheet as tab-separated columns: client, montant, type,
+        date, année. The batch is validated as a whole and saved in a single
+        transaction; nothing is saved while a line is in error.
+        """
+        from tkinter import ttk
+
+        form = ctk.CTkToplevel(parent)
+        form.title("Saisie groupée de versements")
+        form.geometry("1100x600")
+
+        fields = ('client', 'montant', 'type', 'date_paiement', 'annee_concernee')
+        columns = ("Client", "Montant", "Type", "Date Paiement", "Année Concernée", "Erreur")
+
+        # Entry bar; client, type, date and year are kept from one line to the next
+        entry_frame = ctk.CTkFrame(form)
+        entry_frame.pack(fill="x", padx=10, pady=10)
+
+        client_var = StringVar()
+        client_dropdown = ctk.CTkComboBox(entry_frame, variable=client_var, values=[], width=300)
+        entries = {'client': client_dropdown}
+        for field, label in zip(fields, columns):
+            ctk.CTkLabel(entry_frame, text=label).pack(side="left", padx=(10, 2))
+            if field != 'client':
+                entries[field] = ctk.CTkEntry(entry_frame, width=110)
+            entries[field].pack(side="left", padx=2)
+        today = datetime.date.today()
+        entries['date_paiement'].insert(0, today.strftime('%Y-%m-%d'))
+        entries['annee_concernee'].insert(0, str(today.year))
+
+        tree = ttk.Treeview(form, columns=columns, show="headings")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=120, anchor="center")
+        tree.column("Client", width=260, anchor="w")
+        tree.column("Erreur", width=320, anchor="w")
+        tree.tag_configure('error', background='#5c2b2b')
+        tree.pack(fill="both", expand=True, padx=10)
+
+        bottom_frame = ctk.CTkFrame(form)
+        bottom_frame.pack(fill="x", padx=10, pady=10)
+        summary_label = ctk.CTkLabel(bottom_frame, text="")
+        summary_label.pack(side="left", padx=10)
+
+        tasks = ViewTaskRunner(form, max_concurrent=1)
+        tasks.submit(
+            client_controller.get_clients_for_dropdown,
+            on_success=lambda clients: client_dropdown.configure(values=list(clients.values())),
+            on_error=lambda e: messagebox.showerror("Erreur", str(e))
+        )
+
+        def normalize_amount(value):
+            # Accept decimal commas and thousands separators pasted from a spreadsheet
+            return value.replace('\u00a0', '').replace(' ', '').replace(',', '.')
+
+        def update_summary():
+            total = Decimal('0')
+            for iid in tree.get_children():
+                try:
+                    total += Decimal(tree.set(iid, "Montant"))
+                except InvalidOperation:
+                    pass
+            summary_label.configure(text=f"{len(tree.get_children())} ligne(s), total {total:.2f}")
+
+        def add_line(values):
+            tree.insert("", "end", values=tuple(values) + ("",))
+
+        def add_from_entries(event=None):
+            values = [client_var.get().strip()] + [entries[field].get().strip() for field in fields[1:]]
+            if not any(values[:3]):
+                return
+            values[1] = normalize_amount(values[1])
+            add_line(values)
+            entries['montant'].delete(0, "end")
+            client_dropdown.focus_set()
+            update_summary()
+
+        def edit_line(event=None):
+            # The line goes back to the entry bar and is added again with Entrée
+            selection = tree.selection()
+            if not selection:
+                return
+            values = tree.item(selection[0], 'values')
+            client_var.set(values[0])
+            for field, value in zip(fields[1:], values[1:5]):
+                entries[field].delete(0, "end")
+                entries[field].insert(0, value)
+            tree.delete(selection[0])
+            update_summary()
+
+        def remove_lines():
+            for iid in tree.selection():
+                tree.delete(iid)
+            update_summary()
+
+        def paste_lines(event=None):
+            try:
+                text = form.clipboard_get()
+            except Exception:
+                return "break"
+            for row in text.splitlines():
+                cells = [cell.strip() for cell in row.split("\t")]
+                if not any(cells):
+                    continue
+                cells = (cells + [""] * len(fields))[:len(fields)]
+                cells[1] = normalize_amount(cells[1])
+                add_line(cells)
+            update_summary()
+            return "break"
+
+        for field in fields[1:]:
+            entries[field].bind("<Return>", add_from_entries)
+        tree.bind("<Double-1>", edit_line)
+        tree.bind("<Delete>", lambda event: remove_lines())
+        tree.bind("<Control-v>", paste_lines)
+
+        def save():
+            lines = [tree.item(iid, 'values') for iid in tree.get_children()]
+            if not lines:
+                messagebox.showwarning("Attention", "Aucune ligne à enregistrer.")
+                return
+
+            def submit():
+                batch = []
+                for values in lines:
+                    client_id = client_controller.get_client_id_by_name(values[0])
+                    batch.append((client_id, dict(zip(fields[1:], values[1:5]))))
+                return versement_controller.create_versements(batch)
+
+            save_button.configure(state="disabled")
+            tasks.submit(submit, on_success=on_saved, on_error=on_failed, key='save')
+
+        def on_saved(result):
+            form.destroy()
+            if isinstance(result, QueuedOperation):
+                messagebox.showinfo("Hors ligne", QUEUED_MESSAGE)
+            else:
+                messagebox.showinfo("Information", f"{result} versement(s) enregistré(s).")
+            success_callback()
+
+        def on_failed(error):
+            save_button.configure(state="normal")
+            line_errors = {item['line']: item['message'] for item in getattr(error, 'errors', [])}
+            for line, iid in enumerate(tree.get_children(), start=1):
+                message = line_errors.get(line, "")
+                tree.set(iid, "Erreur", message)
+                tree.item(iid, tags=('error',) if message else ())
+            if line_errors:
+                messagebox.showerror("Erreur", f"{len(line_errors)} ligne(s) en erreur, aucun versement enregistré.")
+            else:
+                messagebox.showerror("Erreur", str(error))
+
+        save_button = ctk.CTkButton(bottom_frame, text="Valider et enregistrer", command=save)
+        save_button.pack(side="right", padx=5)
+        ctk.CTkButton(bottom_frame, text="Coller", width=90, command=paste_lines).pack(side="right", padx=5)
+        ctk.CTkButton(bottom_frame, text="Supprimer ligne(s)", command=remove_lines).pack(side="right", padx=5)
+        ctk.CTkButton(bottom_frame, text="Ajouter ligne", command=add_from_entries).pack(side="right", padx=5)
+        update_summary()
+        client_dropdown.focus_set()
+
+    @staticmethod
+    def versement_export_form(parent, versement_controller, client_controller):
+        """Create a form to export versements with optional client and year filters"""
+        from tkinter import filedialog
+
+        form = ctk.CTkToplevel(parent)
+        form.title("Exporter les versements")
+        form.geometry("500x320")
+
+        main_frame = ctk.CTkFrame(form)
+        main_frame.pack(fill="both", expand=True, padx=10, pady=10)
+
+        all_clients = "Tous les clients"
+        ctk.CTkLabel(main_frame, text="Client").pack(pady=(10, 0))
+        client_var = StringVar(value=all_clients)
+        client_dropdown = ctk.CTkComboBox(main_frame, variable=client_var, values=[all_clients])
+        client_dropdown.pack(padx=10, pady=5, fill="x")
+
+        ctk.CTkLabel(main_frame, text="Année Concernée (optionnel)").pack(pady=(10, 0))
+        annee_entry = ctk.CTkEntry(main_frame)
+        annee_entry.pack(padx=10, pady=5, fill="x")
+
+        tasks = ViewTaskRunner(form, max_concurrent=1)
+        tasks.submit(
+            client_controller.get_clients_for_dropdown,
+            on_success=lambda clients: client_dropdown.configure(values=[all_clients] + list(clients.values())),
+            on_error=lambda e: messagebox.showerror("Erreur", str(e))
+        )
+
+        def export():
+            client_name = client_var.get()
+            annee = annee_entry.get().strip()
+            if annee and not annee.isdigit():
+                messagebox.showerror("Erreur", "Veuillez entrer une année valide!")
+                return
+
+            path = filedialog.asksaveasfilename(
+                parent=form,
+                title="Exporter les versements",
+                defaultextension=".csv",
+                filetypes=[("CSV", "*.csv"), ("Excel", "*.xlsx")]
+            )
+            if not path:
+                return
+
+            def run():
+                client_id = None
+                if client_name and client_name != all_clients:
+                    client_id = client_controller.get_client_id_by_name(client_name)
+                    if not client_id:
+                        raise ValueError("Veuillez sélectionner un client valide.")
+                return versement_controller.export_versements(path, client_id, int(annee) if annee else None)
+
+            export_button.configure(state="disabled")
+            tasks.submit(run, on_success=on_exported, on_error=on_failed, key='export')
+
+        def on_exported(count):
+            form.destroy()
+            messagebox.showinfo("Information", f"{count} versement(s) exporté(s).")
+
+        def on_failed(error):
+            export_button.configure(state="normal")
+            messagebox.showerror("Erreur", str(error))
+
+        export_button = ctk.CTkButton(main_frame, text="Exporter", command=export)
+        export_button.pack(pady=20)
 
     @staticmethod
     def simple_form(parent, title, label, save_callback, success_callback, initial_value=""):
@@ -252,14 +505,20 @@ class FormBuilder:
         if initial_value:
             entry.insert(0, initial_value)
 
+        tasks = ViewTaskRunner(form, max_concurrent=1)
+
         def save():
-            try:
-                value = entry.get().strip()
-                save_callback(value)
-                form.destroy()
-                success_callback()
-                
-            except Exception as e:
-                messagebox.showerror("Erreur", str(e))
-
-        ctk.CTkButton(main_frame, text="Enregistrer", command=save).pack(pady=20)
\ No newline at end of file
+            save_button.configure(state="disabled")
+            tasks.submit(save_callback, entry.get().strip(),
+                         on_success=on_saved, on_error=on_failed, key='save')
+
+        def on_saved(result):
+            form.destroy()
+            success_callback()
+
+        def on_failed(error):
+            save_button.configure(state="normal")
+            messagebox.showerror("Erreur", str(error))
+
+        save_button = ctk.CTkButton(main_frame, text="Enregistrer", command=save)
+        save_button.pack(pady=20)
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Streaming readers and writers for CSV and XLSX files
+"""
+
+import csv
+import os
+import unicodedata
+
+# Accepted column headers (normalized) for each client field
+CLIENT_HEADERS = {
+    'nom': 'nom',
+    'prenom': 'prenom',
+    'activite': 'activite',
+    'telephone': 'phone',
+    'tel': 'phone',
+    'phone': 'phone',
+    'email': 'email',
+    'mail': 'email',
+    'adresse': 'address',
+    'address': 'address',
+    'montant': 'montant',
+    'type': 'type',
+    'regimefiscal': 'regime_fiscal',
+    'agent': 'agent_responsable',
+    'agentresponsable': 'agent_responsable',
+    'formejuridique': 'forme_juridique',
+    'fj': 'forme_juridique',
+    'regimecnas': 'regime_cnas',
+    'modepaiement': 'mode_paiement',
+    'honorairesmois': 'honoraires_mois',
+    'honoraires': 'honoraires_mois',
+}
+
+
+def normalize_header(header):
+    """Lowercase a header and strip accents, spaces and punctuation"""
+    text = unicodedata.normalize('NFKD', str(header or ''))
+    return ''.join(c for c in text.lower() if c.isalnum())
+
+
+def _map_headers(headers, mapping):
+    """Return the field name for each header, or None for unknown columns"""
+    return [mapping.get(normalize_header(header)) for header in headers]
+
+
+def _cell(value):
+    """Convert a cell value to the stripped string the validators expect"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _iter_csv(path):
+    """Yield the raw rows of a CSV file, detecting the delimiter"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _iter_xlsx(path):
+    """Yield the raw rows of the first sheet of an XLSX file"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Le module openpyxl est requis pour lire les fichiers .xlsx")
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_records(path, mapping=CLIENT_HEADERS):
+    """
+    Stream the rows of a CSV or XLSX file as dicts
+
+    The first row holds the headers; unknown columns are ignored.
+
+    Args:
+        path (str): File to read
+        mapping (dict): Normalized header -> field name
+
+    Yields:
+        tuple: (line number, {field: value})
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        rows = _iter_csv(path)
+    elif extension in ('.xlsx', '.xlsm'):
+        rows = _iter_xlsx(path)
+    else:
+        raise ValueError("Format de fichier non supporté (CSV ou XLSX attendu)")
+
+    fields = None
+    for line, row in enumerate(rows, start=1):
+        if fields is None:
+            fields = _map_headers(row, mapping)
+            if not any(fields):
+                raise ValueError("Aucune colonne reconnue dans l'en-tête du fichier")
+            continue
+        if not any(_cell(value) for value in row):
+            continue  # Skip blank lines
+        yield line, {
+            field: _cell(value)
+            for field, value in zip(fields, row)
+            if field is not None
+        }
+
+
+def write_rows(path, headers, rows):
+    """
+    Write rows to a CSV or XLSX file as they are produced
+
+    Rows are consumed one at a time, so an iterator over a streamed query
+    is written with constant memory.
+
+    Args:
+        path (str): Destination file; the extension selects the format
+        headers (list): Column header labels
+        rows (iterable): Row tuples
+
+    Returns:
+        int: Number of rows written
+    """
+    extension = os.path.splitext(path)[1].lower()
+    count = 0
+
+    if extension == '.csv':
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(headers)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        return count
+
+    if extension == '.xlsx':
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise ValueError("Le module openpyxl est requis pour écrire les fichiers .xlsx")
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(list(headers))
+        for row in rows:
+            sheet.append(list(row))
+            count += 1
+        workbook.save(path)
+        return count
+
+    raise ValueError("Format de fichier non supporté (CSV ou XLSX attendu)")
+
+
+def write_error_report(errors, path):
+    """Write import errors as a CSV file with line and message columns"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Ligne', 'Erreur'])
+        for error in errors:
+            writer.writerow([error['line'], error['message']])
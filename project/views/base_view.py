@@ -2,15 +2,35 @@
 Base view class with common functionality
 """
 
+import logging
 import customtkinter as ctk
 from tkinter import ttk
-from config import UI_CONFIG
+from config import UI_CONFIG, SYNC_CONFIG
+from views.virtual_treeview import VirtualTreeview, apply_rows
+from utilities.background import ViewTaskRunner
+
+logger = logging.getLogger(__name__)
 
 class BaseView:
     def __init__(self, parent, controller):
         self.parent = parent
         self.controller = controller
         self.selected_item = None
+        self.selected_id = None
+        self.busy_indicator = None
+        self._tree_rows = {}
+
+        # Controller calls run in the background, results come back via after()
+        self.tasks = ViewTaskRunner(
+            parent,
+            max_concurrent=UI_CONFIG['max_view_tasks'],
+            on_busy=self.set_busy
+        )
+
+        # Polls for other users' changes, without the busy indicator
+        self.sync_tasks = ViewTaskRunner(parent, max_concurrent=1)
+        self.sync_task = None
+        self.sync_watermark = None
         
         # Configure styles for treeview
         self.style = ttk.Style()
@@ -39,9 +59,9 @@ class BaseView:
         self.style.configure("oddrow.Treeview", background="#2e2e2e")
         self.style.configure("evenrow.Treeview", background="#242424")
 
-    def create_treeview(self, columns, show_headings=True):
-        """Create a treeview with given columns"""
-        tree = ttk.Treeview(self.parent, columns=columns, show="headings" if show_headings else "tree headings")
+    def create_treeview(self, columns, show_headings=True, parent=None):
+        """Create a treeview with given columns, in the view's frame unless parent is given"""
+        tree = ttk.Treeview(parent or self.parent, columns=columns, show="headings" if show_headings else "tree headings")
         
         for col in columns:
             tree.heading(col, text=col)
@@ -49,16 +69,97 @@ class BaseView:
         
         return tree
 
-    def populate_treeview(self, tree, data):
-        """Populate treeview with data and alternating row colors"""
-        # Clear existing items
-        for row in tree.get_children():
-            tree.delete(row)
-            
-        # Add new items
-        for i, item in enumerate(data):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            tree.insert('', 'end', values=item, tags=(tag,))
+    def create_virtual_treeview(self, columns, on_error=None):
+        """Create a virtualized treeview that loads rows in pages through the view's task runner"""
+        virtual_tree = VirtualTreeview(
+            self.parent, columns, self.tasks,
+            page_size=UI_CONFIG['page_size'],
+            prefetch_pages=UI_CONFIG['prefetch_pages'],
+            on_error=on_error
+        )
+
+        for col in columns:
+            virtual_tree.tree.heading(col, text=col)
+            virtual_tree.tree.column(col, width=120, anchor="center")
+
+        return virtual_tree
+
+    def populate_treeview(self, tree, rows):
+        """
+        Show (id, values) rows in a treeview with alternating row colors
+
+        The new rows are diffed against the displayed ones by id, so only
+        rows that were added, changed, moved out of order or removed cost a
+        Tk operation (see apply_rows).
+        """
+        apply_rows(tree, [
+            (str(iid), tuple(values), 'evenrow' if index % 2 == 0 else 'oddrow')
+            for index, (iid, values) in enumerate(rows)
+        ], self._tree_rows.setdefault(str(tree), {}))
+
+    def update_treeview(self, tree, changed, deleted):
+        """
+        Apply changed (id, values) rows and deleted ids to the displayed rows
+
+        Displayed rows keep their position; rows that are not displayed are
+        not added.
+
+        Returns:
+            list: Ids of the changed rows that are not displayed
+        """
+        displayed = self._tree_rows.get(str(tree), {})
+        changed = {str(iid): tuple(values) for iid, values in changed}
+        deleted = {str(iid) for iid in deleted}
+        rows = [
+            (iid, changed[iid] if iid in changed else displayed[iid][0])
+            for iid in tree.get_children() if iid not in deleted and iid in displayed
+        ]
+        self.populate_treeview(tree, rows)
+        return [iid for iid in changed if iid not in displayed]
+
+    def start_sync(self):
+        """Poll for rows changed by other users while the view exists, if it implements fetch_changes"""
+        if SYNC_CONFIG['enabled'] and type(self).fetch_changes is not BaseView.fetch_changes:
+            self.parent.after(SYNC_CONFIG['poll_interval_ms'], self.poll_changes)
+
+    def poll_changes(self):
+        """Fetch the rows changed since the watermark and apply them"""
+        if not self.parent.winfo_exists():
+            return
+        self.parent.after(SYNC_CONFIG['poll_interval_ms'], self.poll_changes)
+        # Nothing loaded yet, or the previous poll is still running
+        if self.sync_watermark is None or self.sync_task is not None:
+            return
+
+        def on_success(changes):
+            self.sync_task = None
+            self.sync_watermark = changes['watermark']
+            if changes['changed'] or changes['deleted']:
+                self.apply_changes(changes)
+
+        def on_error(error):
+            # Retried at the next poll
+            self.sync_task = None
+            logger.warning("Synchronisation impossible: %s", error)
+
+        self.sync_task = self.sync_tasks.submit(
+            self.fetch_changes, self.sync_watermark, on_success=on_success, on_error=on_error
+        )
+
+    def fetch_changes(self, since):
+        """
+        Return the changes since a watermark (runs in the background)
+
+        Views that are kept in sync override it together with apply_changes;
+        start_sync does not poll views that keep this default.
+
+        Returns:
+            dict: See models.changes.get_changes
+        """
+        return None
+
+    def apply_changes(self, changes):
+        """Show the rows changed or deleted by other users"""
 
     def create_action_dropdown(self, parent, label, actions, command):
         """Create a standardized action dropdown menu"""
@@ -75,10 +176,27 @@ class BaseView:
         )
         return dropdown, var
 
+    def create_busy_indicator(self, parent):
+        """Create a progress bar that runs while background calls are pending"""
+        self.busy_indicator = ctk.CTkProgressBar(parent, mode="indeterminate", width=120)
+        self.busy_indicator.set(0)
+        return self.busy_indicator
+
+    def set_busy(self, busy):
+        """Start or stop the busy indicator"""
+        if self.busy_indicator is None:
+            return
+        if busy:
+            self.busy_indicator.start()
+        else:
+            self.busy_indicator.stop()
+            self.busy_indicator.set(0)
+
     def on_item_select(self, event, tree):
         """Handle item selection in treeview"""
         selected = tree.selection()
         if selected:
+            self.selected_id = int(selected[0])
             self.selected_item = tree.item(selected[0])['values']
 
     def show_error(self, message):
@@ -5,14 +5,31 @@ Client management view
 import customtkinter as ctk
 from tkinter import StringVar
 from views.base_view import BaseView
-from utilities.form_builder import FormBuilder
+from models.offline import QueuedOperation, QUEUED_MESSAGE
+from config import UI_CONFIG
+
+# Forms and the spreadsheet helpers are imported on first use, they are not
+# needed to show the list
 
 class ClientView(BaseView):
-    def __init__(self, parent, client_controller, versement_controller):
+    # Values each sort option orders the rows by; relevance depends on the
+    # searched columns
+    SORT_KEYS = {
+        'nom': lambda client: (client.nom, client.prenom),
+        'montant': lambda client: client.montant,
+        'creation_date': lambda client: client.id,
+        'relevance': lambda client: (client.nom, client.prenom, client.phone, client.activite)
+    }
+
+    def __init__(self, parent, client_controller, versement_controller, prefetched=None):
         super().__init__(parent, client_controller)
         self.versement_controller = versement_controller
+        self.search_after_id = None
+        self.history_client_id = None
+        self.search_term = None
         self.setup_ui()
-        self.load_data()
+        self.load_data(prefetched)
+        self.start_sync()
 
     def setup_ui(self):
         """Setup the client management UI"""
@@ -25,12 +42,12 @@ class ClientView(BaseView):
         ctk.CTkLabel(top_frame, text="Rechercher:").pack(side="left", padx=(0, 5))
         self.search_entry = ctk.CTkEntry(top_frame, textvariable=self.search_var, width=200)
         self.search_entry.pack(side="left")
-        self.search_entry.bind('<KeyRelease>', lambda event: self.load_data())
+        self.search_entry.bind('<KeyRelease>', self.on_search_change)
 
         # Sort functionality
         ctk.CTkLabel(top_frame, text="Trier par:").pack(side="left", padx=(20, 5))
         self.sort_var = ctk.StringVar(value="Nom")
-        sort_options = ["Nom", "Montant", "Date de création"]
+        sort_options = ["Nom", "Montant", "Date de création", "Pertinence"]
         self.sort_dropdown = ctk.CTkComboBox(
             top_frame,
             variable=self.sort_var,
@@ -41,24 +58,117 @@ class ClientView(BaseView):
         self.sort_dropdown.pack(side="left", padx=(0, 10))
 
         # Action dropdown
-        actions = ["Ajouter Client", "Modifier Client", "Supprimer Client"]
+        actions = ["Ajouter Client", "Modifier Client", "Supprimer Client", "Importer Clients", "Exporter Clients"]
         dropdown, _ = self.create_action_dropdown(
             top_frame, "Gestion des Clients", actions, self.handle_action
         )
         dropdown.pack(side="right", padx=5)
+        self.create_busy_indicator(top_frame).pack(side="right", padx=10)
+
+        self.setup_detail_panel()
 
         # Treeview
         columns = ("Nom", "Prénom", "Activité", "Téléphone", "Adresse", 
                   "Montant", "Régime Fiscal", "Agent", "Forme Juridique")
         
-        self.tree = self.create_treeview(columns)
-        self.tree.pack(fill="both", expand=True, padx=10, pady=10)
-        self.tree.bind('<<TreeviewSelect>>', lambda event: self.on_item_select(event, self.tree))
+        if UI_CONFIG['virtual_tree']:
+            self.virtual_tree = self.create_virtual_treeview(columns, on_error=self.on_load_error)
+            self.virtual_tree.pack(fill="both", expand=True, padx=10, pady=10)
+            self.tree = self.virtual_tree.tree
+        else:
+            self.virtual_tree = None
+            self.tree = self.create_treeview(columns)
+            self.tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.tree.bind('<<TreeviewSelect>>', lambda event: self.on_item_select(event, self.tree), add="+")
+        self.tree.bind('<<TreeviewSelect>>', self.on_client_select, add="+")
 
         # Configure column widths
         for col in columns:
             self.tree.column(col, width=100, anchor="nw")
 
+    def setup_detail_panel(self):
+        """Setup the payment history panel of the selected client"""
+        panel = ctk.CTkFrame(self.parent, width=420)
+        panel.pack(side="right", fill="y", padx=(0, 10), pady=10)
+        panel.pack_propagate(False)
+
+        self.detail_title = ctk.CTkLabel(
+            panel, text="Aucun client sélectionné",
+            font=(UI_CONFIG['font_family'], UI_CONFIG['font_size_bold'], "bold")
+        )
+        self.detail_title.pack(fill="x", padx=10, pady=(10, 5))
+        self.detail_summary = ctk.CTkLabel(panel, text="", justify="left", anchor="w")
+        self.detail_summary.pack(fill="x", padx=10, pady=(0, 10))
+
+        self.totals_tree = self.create_treeview(("Année", "Total", "Versements"), parent=panel)
+        self.totals_tree.configure(height=5)
+        self.totals_tree.pack(fill="x", padx=10)
+
+        self.history_tree = self.create_treeview(("Date", "Montant", "Type", "Année"), parent=panel)
+        for col in ("Date", "Montant", "Type", "Année"):
+            self.history_tree.column(col, width=90)
+        self.history_tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+    def on_client_select(self, event):
+        """Load the payment history of the selected client"""
+        selected = self.tree.selection()
+        if selected:
+            values = self.tree.item(selected[0])['values']
+            self.load_history(int(selected[0]), f"{values[0]} {values[1]}" if values else "")
+
+    def load_history(self, client_id, title=None, reload=False):
+        """Fetch a client's history in the background, superseding the previous one"""
+        self.history_client_id = client_id
+        if title is not None:
+            self.detail_title.configure(text=title)
+            self.detail_summary.configure(text="Chargement...")
+        self.tasks.submit(
+            self.versement_controller.get_client_history, client_id, reload,
+            on_success=lambda history: self.show_history(client_id, history),
+            on_error=lambda e: self.show_error(f"Erreur lors du chargement des versements: {e}"),
+            key='history'
+        )
+
+    def show_history(self, client_id, history):
+        """Display a client's versements, totals per year and last payment"""
+        if client_id != self.history_client_id:
+            return
+
+        totals = history['totals']
+        total_paid = sum(float(year.total or 0) for year in totals)
+        count = sum(year.count for year in totals)
+        last_payment = history['last_payment']
+
+        summary = (f"Dernier versement: {last_payment.strftime('%Y-%m-%d') if last_payment else 'aucun'}\n"
+                   f"Total payé: {total_paid:.2f} ({count} versement(s))")
+        if count > len(history['versements']):
+            summary += f"\n{len(history['versements'])} derniers versements affichés"
+        self.detail_summary.configure(text=summary)
+
+        self.populate_treeview(self.totals_tree, [
+            (year.annee_concernee, (year.annee_concernee, f"{float(year.total or 0):.2f}", year.count))
+            for year in totals
+        ])
+        self.populate_treeview(self.history_tree, [
+            (versement.id, (versement.date_paiement.strftime('%Y-%m-%d'), f"{float(versement.montant):.2f}",
+                            versement.type, versement.annee_concernee))
+            for versement in history['versements']
+        ])
+
+    def clear_history(self):
+        """Empty the history panel"""
+        self.history_client_id = None
+        self.detail_title.configure(text="Aucun client sélectionné")
+        self.detail_summary.configure(text="")
+        self.populate_treeview(self.totals_tree, [])
+        self.populate_treeview(self.history_tree, [])
+
+    def on_search_change(self, event):
+        """Reload the list once the user stops typing"""
+        if self.search_after_id is not None:
+            self.parent.after_cancel(self.search_after_id)
+        self.search_after_id = self.parent.after(UI_CONFIG['search_debounce_ms'], self.load_data)
+
     def on_sort_change(self, choice):
         """Handle sort option change"""
         self.load_data()
@@ -71,97 +181,244 @@ class ClientView(BaseView):
             self.edit_client()
         elif choice == "Supprimer Client":
             self.delete_client()
+        elif choice == "Importer Clients":
+            self.import_clients()
+        elif choice == "Exporter Clients":
+            self.export_clients()
 
-    def load_data(self):
-        """Load and display client data"""
-        try:
-            search_term = self.search_var.get().strip()
-            
-            # Map UI sort options to model sort keys
-            sort_mapping = {
-                "Nom": "nom",
-                "Montant": "montant", 
-                "Date de création": "creation_date"
-            }
-            sort_by = sort_mapping.get(self.sort_var.get(), "nom")
-            
-            clients = self.controller.get_all_clients(
-                search_term if search_term else None,
-                sort_by
-            )
-            
-            # Format data for display
-            display_data = []
-            for client in clients:
-                montant = client.get('montant', 0.0) or 0.0
-                formatted_montant = f"{float(montant):.2f}"
-                
-                row_data = (
-                    client.get('nom', ''),
-                    client.get('prenom', ''),
-                    client.get('activite', ''),
-                    client.get('phone', ''),
-                    client.get('address', ''),
-                    formatted_montant,
-                    client.get('regime_fiscal', ''),
-                    client.get('agent_responsable', ''),
-                    client.get('forme_juridique', '')
+    def load_data(self, prefetched=None):
+        """
+        Load and display client data
+
+        Args:
+            prefetched: Result of fetch_clients() for the default search and
+                sort, shown instead of querying again
+        """
+        self.search_after_id = None
+        search_term = self.search_var.get().strip() or None
+        # Read by the change polls
+        self.search_term = search_term
+        
+        # Map UI sort options to model sort keys
+        sort_mapping = {
+            "Nom": "nom",
+            "Montant": "montant", 
+            "Date de création": "creation_date",
+            "Pertinence": "relevance"
+        }
+        sort_by = sort_mapping.get(self.sort_var.get(), "nom")
+
+        def fetch_page(after, offset, limit):
+            return self.controller.get_clients_page(search_term, sort_by, after, offset, limit)
+
+        if self.virtual_tree:
+            # Only the visible window is fetched, page by page
+            def show(result):
+                total, first_page = result
+                self.virtual_tree.load(
+                    total, fetch_page,
+                    lambda client: (client.id, self.format_client_row(client)),
+                    first_page, self.SORT_KEYS[sort_by]
                 )
-                display_data.append(row_data)
-            
-            self.populate_treeview(self.tree, display_data)
-            
-        except Exception as e:
-            self.show_error(f"Erreur lors du chargement des clients: {e}")
+        else:
+            def show(rows):
+                self.populate_treeview(self.tree, rows)
+
+        def apply(result):
+            self.sync_watermark, data = result
+            show(data)
+
+        if prefetched is not None:
+            apply(prefetched)
+            return
+
+        # Queries run off the main thread; only the latest result is applied
+        self.tasks.submit(
+            self.fetch_clients, self.controller, search_term, sort_by,
+            on_success=apply, on_error=self.on_load_error, key='load'
+        )
+
+    @staticmethod
+    def fetch_clients(controller, search_term=None, sort_by="nom"):
+        """
+        Query the rows the list shows (runs in the background)
+
+        Returns:
+            tuple: (watermark, data); the watermark is the server time changes
+                are polled from, data is (total, first page) with the virtual
+                tree, otherwise the formatted (id, values) rows of every
+                matching client
+        """
+        watermark = controller.get_sync_watermark()
+        if UI_CONFIG['virtual_tree']:
+            total = controller.count_clients(search_term)
+            return watermark, (total, controller.get_clients_page(search_term, sort_by, None, 0, UI_CONFIG['page_size']))
+        clients = controller.get_all_clients(search_term, sort_by)
+        return watermark, [(client.id, ClientView.format_client_row(client)) for client in clients]
+
+    def fetch_changes(self, since):
+        """Return the clients matching the search changed since a watermark (runs in the background)"""
+        return self.controller.get_client_changes(since, self.search_term)
+
+    def apply_changes(self, changes):
+        """
+        Show the clients changed or deleted by other users
+
+        Displayed rows are updated in place. A row that is not displayed may
+        be a new client: the full list is then reloaded, the virtual list
+        recounted and its window reloaded if the count moved.
+        """
+        changed = changes['changed']
+        deleted = set(changes['deleted'])
+
+        if self.history_client_id in deleted:
+            self.clear_history()
+        elif any(client.id == self.history_client_id for client in changed):
+            # Its balance moved, a payment was written elsewhere
+            self.load_history(self.history_client_id, reload=True)
+
+        if not self.virtual_tree:
+            missing = self.update_treeview(
+                self.tree, [(client.id, self.format_client_row(client)) for client in changed], deleted
+            )
+            if missing:
+                self.load_data()
+            return
+
+        found = self.virtual_tree.update_rows(changed)
+        if not deleted and len(found) == len(changed):
+            return
+        removed = bool(deleted & self.virtual_tree.cached_iids())
+
+        def on_count(total):
+            if removed or total != self.virtual_tree.total:
+                self.virtual_tree.refresh(total)
+
+        self.tasks.submit(self.controller.count_clients, self.search_term, on_success=on_count, key='count')
+
+    def on_load_error(self, error):
+        """Report a failed load"""
+        self.show_error(f"Erreur lors du chargement des clients: {error}")
+
+    @staticmethod
+    def format_client_row(client):
+        """Format a client row for display"""
+        return (
+            client.nom,
+            client.prenom,
+            client.activite,
+            client.phone,
+            client.address,
+            f"{float(client.montant or 0):.2f}",
+            client.regime_fiscal,
+            client.agent_responsable,
+            client.forme_juridique
+        )
 
     def add_client(self):
         """Open form to add new client"""
+        from utilities.form_builder import FormBuilder
         FormBuilder.client_form(self.parent, "Ajouter un Client", self.controller, self.on_form_success)
 
     def edit_client(self):
         """Open form to edit selected client"""
-        if not self.selected_item:
+        from utilities.form_builder import FormBuilder
+
+        if self.selected_id is None:
             self.show_warning("Veuillez sélectionner un client à modifier.")
             return
-            
-        try:
-            client_id = self.controller.get_client_id_by_details(
-                self.selected_item[0], self.selected_item[1], self.selected_item[2]
-            )
-            
-            if client_id:
-                client_data = self.controller.get_client_by_id(client_id)
+
+        def open_form(client_data):
+            if client_data:
                 FormBuilder.client_form(
                     self.parent, "Modifier le client", self.controller, 
                     self.on_form_success, client_data
                 )
             else:
                 self.show_error("Client non trouvé.")
-                
-        except Exception as e:
-            self.show_error(f"Erreur lors de la modification: {e}")
+
+        self.tasks.submit(
+            self.controller.get_client_by_id, self.selected_id,
+            on_success=open_form,
+            on_error=lambda e: self.show_error(f"Erreur lors de la modification: {e}")
+        )
 
     def delete_client(self):
         """Delete selected client"""
-        if not self.selected_item:
+        if self.selected_id is None:
             self.show_warning("Veuillez sélectionner un client à supprimer.")
             return
             
         if self.confirm_action("Voulez-vous vraiment supprimer ce client ?"):
-            try:
-                client_id = self.controller.get_client_id_by_details(
-                    self.selected_item[0], self.selected_item[1], self.selected_item[3]
-                )
-                
-                if client_id:
-                    self.controller.delete_client(client_id)
-                    self.load_data()
-                    self.show_info("Client supprimé avec succès.")
+            def on_deleted(result):
+                if self.history_client_id == self.selected_id:
+                    self.clear_history()
+                self.selected_id = None
+                self.selected_item = None
+                self.load_data()
+                if isinstance(result, QueuedOperation):
+                    self.show_info(QUEUED_MESSAGE)
                 else:
-                    self.show_error("Client non trouvé.")
-                    
-            except Exception as e:
-                self.show_error(f"Erreur lors de la suppression: {e}")
+                    self.show_info("Client supprimé avec succès.")
+
+            self.tasks.submit(
+                self.controller.delete_client, self.selected_id,
+                on_success=on_deleted,
+                on_error=lambda e: self.show_error(f"Erreur lors de la suppression: {e}")
+            )
+
+    def import_clients(self):
+        """Import clients from a CSV or XLSX file"""
+        from tkinter import filedialog
+        from utilities.spreadsheet import write_error_report
+
+        path = filedialog.askopenfilename(
+            title="Importer des clients",
+            filetypes=[("Fichiers clients", "*.csv *.xlsx"), ("CSV", "*.csv"), ("Excel", "*.xlsx")]
+        )
+        if not path:
+            return
+
+        def on_imported(report):
+            self.load_data()
+            message = f"{report['imported']} client(s) importé(s)."
+            if not report['errors']:
+                self.show_info(message)
+                return
+
+            message += f"\n{len(report['errors'])} ligne(s) rejetée(s). Enregistrer le rapport d'erreurs ?"
+            if self.confirm_action(message):
+                report_path = filedialog.asksaveasfilename(
+                    title="Rapport d'erreurs",
+                    defaultextension=".csv",
+                    filetypes=[("CSV", "*.csv")]
+                )
+                if report_path:
+                    write_error_report(report['errors'], report_path)
+
+        self.tasks.submit(
+            self.controller.import_clients, path,
+            on_success=on_imported,
+            on_error=lambda e: self.show_error(f"Erreur lors de l'import: {e}")
+        )
+
+    def export_clients(self):
+        """Export the client list to a CSV or XLSX file"""
+        from tkinter import filedialog
+
+        path = filedialog.asksaveasfilename(
+            title="Exporter les clients",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("Excel", "*.xlsx")]
+        )
+        if not path:
+            return
+
+        self.tasks.submit(
+            self.controller.export_clients, path,
+            on_success=lambda count: self.show_info(f"{count} client(s) exporté(s)."),
+            on_error=lambda e: self.show_error(f"Erreur lors de l'export: {e}")
+        )
 
     def on_form_success(self):
         """Callback for successful form submission"""
@@ -3,16 +3,26 @@ Versement (Payment) management view
 """
 
 import customtkinter as ctk
-from tkinter import StringVar
+import datetime
+from tkinter import StringVar, ttk
 from views.base_view import BaseView
-from utilities.form_builder import FormBuilder
+from models.offline import QueuedOperation, QUEUED_MESSAGE
+from config import UI_CONFIG
+
+# FormBuilder is imported on first use, it is not needed to show the list
 
 class VersementView(BaseView):
-    def __init__(self, parent, versement_controller, client_controller):
+    def __init__(self, parent, versement_controller, client_controller, prefetched=None):
         super().__init__(parent, versement_controller)
         self.client_controller = client_controller
+        self.rows = []
+        self.last_versement = None
+        self.has_more = False
+        self.more_task = None
+        self.filters = {}
         self.setup_ui()
-        self.load_data()
+        self.load_data(prefetched)
+        self.start_sync()
 
     def setup_ui(self):
         """Setup the versement management UI"""
@@ -21,19 +31,53 @@ class VersementView(BaseView):
         top_frame.pack(fill="x", padx=10, pady=10)
 
         # Action dropdown
-        actions = ["Ajouter Versement", "Modifier Versement", "Supprimer Versement"]
+        actions = ["Ajouter Versement", "Saisie Groupée", "Modifier Versement", "Supprimer Versement",
+                   "Exporter Versements"]
         dropdown, _ = self.create_action_dropdown(
             top_frame, "Gestion des Versements", actions, self.handle_action
         )
         dropdown.pack(side="left", padx=5)
+        self.create_busy_indicator(top_frame).pack(side="right", padx=10)
+
+        # Filters
+        filter_frame = ctk.CTkFrame(self.parent)
+        filter_frame.pack(fill="x", padx=10, pady=(0, 10))
+
+        self.all_clients = "Tous les clients"
+        self.client_filter_var = StringVar(value=self.all_clients)
+        ctk.CTkLabel(filter_frame, text="Client:").pack(side="left", padx=(5, 5))
+        self.client_filter = ctk.CTkComboBox(
+            filter_frame, variable=self.client_filter_var, values=[self.all_clients], width=200
+        )
+        self.client_filter.pack(side="left")
+
+        self.filter_entries = {}
+        for label, field, width in [("Année:", 'annee_concernee', 70), ("Type:", 'type', 100),
+                                    ("Du:", 'date_from', 100), ("Au:", 'date_to', 100)]:
+            ctk.CTkLabel(filter_frame, text=label).pack(side="left", padx=(10, 5))
+            entry = ctk.CTkEntry(filter_frame, width=width)
+            entry.pack(side="left")
+            entry.bind('<Return>', lambda event: self.apply_filters())
+            self.filter_entries[field] = entry
+
+        ctk.CTkButton(filter_frame, text="Filtrer", width=80, command=self.apply_filters).pack(side="left", padx=(10, 5))
+        ctk.CTkButton(filter_frame, text="Réinitialiser", width=80, command=self.reset_filters).pack(side="left")
 
-        # Treeview
+        self.tasks.submit(
+            self.client_controller.get_clients_for_dropdown,
+            on_success=lambda clients: self.client_filter.configure(values=[self.all_clients] + list(clients.values()))
+        )
+
+        # Treeview, loaded page by page as the user scrolls down
         columns = ("ID", "Client", "Montant", "Type", "Date Paiement", "Année Concernée")
         self.tree = self.create_treeview(columns)
         
         for col in columns:
             self.tree.column(col, width=120, anchor="center")
-        
+
+        scrollbar = ttk.Scrollbar(self.parent, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=lambda first, last: self.on_tree_scroll(scrollbar, first, last))
+        scrollbar.pack(side="right", fill="y", pady=10)
         self.tree.pack(fill="both", expand=True, padx=10, pady=10)
         self.tree.bind('<<TreeviewSelect>>', lambda event: self.on_item_select(event, self.tree))
 
@@ -41,36 +85,182 @@ class VersementView(BaseView):
         """Handle dropdown action selection"""
         if choice == "Ajouter Versement":
             self.add_versement()
+        elif choice == "Saisie Groupée":
+            from utilities.form_builder import FormBuilder
+            FormBuilder.versement_batch_form(
+                self.parent, self.controller, self.client_controller, self.on_form_success
+            )
         elif choice == "Modifier Versement":
             self.edit_versement()
         elif choice == "Supprimer Versement":
             self.delete_versement()
+        elif choice == "Exporter Versements":
+            from utilities.form_builder import FormBuilder
+            FormBuilder.versement_export_form(self.parent, self.controller, self.client_controller)
 
-    def load_data(self):
-        """Load and display versement data"""
+    def apply_filters(self):
+        """Read the filter fields and reload the first page"""
+        values = {field: entry.get().strip() for field, entry in self.filter_entries.items()}
         try:
-            versements = self.controller.get_all_versements()
-            
-            # Format data for display
-            display_data = []
-            for versement in versements:
-                row_data = (
-                    versement['id'],
-                    versement['client_name'],
-                    f"{versement['montant']:.2f}",
-                    versement['type'],
-                    versement['date_paiement'].strftime('%Y-%m-%d') if versement['date_paiement'] else '',
-                    versement['annee_concernee']
-                )
-                display_data.append(row_data)
-            
-            self.populate_treeview(self.tree, display_data)
-            
-        except Exception as e:
-            self.show_error(f"Erreur lors du chargement des versements: {e}")
+            if values['annee_concernee']:
+                values['annee_concernee'] = int(values['annee_concernee'])
+            for field in ('date_from', 'date_to'):
+                if values[field]:
+                    values[field] = datetime.datetime.strptime(values[field], '%Y-%m-%d').date()
+        except ValueError:
+            self.show_error("Filtre invalide! Utilisez une année numérique et des dates YYYY-MM-DD")
+            return
+
+        values['client_name'] = self.client_filter_var.get()
+        self.filters = values
+        self.rows = []
+        self.load_data()
+
+    def reset_filters(self):
+        """Clear every filter and reload the first page"""
+        for entry in self.filter_entries.values():
+            entry.delete(0, "end")
+        self.client_filter_var.set(self.all_clients)
+        self.apply_filters()
+
+    def resolve_filters(self):
+        """Translate the client filter label to an id (runs in the background)"""
+        filters = dict(self.filters)
+        client_name = filters.pop('client_name', None)
+        if client_name and client_name != self.all_clients:
+            filters['client_id'] = self.client_controller.get_client_id_by_name(client_name)
+            if not filters['client_id']:
+                raise ValueError("Veuillez sélectionner un client valide.")
+        return filters
+
+    @staticmethod
+    def format_versement_row(versement):
+        """Format a versement row for display"""
+        return (versement.id, (
+            versement.id,
+            versement.client_name,
+            f"{versement.montant:.2f}",
+            versement.type,
+            versement.date_paiement.strftime('%Y-%m-%d') if versement.date_paiement else '',
+            versement.annee_concernee
+        ))
+
+    @staticmethod
+    def fetch_first_page(controller):
+        """
+        Query the unfiltered first page shown when the view opens (runs in the background)
+
+        Returns:
+            tuple: (watermark, versements); see load_data
+        """
+        watermark = controller.get_sync_watermark()
+        return watermark, controller.get_versements_page({}, None, UI_CONFIG['page_size'])
+
+    def load_data(self, prefetched=None):
+        """
+        Load the first page of versements, or reload the pages already shown
+
+        Args:
+            prefetched (tuple): Result of fetch_first_page(), shown instead of
+                querying again
+        """
+        # No further pages until this load is applied
+        self.has_more = False
+        if self.more_task is not None:
+            self.more_task.cancel()
+            self.more_task = None
+
+        # Reloading keeps as many rows as are displayed so the position is kept
+        limit = max(UI_CONFIG['page_size'], len(self.rows))
+
+        def fetch():
+            # Changes are polled from the server time before the query
+            watermark = self.controller.get_sync_watermark()
+            return watermark, self.controller.get_versements_page(self.resolve_filters(), None, limit)
+
+        def apply(result):
+            self.sync_watermark, versements = result
+            self.show_page(versements, limit, append=False)
+
+        if prefetched is not None:
+            apply(prefetched)
+            return
+
+        self.tasks.submit(
+            fetch,
+            on_success=apply,
+            on_error=lambda e: self.show_error(f"Erreur lors du chargement des versements: {e}"),
+            key='load'
+        )
+
+    def load_more(self):
+        """Load the next page after the last displayed versement"""
+        if not self.has_more or self.more_task is not None:
+            return
+
+        limit = UI_CONFIG['page_size']
+        after = self.last_versement
+
+        def fetch():
+            return self.controller.get_versements_page(self.resolve_filters(), after, limit)
+
+        def apply(versements):
+            self.more_task = None
+            self.show_page(versements, limit, append=True)
+
+        def on_error(error):
+            self.more_task = None
+            self.show_error(f"Erreur lors du chargement des versements: {error}")
+
+        self.more_task = self.tasks.submit(fetch, on_success=apply, on_error=on_error, key='more')
+
+    def show_page(self, versements, limit, append):
+        """Display a fetched page"""
+        rows = [self.format_versement_row(versement) for versement in versements]
+        self.rows = self.rows + rows if append else rows
+        if versements:
+            self.last_versement = versements[-1]
+        elif not append:
+            self.last_versement = None
+        self.has_more = len(versements) == limit
+        self.populate_treeview(self.tree, self.rows)
+
+    def fetch_changes(self, since):
+        """Return the versements matching the filters changed since a watermark (runs in the background)"""
+        return self.controller.get_versement_changes(since, self.resolve_filters())
+
+    def apply_changes(self, changes):
+        """
+        Merge the versements changed or deleted by other users into the list
+
+        Changed rows replace the displayed ones and new rows are inserted in
+        date order, unless they fall after the last loaded page.
+        """
+        rows = {iid: values for iid, values in self.rows}
+        for versement_id in changes['deleted']:
+            rows.pop(versement_id, None)
+
+        last = self.last_versement
+        for versement in changes['changed']:
+            beyond_loaded = (self.has_more and last is not None
+                             and (versement.date_paiement, versement.id) < (last.date_paiement, last.id))
+            if versement.id in rows or not beyond_loaded:
+                iid, values = self.format_versement_row(versement)
+                rows[iid] = values
+
+        # Newest first, as (date_paiement, id) descending
+        self.rows = sorted(rows.items(), key=lambda row: (row[1][4], row[0]), reverse=True)
+        self.populate_treeview(self.tree, self.rows)
+
+    def on_tree_scroll(self, scrollbar, first, last):
+        """Update the scrollbar and fetch the next page near the bottom"""
+        scrollbar.set(first, last)
+        if float(last) >= 0.9:
+            self.load_more()
 
     def add_versement(self):
         """Open form to add new versement"""
+        from utilities.form_builder import FormBuilder
         FormBuilder.versement_form(
             self.parent, "Ajouter Versement", self.controller, 
             self.client_controller, self.on_form_success
@@ -78,14 +268,13 @@ class VersementView(BaseView):
 
     def edit_versement(self):
         """Open form to edit selected versement"""
-        if not self.selected_item:
+        from utilities.form_builder import FormBuilder
+
+        if self.selected_id is None:
             self.show_warning("Veuillez sélectionner un versement à modifier.")
             return
-            
-        try:
-            versement_id = self.selected_item[0]
-            versement_data = self.controller.get_versement_by_id(versement_id)
-            
+
+        def open_form(versement_data):
             if versement_data:
                 FormBuilder.versement_form(
                     self.parent, f"Modifier Versement pour {versement_data['nom']} {versement_data['prenom']}", 
@@ -94,25 +283,34 @@ class VersementView(BaseView):
                 )
             else:
                 self.show_error("Versement non trouvé.")
-                
-        except Exception as e:
-            self.show_error(f"Erreur lors de la modification: {e}")
+
+        self.tasks.submit(
+            self.controller.get_versement_by_id, self.selected_id,
+            on_success=open_form,
+            on_error=lambda e: self.show_error(f"Erreur lors de la modification: {e}")
+        )
 
     def delete_versement(self):
         """Delete selected versement"""
-        if not self.selected_item:
+        if self.selected_id is None:
             self.show_warning("Veuillez sélectionner un versement à supprimer.")
             return
             
         if self.confirm_action("Voulez-vous vraiment supprimer ce versement ?"):
-            try:
-                versement_id = self.selected_item[0]
-                self.controller.delete_versement(versement_id)
+            def on_deleted(result):
+                self.selected_id = None
+                self.selected_item = None
                 self.load_data()
-                self.show_info("Versement supprimé avec succès.")
-                
-            except Exception as e:
-                self.show_error(f"Erreur lors de la suppression: {e}")
+                if isinstance(result, QueuedOperation):
+                    self.show_info(QUEUED_MESSAGE)
+                else:
+                    self.show_info("Versement supprimé avec succès.")
+
+            self.tasks.submit(
+                self.controller.delete_versement, self.selected_id,
+                on_success=on_deleted,
+                on_error=lambda e: self.show_error(f"Erreur lors de la suppression: {e}")
+            )
 
     def on_form_success(self):
         """Callback for successful form submission"""
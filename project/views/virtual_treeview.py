@@ -0,0 +1,388 @@
+"""
+Virtualized treeview for large result sets
+"""
+
+from bisect import bisect_left
+from collections import OrderedDict
+from tkinter import ttk
+from config import UI_CONFIG
+
+# Prefix of the iids of the rows shown while their page is being fetched
+PLACEHOLDER = "loading-"
+
+
+def _longest_increasing(sequence):
+    """Return the positions of a longest strictly increasing subsequence"""
+    tails = []
+    tail_positions = []
+    previous = [None] * len(sequence)
+    for position, value in enumerate(sequence):
+        slot = bisect_left(tails, value)
+        if slot == len(tails):
+            tails.append(value)
+            tail_positions.append(position)
+        else:
+            tails[slot] = value
+            tail_positions[slot] = position
+        previous[position] = tail_positions[slot - 1] if slot else None
+
+    result = []
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        result.append(position)
+        position = previous[position]
+    return result[::-1]
+
+
+def apply_rows(tree, rows, displayed):
+    """
+    Make a treeview show the given rows with as few Tk operations as possible
+
+    Rows that are gone are deleted, and among the rows that stay the longest
+    run already in the right order is left in place: only the other rows are
+    moved, so moving one row costs one move. New rows are inserted and rows
+    whose values or tag changed are updated.
+
+    Args:
+        tree (ttk.Treeview): Flat treeview
+        rows (list): (iid, values, tag) in display order
+        displayed (dict): iid -> (values, tag) of the displayed rows, updated
+            in place
+    """
+    new_ids = {iid for iid, _, _ in rows}
+    order = list(tree.get_children())
+    stale = [iid for iid in order if iid not in new_ids]
+    if stale:
+        tree.delete(*stale)
+        for iid in stale:
+            displayed.pop(iid, None)
+        order = [iid for iid in order if iid in new_ids]
+
+    position = {iid: index for index, iid in enumerate(order)}
+    kept = [iid for iid, _, _ in rows if iid in position]
+    in_place = {kept[index] for index in _longest_increasing([position[iid] for iid in kept])}
+
+    # From the last row up, put every other row right before its successor
+    following = None
+    for iid, values, tag in reversed(rows):
+        if iid not in position:
+            index = order.index(following) if following is not None else len(order)
+            tree.insert('', index, iid=iid, values=values, tags=(tag,))
+            order.insert(index, iid)
+        else:
+            if iid not in in_place:
+                order.remove(iid)
+                index = order.index(following) if following is not None else len(order)
+                tree.move(iid, '', index)
+                order.insert(index, iid)
+            if displayed.get(iid) != (values, tag):
+                tree.item(iid, values=values, tags=(tag,))
+        displayed[iid] = (values, tag)
+        following = iid
+
+
+class VirtualTreeview:
+    """
+    Treeview that only holds the visible window of a large result set
+
+    Rows are requested from a page loader as the user scrolls. Consecutive
+    pages are fetched by keyset (the last row of the previous page), random
+    jumps with the scrollbar fall back to an offset. Loaded pages are kept in
+    a small LRU cache covering the visible window plus a prefetch margin.
+
+    Pages are fetched in the background through a ViewTaskRunner; rows of a
+    page that has not arrived yet are shown as "Chargement..." placeholders
+    and replaced when it does.
+    """
+
+    def __init__(self, parent, columns, tasks, page_size=100, prefetch_pages=1, on_error=None):
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self.row_height = UI_CONFIG['row_height']
+        self.columns = columns
+        self.tasks = tasks
+        self.on_error = on_error
+
+        self.frame = ttk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings")
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.total = 0
+        self.top = 0
+        self.visible = 1
+        self.fetch_page = None
+        self.format_row = None
+        self.sort_key = None
+        self.pages = OrderedDict()
+        self.anchors = {}
+        self.selected_iid = None
+        self.displayed = {}
+        # Pages being fetched, and cached pages kept on screen until refetched
+        self.pending = {}
+        self.stale = set()
+        # Results of fetches started before the last load or refresh are dropped
+        self.generation = 0
+
+        self.tree.bind('<Configure>', self.on_resize)
+        self.tree.bind('<MouseWheel>', self.on_mousewheel)
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(3))
+        self.tree.bind('<Down>', lambda event: self.on_arrow(1))
+        self.tree.bind('<Up>', lambda event: self.on_arrow(-1))
+        self.tree.bind('<Next>', lambda event: self.scroll(self.visible) or "break")
+        self.tree.bind('<Prior>', lambda event: self.scroll(-self.visible) or "break")
+        self.tree.bind('<<TreeviewSelect>>', self.on_select, add="+")
+
+    def pack(self, **kwargs):
+        """Pack the container frame"""
+        self.frame.pack(**kwargs)
+
+    def load(self, total, fetch_page, format_row, first_page=None, sort_key=None):
+        """
+        Reset the view on a new result set
+
+        Args:
+            total (int): Number of rows in the result set
+            fetch_page (callable): fetch_page(after, offset, limit) returning
+                a list of rows; ``after`` is the last row of the previous page
+                when it is known, so the loader can continue by keyset
+            format_row (callable): format_row(row) returning (iid, values)
+            first_page (list): Rows of the first page, if already fetched
+            sort_key (callable): sort_key(row) returning the values the rows
+                are ordered by, so update_rows() can tell when a row moved
+        """
+        self.total = total
+        self.fetch_page = fetch_page
+        self.format_row = format_row
+        self.sort_key = sort_key
+        self.reset()
+        self.pages.clear()
+        self.top = 0
+        if first_page is not None:
+            self.pages[0] = first_page
+            if first_page:
+                self.anchors[0] = first_page[-1]
+        self.render()
+
+    def refresh(self, total=None):
+        """
+        Reload the current window from the database, with a new row count if given
+
+        The rows on screen stay until their pages have been fetched again.
+        """
+        if total is not None:
+            self.total = total
+        self.reset()
+        first, last = self.window_pages()
+        self.pages = OrderedDict((index, rows) for index, rows in self.pages.items() if first <= index <= last)
+        self.stale = set(self.pages)
+        self.render()
+
+    def reset(self):
+        """Forget the fetches in progress and the keyset anchors"""
+        self.generation += 1
+        for task in self.pending.values():
+            task.cancel()
+        self.pending.clear()
+        self.stale.clear()
+        self.anchors.clear()
+
+    def window_pages(self):
+        """Return the first and last page of the visible window plus the prefetch margin"""
+        margin = self.prefetch_pages * self.page_size
+        start = max(self.top - margin, 0)
+        end = max(min(self.top + self.visible + margin, self.total) - 1, 0)
+        return start // self.page_size, end // self.page_size
+
+    def update_rows(self, rows):
+        """
+        Replace cached rows by the given rows with the same iid and redraw
+
+        When the sort key of a row changed it belongs elsewhere in the order,
+        and the window is fetched again instead.
+
+        Returns:
+            set: iids of the given rows that were cached
+        """
+        if self.format_row is None:
+            return set()
+        by_iid = {self.format_row(row)[0]: row for row in rows}
+        found = set()
+        moved = False
+        for page in self.pages.values():
+            for position, row in enumerate(page):
+                iid = self.format_row(row)[0]
+                if iid in by_iid:
+                    changed = by_iid[iid]
+                    if self.sort_key is not None and self.sort_key(changed) != self.sort_key(row):
+                        moved = True
+                    page[position] = changed
+                    found.add(iid)
+        if moved:
+            self.refresh()
+        elif found:
+            self.render()
+        return found
+
+    def cached_iids(self):
+        """Return the iids of the cached rows"""
+        return {self.format_row(row)[0] for page in self.pages.values() for row in page}
+
+    def get_page(self, index):
+        """Return the rows of a page, or None and fetch it in the background if it is not cached"""
+        if index in self.pages and index not in self.stale:
+            self.pages.move_to_end(index)
+            return self.pages[index]
+
+        if index not in self.pending:
+            generation = self.generation
+            self.pending[index] = self.tasks.submit(
+                self.fetch_page, self.anchors.get(index - 1), index * self.page_size, self.page_size,
+                on_success=lambda rows: self.on_page(generation, index, rows),
+                on_error=lambda error: self.on_page_error(generation, index, error)
+            )
+        # A stale page is shown until it has been fetched again
+        return self.pages.get(index)
+
+    def on_page(self, generation, index, rows):
+        """Store a fetched page and redraw if it is on screen"""
+        if generation != self.generation:
+            return
+        self.pending.pop(index, None)
+        self.stale.discard(index)
+        if rows:
+            self.anchors[index] = rows[-1]
+        self.pages[index] = rows
+
+        # Keep the visible pages plus the prefetch margin on each side
+        max_pages = self.visible // self.page_size + 2 + 2 * self.prefetch_pages
+        first, last = self.window_pages()
+        for cached in list(self.pages):
+            if len(self.pages) <= max_pages:
+                break
+            if not first <= cached <= last:
+                del self.pages[cached]
+
+        top_page = self.top // self.page_size
+        bottom_page = max(self.top + self.visible - 1, 0) // self.page_size
+        if top_page <= index <= bottom_page:
+            self.render()
+
+    def on_page_error(self, generation, index, error):
+        """Forget a failed fetch; the page is requested again at the next render"""
+        if generation != self.generation:
+            return
+        self.pending.pop(index, None)
+        if self.on_error:
+            self.on_error(error)
+
+    def rows(self, start, end):
+        """
+        Return rows [start, end) of the result set
+
+        Returns:
+            list: Rows, None for each row whose page is still being fetched
+        """
+        result = []
+        for index in range(start // self.page_size, (end - 1) // self.page_size + 1):
+            page = self.get_page(index)
+            first = index * self.page_size
+            count = min(end, first + self.page_size) - max(start, first)
+            if page is None:
+                result.extend([None] * count)
+            else:
+                chunk = page[max(start - first, 0):max(end - first, 0)]
+                result.extend(chunk + [None] * (count - len(chunk)) if len(chunk) < count else chunk)
+        return result
+
+    def render(self):
+        """Show the rows of the current window"""
+        if self.fetch_page is None:
+            return
+
+        self.top = max(0, min(self.top, self.total - self.visible))
+        end = min(self.top + self.visible, self.total)
+
+        rows = self.rows(self.top, end) if end > self.top else []
+
+        # Prefetch the margin so scrolling stays local
+        if self.total:
+            first, last = self.window_pages()
+            self.get_page(last)
+            self.get_page(first)
+
+        window = []
+        for i, row in enumerate(rows):
+            if row is None:
+                iid, values = f"{PLACEHOLDER}{self.top + i}", ("Chargement...",) + ("",) * (len(self.columns) - 1)
+            else:
+                iid, values = self.format_row(row)
+            tag = 'evenrow' if (self.top + i) % 2 == 0 else 'oddrow'
+            window.append((str(iid), tuple(values), tag))
+        apply_rows(self.tree, window, self.displayed)
+
+        if self.selected_iid is not None and self.tree.exists(self.selected_iid):
+            self.tree.selection_set(self.selected_iid)
+
+        if self.total:
+            self.scrollbar.set(self.top / self.total, end / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, rows):
+        """Scroll the window by a number of rows"""
+        top = max(0, min(self.top + rows, self.total - self.visible))
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def on_scrollbar(self, action, value, unit=None):
+        """Handle scrollbar drags and clicks"""
+        if action == "moveto":
+            self.top = int(float(value) * self.total)
+            self.render()
+        elif action == "scroll":
+            step = self.visible if unit == "pages" else 1
+            self.scroll(int(value) * step)
+
+    def on_mousewheel(self, event):
+        """Handle mouse wheel scrolling"""
+        self.scroll(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def on_arrow(self, direction):
+        """Scroll when the keyboard selection leaves the visible window"""
+        children = self.tree.get_children()
+        focus = self.tree.focus()
+        if not children or focus not in children:
+            return None
+        position = children.index(focus)
+        if (direction > 0 and position == len(children) - 1) or (direction < 0 and position == 0):
+            self.scroll(direction)
+            children = self.tree.get_children()
+            if children:
+                target = children[-1] if direction > 0 else children[0]
+                self.tree.focus(target)
+                self.tree.selection_set(target)
+            return "break"
+        return None
+
+    def on_resize(self, event):
+        """Recompute how many rows fit in the widget"""
+        visible = max(1, event.height // self.row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.render()
+
+    def on_select(self, event):
+        """Remember the selected row so it survives re-rendering"""
+        selected = self.tree.selection()
+        placeholders = [iid for iid in selected if iid.startswith(PLACEHOLDER)]
+        if placeholders:
+            # Handlers bound after this one see only real rows
+            self.tree.selection_remove(*placeholders)
+            selected = self.tree.selection()
+        if selected:
+            self.selected_iid = selected[0]